@@ -0,0 +1,579 @@
+#!/usr/bin/env python2.7
+
+"""
+Benchmarks for the filesystem-heavy parts of the bento scripts.
+
+Generates a synthetic bento box and set of Kiji checkouts in a temp directory, puts stub versions
+of mvn, jps and tar on the PATH, and then times the JAR scanning, linking and copying code paths.
+Results (wall-clock timings, counts of os-level calls and peak memory) are written out as JSON so
+that runs can be compared with one another.
+
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+try:
+  import __builtin__ as builtins
+except ImportError:
+  import builtins
+
+import bento_reboot
+import link_redundant_jars
+import make_cassandra_bento
+import workspace
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script builds a synthetic bento box + Kiji checkouts and benchmarks the JAR scanning, linking
+and copying code paths against it.  Results are written as JSON.  Use --compare to print the
+difference between this run and an earlier JSON file.
+"""
+
+# Name of the synthetic bento box (must match bento_reboot.p_bento).
+bento_name = 'albacore'
+bento_version = '1.0.0'
+
+# Version of the Kiji JARs in the synthetic bento box and the local builds.
+bento_kiji_version = '1.0.0'
+local_kiji_version = '1.1.0'
+
+# Functions in the os module whose calls we count during each operation.  These are the calls that
+# turn into syscalls for the code under test (os.walk, os.path.isdir, etc. go through them).
+counted_os_functions = [
+    'listdir',
+    'scandir',
+    'stat',
+    'lstat',
+    'open',
+    'rename',
+    'symlink',
+    'remove',
+    'unlink',
+    'mkdir',
+    'readlink',
+]
+
+stub_mvn = """#!/bin/sh
+echo "[INFO] Scanning for projects..."
+echo "[INFO] --- maven-dependency-plugin:2.8:build-classpath (default-cli) @ $(basename "$PWD") ---"
+echo "[INFO] Dependencies classpath:"
+cat "$BENCH_CLASSPATH_FILE"
+echo ""
+echo "[INFO] BUILD SUCCESS"
+"""
+
+# Checkouts are laid out so that each module's artifactId is the name of its directory.
+pom_template = """<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>org.kiji.bench</groupId>
+  <artifactId>%s</artifactId>
+  <version>%s-SNAPSHOT</version>
+</project>
+"""
+
+stub_jps = """#!/bin/sh
+echo "4242 Jps"
+"""
+
+stub_tar = """#!/bin/sh
+exit 0
+"""
+
+
+class _OsCallCounter(object):
+  """ Context manager that counts calls to some of the functions in the os module. """
+
+  def __init__(self):
+    super(_OsCallCounter, self).__init__()
+    self.counts = {}
+    self._originals = {}
+
+  def _wrap(self, name, func):
+    counts = self.counts
+
+    def wrapper(*args, **kwargs):
+      counts[name] = counts.get(name, 0) + 1
+      return func(*args, **kwargs)
+
+    return wrapper
+
+  def __enter__(self):
+    for name in counted_os_functions:
+      if not hasattr(os, name):
+        continue
+      func = getattr(os, name)
+      self._originals[name] = func
+      setattr(os, name, self._wrap(name, func))
+
+    # shutil.copyfile and friends go through the builtin open().
+    self._builtin_open = builtins.open
+    builtins.open = self._wrap('file_open', self._builtin_open)
+    return self
+
+  def __exit__(self, *exc_info):
+    for (name, func) in self._originals.items():
+      setattr(os, name, func)
+    self._originals = {}
+    builtins.open = self._builtin_open
+    return False
+
+
+class BentoTreeBenchmark(object):
+
+  # Operations that we know how to benchmark.  'update-lib-jars' modifies the bento lib dir, so it
+  # always runs last.
+  possible_operations = [
+      'bento-jars',
+      'local-jar',
+      'symlink-candidates',
+      'update-lib-jars',
+  ]
+
+  def __init__(self):
+    super(BentoTreeBenchmark, self).__init__()
+
+    # Temp directory containing the synthetic tree.
+    self._tree_dir = None
+
+    # Directory containing the stub executables.
+    self._stub_bin = None
+
+    # Bento box directory inside of the synthetic tree.
+    self._bento_dir = None
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '--files',
+        type=int,
+        default=10000,
+        help='Total number of filler files to create in the bento box and checkouts [10000]')
+
+    parser.add_argument(
+        '--files-per-dir',
+        type=int,
+        default=50,
+        help='Number of filler files in each leaf directory [50]')
+
+    parser.add_argument(
+        '--depth',
+        type=int,
+        default=4,
+        help='Depth of the filler directory trees [4]')
+
+    parser.add_argument(
+        '--duplicated-jars',
+        type=int,
+        default=50,
+        help='Number of JARs that appear in more than one bento directory [50]')
+
+    parser.add_argument(
+        '--copies',
+        type=int,
+        default=3,
+        help='Number of bento directories that each duplicated JAR appears in [3]')
+
+    parser.add_argument(
+        '--classpath-jars',
+        type=int,
+        default=200,
+        help='Number of JARs on the classpath returned by the stub mvn [200]')
+
+    parser.add_argument(
+        '-l',
+        '--link-modules',
+        type=str,
+        default='schema,scoring,model-repository',
+        help='CSV of Kiji modules to create checkouts for [schema,scoring,model-repository]')
+
+    parser.add_argument(
+        '--operations',
+        type=str,
+        default=','.join(self.possible_operations),
+        help='CSV of operations to benchmark (%s)' % self.possible_operations)
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Number of times to run each operation [3]')
+
+    parser.add_argument(
+        '--tree-dir',
+        type=str,
+        default=None,
+        help='Directory in which to create the synthetic tree [new temp dir]')
+
+    parser.add_argument(
+        '--keep-tree',
+        action='store_true',
+        default=False,
+        help='Do not delete the synthetic tree when finished')
+
+    parser.add_argument(
+        '--scan-cache',
+        action='store_true',
+        default=False,
+        help='Let the scripts keep a scan cache (see jar_discovery.py), in a new file next to the\n'
+            'tree: the first run of each operation is cold and the repeats are warm [no cache]')
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=str,
+        default=None,
+        help='File to which to write the JSON results [stdout]')
+
+    parser.add_argument(
+        '--compare',
+        type=str,
+        default=None,
+        help='JSON results file from an earlier run to compare against')
+
+    return parser
+
+  def _parse_options(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    self._args = args
+
+    self._link_modules = args.link_modules.split(',')
+
+    self._operations = args.operations.split(',')
+    for operation in self._operations:
+      assert operation in self.possible_operations, \
+        "Operation '%s' is not one of %s" % (operation, self.possible_operations)
+
+    assert args.repeat > 0
+    assert args.depth > 0
+    assert args.files_per_dir > 0
+
+  # ------------------------------------------------------------------------------------------------
+  # Creating the synthetic tree.
+
+  def _write_file(self, path, size=0):
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+      os.makedirs(parent)
+    f = open(path, 'wb')
+    if size:
+      f.write(b'\0' * size)
+    f.close()
+
+  def _write_text(self, path, contents):
+    self._write_file(path)
+    f = open(path, 'w')
+    f.write(contents)
+    f.close()
+
+  def _write_executable(self, path, contents):
+    self._write_text(path, contents)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+  def _filler_dirs(self, root, subdirs, num_files):
+    """
+    Return a list of (directory, number of files) pairs that spread num_files across a tree of
+    depth self._args.depth underneath root.  subdirs is a list of directories (relative to root)
+    to cycle through at the top level, so that we can put filler into, e.g., both src/ and .git/.
+    """
+    num_dirs = int(math.ceil(float(num_files) / self._args.files_per_dir))
+    if num_dirs == 0:
+      return []
+    fanout = max(2, int(math.ceil(num_dirs ** (1.0 / self._args.depth))))
+
+    result = []
+    remaining = num_files
+    for i in range(num_dirs):
+      parts = [subdirs[i % len(subdirs)]]
+      index = i
+      for _ in range(self._args.depth):
+        parts.append('d%d' % (index % fanout))
+        index //= fanout
+      count = min(self._args.files_per_dir, remaining)
+      remaining -= count
+      result.append((os.path.join(root, *parts), count))
+    return result
+
+  def _create_filler(self, root, subdirs, num_files, prefix):
+    for (dirname, count) in self._filler_dirs(root, subdirs, num_files):
+      if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+      for i in range(count):
+        # Mix of file types, so that the JAR regexes have something to reject.
+        suffix = ['.class', '.xml', '.properties', '.jar'][i % 4]
+        self._write_file(os.path.join(dirname, '%s-%d-%d%s' % (prefix, len(dirname), i, suffix)))
+
+  def _create_bento_tree(self, num_files):
+    """ Create a bento box containing the Kiji JARs, duplicated JARs and filler. """
+    bento_dir = os.path.join(self._tree_dir, 'kiji-bento-' + bento_name)
+    lib_dirs = ['lib', 'cluster/lib', 'scoring-server/lib', 'model-repo/lib', 'schema-shell/lib']
+
+    # Kiji JARs for every module, redundantly placed in a few lib dirs.
+    for module in self._link_modules:
+      jar = 'kiji-%s-%s.jar' % (module, bento_kiji_version)
+      for lib_dir in lib_dirs[:self._args.copies]:
+        self._write_file(os.path.join(bento_dir, lib_dir, jar), 1024)
+
+    # JARs that show up in more than one location (for link_redundant_jars).
+    for i in range(self._args.duplicated_jars):
+      jar = 'dup-lib%d-1.0.jar' % i
+      for j in range(self._args.copies):
+        self._write_file(os.path.join(bento_dir, lib_dirs[j % len(lib_dirs)], jar), 512 + i)
+
+    # Stand-ins for the HDFS / HBase / ZooKeeper data directories plus the rest of the bento.
+    self._create_filler(
+        bento_dir, ['cluster/state/hdfs', 'cluster/state/hbase', 'docs', 'examples'],
+        num_files, 'bento')
+
+    return bento_dir
+
+  def _create_checkouts(self, num_files):
+    """ Create one Kiji checkout (with a built JAR in target/) for each link module. """
+    per_checkout = num_files // max(1, len(self._link_modules))
+    for module in self._link_modules:
+      kiji_target = 'kiji-' + module
+      checkout = os.path.join(self._tree_dir, kiji_target)
+      build_dir = os.path.join(checkout, kiji_target)
+      self._write_text(
+          os.path.join(checkout, 'pom.xml'), pom_template % (kiji_target, local_kiji_version))
+      self._write_text(
+          os.path.join(build_dir, 'pom.xml'), pom_template % (kiji_target, local_kiji_version))
+      self._write_file(
+          os.path.join(build_dir, 'target', '%s-%s-SNAPSHOT.jar' % (kiji_target, local_kiji_version)),
+          2048)
+      self._create_filler(checkout, ['.git/objects', kiji_target + '/src'], per_checkout, module)
+
+  def _create_maven_repo(self):
+    """ Create fake JARs in a Maven repo and a file holding their classpath (for the stub mvn). """
+    repo = os.path.join(self._tree_dir, 'm2', 'repository')
+    classpath = []
+    for i in range(self._args.classpath_jars):
+      artifact = 'artifact%d' % i
+      jar = os.path.join(repo, 'org', 'bench', artifact, '1.0', '%s-1.0.jar' % artifact)
+      self._write_file(jar, 256)
+      classpath.append(jar)
+
+    classpath_file = os.path.join(self._tree_dir, 'classpath.txt')
+    f = open(classpath_file, 'w')
+    f.write(':'.join(classpath) + '\n')
+    f.close()
+    return classpath_file
+
+  def _create_stubs(self, classpath_file):
+    self._stub_bin = os.path.join(self._tree_dir, 'stub-bin')
+    self._write_executable(os.path.join(self._stub_bin, 'mvn'), stub_mvn)
+    self._write_executable(os.path.join(self._stub_bin, 'jps'), stub_jps)
+    self._write_executable(os.path.join(self._stub_bin, 'tar'), stub_tar)
+    os.environ['PATH'] = self._stub_bin + os.pathsep + os.environ.get('PATH', '')
+    os.environ['BENCH_CLASSPATH_FILE'] = classpath_file
+
+  def _create_tree(self):
+    if self._args.tree_dir is None:
+      self._tree_dir = tempfile.mkdtemp(prefix='bento-bench-')
+    else:
+      self._tree_dir = os.path.abspath(self._args.tree_dir)
+      assert not os.path.exists(self._tree_dir), \
+          "Refusing to create synthetic tree in existing directory %s" % self._tree_dir
+      os.makedirs(self._tree_dir)
+
+    logging.info("Creating synthetic tree in %s..." % self._tree_dir)
+    start = time.time()
+
+    # Outside of the tree, so that writing it does not change the tree's root directory.
+    self._scan_cache_file = self._tree_dir + '-scan-cache.sqlite' if self._args.scan_cache else None
+
+    # Empty tgz so that the bento dir name can be found by the usual means.
+    self._write_file(os.path.join(
+        self._tree_dir, 'kiji-bento-%s-%s-release.tar.gz' % (bento_name, bento_version)))
+
+    num_bento_files = self._args.files // 2
+    self._bento_dir = self._create_bento_tree(num_bento_files)
+    self._create_checkouts(self._args.files - num_bento_files)
+    self._create_stubs(self._create_maven_repo())
+
+    logging.info("...Done (%.1f seconds)" % (time.time() - start))
+
+  # ------------------------------------------------------------------------------------------------
+  # The operations to benchmark.
+
+  def _make_workspace(self):
+    # A new one for every run, so that nothing that one run found carries over to the next.
+    return workspace.Workspace(self._tree_dir, scan_cache_file=self._scan_cache_file)
+
+  def _make_rebooter(self):
+    rebooter = bento_reboot.BentoRebooter(self._make_workspace())
+    rebooter._root_dir = self._tree_dir
+    rebooter._bento_dir = self._bento_dir
+    rebooter._link_modules = self._link_modules
+    return rebooter
+
+  def _op_bento_jars(self):
+    rebooter = self._make_rebooter()
+    for module in self._link_modules:
+      jars = rebooter._get_bento_jars_for_target('kiji-' + module)
+      assert len(jars) > 0
+
+  def _op_local_jar(self):
+    rebooter = self._make_rebooter()
+    for module in self._link_modules:
+      rebooter._get_locally_built_jar_for_target('kiji-' + module)
+
+  def _op_symlink_candidates(self):
+    linker = link_redundant_jars.RedundantJarLinker()
+    linker._bento_dir = self._bento_dir
+    linker._do_link = False
+    linker._scan_cache_file = self._scan_cache_file
+    old_dir = os.getcwd()
+    os.chdir(self._bento_dir)
+    try:
+      linker._get_symlink_candidates()
+    finally:
+      os.chdir(old_dir)
+
+  def _op_update_lib_jars(self):
+    copier = make_cassandra_bento.JarCopier(self._make_workspace())
+    copier._root_dir = self._tree_dir
+    copier._bento_dir = self._bento_dir
+    copier._link_modules = self._link_modules
+    copier._do_action_update_lib_jars()
+
+  def _run_operation(self, operation):
+    func = getattr(self, '_op_' + operation.replace('-', '_'))
+
+    timings = []
+    counts = None
+
+    # The classpath code prints Maven output, keep it out of our JSON.
+    old_stdout = sys.stdout
+    devnull = open(os.devnull, 'w')
+    try:
+      for _ in range(self._args.repeat):
+        sys.stdout = devnull
+        with _OsCallCounter() as counter:
+          start = time.time()
+          func()
+          timings.append(time.time() - start)
+        sys.stdout = old_stdout
+        if counts is None:
+          counts = counter.counts
+    finally:
+      sys.stdout = old_stdout
+      devnull.close()
+
+    timings_sorted = sorted(timings)
+    return {
+        'seconds': timings,
+        'min_seconds': timings_sorted[0],
+        'median_seconds': timings_sorted[len(timings_sorted) // 2],
+        'os_calls': counts,
+        'total_os_calls': sum(counts.values()),
+        # ru_maxrss is the peak RSS of the process so far (KB on Linux).
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+  # ------------------------------------------------------------------------------------------------
+  # Reporting.
+
+  def _count_tree(self):
+    num_files = 0
+    num_dirs = 0
+    for (_, dirnames, filenames) in os.walk(self._tree_dir):
+      num_dirs += len(dirnames)
+      num_files += len(filenames)
+    return {'files': num_files, 'dirs': num_dirs}
+
+  def _compare(self, results, old_results):
+    """ Print a table comparing the min timings and os call counts of two runs. """
+    lines = ["%-20s %12s %12s %8s %12s %12s" % \
+        ('operation', 'old min (s)', 'new min (s)', 'ratio', 'old calls', 'new calls')]
+    for operation in self.possible_operations:
+      if operation not in results or operation not in old_results:
+        continue
+      old = old_results[operation]
+      new = results[operation]
+      ratio = new['min_seconds'] / old['min_seconds'] if old['min_seconds'] else float('nan')
+      lines.append("%-20s %12.4f %12.4f %8.2f %12d %12d" % (
+          operation, old['min_seconds'], new['min_seconds'], ratio,
+          old['total_os_calls'], new['total_os_calls']))
+    sys.stderr.write('\n'.join(lines) + '\n')
+
+  def go(self, cmd_line_args):
+    self._parse_options(cmd_line_args)
+    self._create_tree()
+
+    try:
+      results = {}
+      for operation in self.possible_operations:
+        if operation not in self._operations:
+          continue
+        logging.info("Benchmarking %s..." % operation)
+        results[operation] = self._run_operation(operation)
+
+      report = {
+          'config': {
+              'files': self._args.files,
+              'files_per_dir': self._args.files_per_dir,
+              'depth': self._args.depth,
+              'duplicated_jars': self._args.duplicated_jars,
+              'copies': self._args.copies,
+              'classpath_jars': self._args.classpath_jars,
+              'link_modules': self._link_modules,
+              'repeat': self._args.repeat,
+          },
+          'tree': self._count_tree(),
+          'python': platform.python_version(),
+          'platform': platform.platform(),
+          'timestamp': time.time(),
+          'results': results,
+      }
+    finally:
+      if self._scan_cache_file is not None and os.path.isfile(self._scan_cache_file):
+        os.remove(self._scan_cache_file)
+      if not self._args.keep_tree:
+        shutil.rmtree(self._tree_dir)
+      else:
+        sys.stderr.write("Synthetic tree left in %s\n" % self._tree_dir)
+
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    if self._args.output is None:
+      print(report_json)
+    else:
+      f = open(self._args.output, 'w')
+      f.write(report_json + '\n')
+      f.close()
+
+    if self._args.compare is not None:
+      f = open(self._args.compare)
+      old_report = json.load(f)
+      f.close()
+      self._compare(results, old_report['results'])
+
+if __name__ == "__main__":
+  foo = BentoTreeBenchmark()
+  foo.go(sys.argv[1:])
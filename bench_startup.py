@@ -0,0 +1,259 @@
+#!/usr/bin/env python2.7
+
+"""
+Benchmark for how long the bento scripts take to start.
+
+The scripts get run from shell loops and git hooks, where starting the interpreter and importing
+everything can take longer than the work itself.  For every script, this times a fresh interpreter
+importing it, and running it with help-actions (or --help), which does nothing but start up.
+
+Where the interpreter has -X importtime (Python 3.7 and up), import times come from that, along with
+the modules that took the longest; elsewhere, we time the whole interpreter and take off the time
+that an empty one takes.  Exits with 1 if any script takes longer than the budget to import, so that
+this can run in CI.
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script times how long each of the bento scripts takes to import (and to print its help) in a
+fresh interpreter, prints the results as JSON, and exits with 1 if any script takes longer to import
+than --budget-ms.
+"""
+
+# Directory with the scripts to measure.
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Scripts to measure, and the arguments that make each of them start up and exit right away.
+startup_commands = [
+    ('bento_buildd.py', ['help-actions']),
+    ('bento_classpath.py', ['--help']),
+    ('bento_instances.py', ['help-actions']),
+    ('bento_pool.py', ['help-actions']),
+    ('bento_reboot.py', ['help-actions']),
+    ('classpath_index.py', ['help-actions', '-b', '.']),
+    ('jar_conflicts.py', ['help-actions']),
+    ('link_redundant_jars.py', ['--help']),
+    ('make_cassandra_bento.py', ['help-actions']),
+    ('run_pmml.py', ['help-actions']),
+]
+
+# How long a script may take to import, on top of an empty interpreter.
+default_budget_ms = 120.0
+
+
+def has_importtime(python):
+  """ Whether this interpreter understands -X importtime. """
+  proc = subprocess.Popen(
+      [python, '-c', 'import sys; print(sys.version_info >= (3, 7))'],
+      stdout=subprocess.PIPE)
+  output = proc.communicate()[0]
+  return output.strip() == b'True'
+
+def parse_importtime(stderr):
+  """
+  Return {module: (self ms, cumulative ms)} from the output of -X importtime, which has lines like
+  'import time:       677 |       5837 |       multiprocessing.process' (in microseconds).
+  """
+  modules = {}
+  for line in stderr.decode('utf-8', 'replace').splitlines():
+    if not line.startswith('import time:'):
+      continue
+    toks = line[len('import time:'):].split('|')
+    if len(toks) != 3 or not toks[0].strip().isdigit():
+      # The header line.
+      continue
+    modules[toks[2].strip()] = (int(toks[0]) / 1000.0, int(toks[1]) / 1000.0)
+  return modules
+
+
+class StartupBenchmark(object):
+
+  def __init__(self):
+    super(StartupBenchmark, self).__init__()
+
+    # Interpreter to measure, and whether it has -X importtime.
+    self._python = None
+    self._b_importtime = False
+
+    # Modules that an empty interpreter imports anyway (with -X importtime).
+    self._startup_modules = set()
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '--python',
+        type=str,
+        default=sys.executable,
+        help='Interpreter to measure [%s]' % sys.executable)
+
+    parser.add_argument(
+        '--scripts',
+        type=str,
+        default=','.join([script for (script, _) in startup_commands]),
+        help='CSV of scripts to measure [all of them]')
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Number of times to start each script (we report the fastest) [5]')
+
+    parser.add_argument(
+        '--budget-ms',
+        type=float,
+        default=default_budget_ms,
+        help='Fail if a script takes longer than this to import [%s]' % default_budget_ms)
+
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=5,
+        help='With -X importtime, how many of the slowest modules to list for each script [5]')
+
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=str,
+        default=None,
+        help='File to which to write the JSON results [stdout]')
+
+    return parser
+
+  def _parse_options(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    self._args = args
+    self._python = args.python
+    self._b_importtime = has_importtime(self._python)
+
+    known_scripts = [script for (script, _) in startup_commands]
+    self._scripts = args.scripts.split(',')
+    for script in self._scripts:
+      assert script in known_scripts, "Script '%s' is not one of %s" % (script, known_scripts)
+
+    assert args.repeat > 0
+
+  # ------------------------------------------------------------------------------------------------
+  # Timing.
+
+  def _time_command(self, argv, b_importtime=False):
+    """ Run the interpreter with these arguments.  Return (wall-clock seconds, its stderr). """
+    cmd = [self._python] + (['-X', 'importtime'] if b_importtime else []) + argv
+    start = time.time()
+    proc = subprocess.Popen(
+        cmd, cwd=scripts_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (_, stderr) = proc.communicate()
+    seconds = time.time() - start
+    assert proc.returncode == 0, \
+        "%s failed:\n%s" % (' '.join(cmd), stderr.decode('utf-8', 'replace'))
+    return (seconds, stderr)
+
+  def _fastest(self, argv, b_importtime=False):
+    """ Run a command --repeat times, and return the (seconds, stderr) of the fastest run. """
+    return min([self._time_command(argv, b_importtime) for _ in range(self._args.repeat)])
+
+  def _measure_import(self, module, baseline_ms):
+    """ How long a fresh interpreter takes to import the module, and (if we can tell) why. """
+    if not self._b_importtime:
+      (seconds, _) = self._fastest(['-c', 'import ' + module])
+      return {'import_ms': round(max(0.0, seconds * 1000.0 - baseline_ms), 1), 'slowest': []}
+
+    runs = [parse_importtime(self._time_command(['-c', 'import ' + module], True)[1])
+        for _ in range(self._args.repeat)]
+    imports = min(runs, key=lambda modules: modules[module][1])
+
+    # The modules that took the longest themselves (without what they imported), not counting the
+    # ones that every interpreter imports at startup.
+    slowest = sorted([(self_ms, name) for (name, (self_ms, _)) in imports.items()
+        if name != module and name not in self._startup_modules], reverse=True)
+    return {
+        'import_ms': round(imports[module][1], 1),
+        'modules': len(imports),
+        'slowest': [[name, round(self_ms, 1)] for (self_ms, name) in slowest[:self._args.top]],
+    }
+
+  def _measure_script(self, script, args, baseline_ms):
+    module = script[:-len('.py')]
+    logging.info("Timing %s..." % script)
+    result = self._measure_import(module, baseline_ms)
+
+    (seconds, _) = self._fastest([script] + args)
+    result['startup_ms'] = round(seconds * 1000.0, 1)
+    result['startup_args'] = args
+    result['over_budget'] = result['import_ms'] > self._args.budget_ms
+    return result
+
+  def go(self, cmd_line_args):
+    self._parse_options(cmd_line_args)
+
+    # Compile everything first, so that no run pays for writing .pyc files.
+    self._time_command(['-m', 'compileall', '-q', scripts_dir])
+
+    # What an empty interpreter takes, and (with -X importtime) what it imports anyway.
+    (seconds, stderr) = self._fastest(['-c', 'pass'], self._b_importtime)
+    baseline_ms = seconds * 1000.0
+    self._startup_modules = set(parse_importtime(stderr).keys())
+
+    results = {}
+    for (script, args) in startup_commands:
+      if script in self._scripts:
+        results[script] = self._measure_script(script, args, baseline_ms)
+
+    report = {
+        'config': {
+            'repeat': self._args.repeat,
+            'budget_ms': self._args.budget_ms,
+            'method': 'importtime' if self._b_importtime else 'wall-clock',
+        },
+        'baseline_ms': round(baseline_ms, 1),
+        'python': self._python,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+    report_json = json.dumps(report, indent=2, sort_keys=True)
+    if self._args.output is None:
+      print(report_json)
+    else:
+      f = open(self._args.output, 'w')
+      f.write(report_json + '\n')
+      f.close()
+
+    over_budget = sorted([script for (script, result) in results.items() if result['over_budget']])
+    for script in over_budget:
+      sys.stderr.write("%s takes %.1f ms to import (budget %.1f ms), slowest modules: %s\n" % (
+          script, results[script]['import_ms'], self._args.budget_ms,
+          ', '.join(['%s (%.1f ms)' % (name, ms) for (name, ms) in results[script]['slowest']])))
+    if len(over_budget) > 0:
+      sys.exit(1)
+
+if __name__ == "__main__":
+  foo = StartupBenchmark()
+  foo.go(sys.argv[1:])
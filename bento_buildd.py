@@ -0,0 +1,491 @@
+#!/usr/bin/env python2.7
+
+"""
+A daemon that serves the classpath, Bento Box and PMML operations over a Unix socket, so that a CI
+job does not start a new Python process (which finds all of the JARs, runs Maven and lists the
+processes again) for every step.
+
+The daemon keeps a Workspace (see workspace.py) for every root directory that it gets asked about,
+so the JAR index, the classpaths from Maven and the process table stay warm between requests.
+Queries (classpath, local-jar, bento-jars, processes, ...) run as soon as they come in, several at
+once.  Operations that change a Bento Box (reboot, copy-jars, pmml) run one at a time for each
+Bento Box, in the order in which they came in; operations on different boxes run side by side.
+
+The protocol is one JSON object per line each way, like JSON-RPC:
+
+  {"id": 1, "method": "local-jar", "params": {"kiji_target": "kiji-schema"}}
+  {"id": 1, "result": "/home/me/src/kiji-schema/kiji-schema/target/kiji-schema-1.4.0-SNAPSHOT.jar"}
+
+A failed request gets {"id": ..., "error": {"type": ..., "message": ...}} instead of a result.  The
+operations that change a Bento Box return the script's result document (see script_output.py), and
+so do their errors.
+
+"""
+
+import argparse
+import collections
+import errno
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+try:
+  import SocketServer as socketserver
+except ImportError:
+  import socketserver
+
+# The scripts that the daemon runs are imported by the methods that run them, so that 'call' (which
+# shell loops and git hooks run over and over) only loads the client.
+import jar_links
+import script_output
+import workspace
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script runs (or talks to) bento-buildd, a daemon that keeps the JAR index, the classpaths from
+Maven and the process table warm, and serves the operations of bento_classpath.py, bento_reboot.py,
+make_cassandra_bento.py and run_pmml.py over a Unix socket.
+"""
+
+default_socket_file = os.path.join(
+    os.path.expanduser('~'), '.cache', 'kiji-build-scripts', 'bento-buildd.sock')
+
+
+class BuilddError(Exception):
+  pass
+
+
+def _read_line(sock):
+  """ Read one line (without the newline) from a socket, or None if it got closed first. """
+  chunks = []
+  while True:
+    chunk = sock.recv(64 * 1024)
+    if not chunk:
+      return None
+    newline = chunk.find(b'\n')
+    if newline != -1:
+      chunks.append(chunk[:newline])
+      return b''.join(chunks)
+    chunks.append(chunk)
+
+
+class BuilddClient(object):
+  """ Sends requests to a running bento-buildd. """
+
+  def __init__(self, socket_file=default_socket_file):
+    super(BuilddClient, self).__init__()
+    self._socket_file = socket_file
+    self._next_id = 0
+
+  def call(self, method, **params):
+    """ Call a method of the daemon and return its result (raise BuilddError if it failed). """
+    self._next_id += 1
+    request = {'id': self._next_id, 'method': method, 'params': params}
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      sock.connect(self._socket_file)
+      sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+      line = _read_line(sock)
+    finally:
+      sock.close()
+
+    assert line is not None, "bento-buildd closed the connection without answering"
+    response = json.loads(line.decode('utf-8'))
+    if 'error' in response:
+      error = response['error']
+      raise BuilddError("%s: %s" % (error['type'], error['message']))
+    return response['result']
+
+
+class _BentoDirQueue(object):
+  """ Runs the operations that change one Bento Box one at a time, in the order they came in. """
+
+  def __init__(self, bento_dir):
+    super(_BentoDirQueue, self).__init__()
+    self._jobs = queue.Queue()
+    thread = threading.Thread(target=self._run_jobs, name='bento-buildd %s' % bento_dir)
+    thread.daemon = True
+    thread.start()
+
+  def _run_jobs(self):
+    while True:
+      (func, done, outcome) = self._jobs.get()
+      try:
+        outcome['result'] = func()
+      except BaseException as e:
+        outcome['error'] = e
+      done.set()
+
+  def run(self, func):
+    """ Wait for our turn, call func, and return what it returns (or raise what it raises). """
+    done = threading.Event()
+    outcome = {}
+    self._jobs.put((func, done, outcome))
+    done.wait()
+    if 'error' in outcome:
+      raise outcome['error']
+    return outcome['result']
+
+
+class BentoBuildd(object):
+  """ What the daemon does for each request (one method per request method). """
+
+  def __init__(self, root_dir, scan_cache_file=workspace.jar_discovery.default_cache_file):
+    super(BentoBuildd, self).__init__()
+    self._root_dir = os.path.abspath(root_dir)
+    self._scan_cache_file = scan_cache_file
+    self._start_time = time.time()
+
+    # Map from root directory to its Workspace, and from Bento directory to its _BentoDirQueue.
+    self._workspaces = {}
+    self._queues = {}
+    self._lock = threading.Lock()
+
+    # Set by the server, so that 'shutdown' can stop it.
+    self.server = None
+
+  def _get_workspace(self, params):
+    root_dir = os.path.abspath(params.get('root_dir', self._root_dir))
+    with self._lock:
+      if root_dir not in self._workspaces:
+        self._workspaces[root_dir] = workspace.Workspace(root_dir, self._scan_cache_file)
+      return self._workspaces[root_dir]
+
+  def _run_queued(self, bento_dir, func):
+    with self._lock:
+      if bento_dir not in self._queues:
+        self._queues[bento_dir] = _BentoDirQueue(bento_dir)
+      bento_queue = self._queues[bento_dir]
+    return bento_queue.run(func)
+
+  def _run_script(self, bento_dir, script_func):
+    """
+    Run a script (after the other operations on the same Bento Box) with its output going into a
+    quiet result document of our own.  Return the script's document.
+    """
+    output = script_output.ScriptOutput(myname)
+    output.b_quiet = True
+
+    def _run():
+      try:
+        output.run(script_func)
+      except Exception as e:
+        e.document = output.document.get('scripts', [output.document])[0]
+        raise
+      return output.document['scripts'][0]
+
+    return self._run_queued(bento_dir, _run)
+
+  def handle(self, request):
+    """ Return the response to a request. """
+    response = collections.OrderedDict([('id', request.get('id'))])
+    method = request.get('method')
+    func = getattr(self, '_rpc_' + str(method).replace('-', '_'), None)
+    start = time.time()
+    try:
+      assert func is not None, "No such method: %s" % method
+      params = request.get('params') or {}
+      # Nothing that a script prints (e.g., Maven's [INFO] lines) should end up in our output.
+      output = script_output.ScriptOutput(myname)
+      output.b_quiet = True
+      result = []
+      output.run(lambda: result.append(func(params)))
+      response['result'] = result[0]
+    except BaseException as e:
+      logging.exception("%s failed" % method)
+      response['error'] = collections.OrderedDict([
+          ('type', type(e).__name__),
+          ('message', str(e)),
+          ('document', getattr(e, 'document', None)),
+      ])
+    logging.info("%s took %.3f seconds" % (method, time.time() - start))
+    return response
+
+  # ----------------------------------------------------------------------------------------------
+  # Queries, which run as soon as they come in.
+
+  def _rpc_ping(self, params):
+    return {'pid': os.getpid(), 'uptime': time.time() - self._start_time}
+
+  def _rpc_classpath(self, params):
+    """
+    build_dirs: the Maven projects whose classpaths we want.  single_reactor: run Maven once for all
+    of them.  remove_kiji (default true): leave out the Kiji JARs, like bento_classpath.py.
+    """
+    ws = self._get_workspace(params)
+    classpaths = ws.get_classpaths(params['build_dirs'], params.get('single_reactor', False))
+    if params.get('remove_kiji', True):
+      import bento_classpath
+      bentocp = bento_classpath.BentoClasspath()
+      classpaths = dict([(d, bentocp.remove_kiji_dependencies(c)) for (d, c) in classpaths.items()])
+    return classpaths
+
+  def _rpc_local_jar(self, params):
+    """ kiji_target: e.g., 'kiji-schema'.  Returns its locally-built JAR. """
+    return self._get_workspace(params).get_local_jar(
+        params['kiji_target'], params.get('other_targets', []))
+
+  def _rpc_bento_jars(self, params):
+    """ bento_dir, kiji_target: returns that target's JARs in the Bento Box. """
+    return sorted(self._get_workspace(params).get_bento_jars(
+        params['bento_dir'], params['kiji_target'], params.get('other_targets', [])))
+
+  def _rpc_processes(self, params):
+    """ directory (optional): returns [pid, name] of the JVMs (running from directory). """
+    return self._get_workspace(params).get_java_processes(params.get('directory'))
+
+  def _rpc_linked_jars(self, params):
+    """ bento_dir: returns the JARs that link-jars or copy-jars put into the Bento Box. """
+    return jar_links.get_linked_jars(params['bento_dir'])
+
+  def _rpc_forget(self, params):
+    """ Forget the local JARs (and the JARs of bento_dir, if given), e.g., after a new checkout. """
+    ws = self._get_workspace(params)
+    ws.forget_local_jars()
+    if 'bento_dir' in params:
+      ws.forget_bento_jars(params['bento_dir'])
+    return True
+
+  # ----------------------------------------------------------------------------------------------
+  # Operations that change a Bento Box, one at a time for each box.
+
+  def _rpc_reboot(self, params):
+    """
+    actions: bento_reboot.py actions.  Also takes the keyword arguments of
+    BentoRebooter.configure() (link_modules, bento_version, instance, port_block, ...).
+    """
+    import bento_reboot
+
+    options = dict([(k, v) for (k, v) in params.items() if k not in ['actions', 'root_dir']])
+    rebooter = bento_reboot.BentoRebooter(self._get_workspace(params))
+    rebooter.configure(params['actions'], **options)
+    return self._run_script(rebooter._bento_dir, rebooter.run)
+
+  def _rpc_copy_jars(self, params):
+    """ args: the command line for make_cassandra_bento.py. """
+    import make_cassandra_bento
+
+    ws = self._get_workspace(params)
+    copier = make_cassandra_bento.JarCopier(ws)
+    copier._parse_options(params['args'] + ['-r', ws.root_dir])
+    return self._run_script(copier._bento_dir, lambda: copier._output.run(copier._run_actions))
+
+  def _rpc_pmml(self, params):
+    """
+    args: the command line for run_pmml.py.  project_dir: the directory that run_pmml.py would run
+    in (its work/ directory goes there).
+    """
+    import run_pmml
+
+    ws = self._get_workspace(params)
+    runner = run_pmml.PmmlRunner(ws, project_dir=params['project_dir'])
+    runner._parse_options(params['args'] + ['-r', ws.root_dir])
+
+    # run_pmml.py works on the one Bento Box in the root directory.
+    bento_dirs = [os.path.join(ws.root_dir, d) for d in os.listdir(ws.root_dir)
+        if d.startswith('kiji-bento-') and os.path.isdir(os.path.join(ws.root_dir, d))]
+    bento_dir = bento_dirs[0] if len(bento_dirs) == 1 else ws.root_dir
+    return self._run_script(bento_dir, lambda: runner._output.run(runner._run_actions))
+
+  def _rpc_lease(self, params):
+    """ Lease a box from the warm pool (see bento_pool.py).  Takes bento_version. """
+    import bento_pool
+
+    pool = bento_pool.BentoPool(
+        self._get_workspace(params).root_dir, bento_version=params.get('bento_version'))
+    return pool.lease()
+
+  def _rpc_return_box(self, params):
+    """ box: the name of a leased box to give back to the pool. """
+    import bento_pool
+
+    pool = bento_pool.BentoPool(self._get_workspace(params).root_dir)
+    pool.return_box(params['box'])
+    return True
+
+  def _rpc_shutdown(self, params):
+    # shutdown() waits for serve_forever() to return, so it cannot run in a request's thread.
+    threading.Thread(target=self.server.shutdown).start()
+    return True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+  """ Answers every request (one JSON object per line) on a connection, in order. """
+
+  def handle(self):
+    for line in self.rfile:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        request = json.loads(line.decode('utf-8'))
+      except ValueError as e:
+        request = None
+        response = {'id': None, 'error': {'type': 'ValueError', 'message': str(e)}}
+      if request is not None:
+        response = self.server.buildd.handle(request)
+      self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+      self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+def serve(buildd, socket_file=default_socket_file):
+  """ Serve requests on socket_file until someone calls 'shutdown'. """
+  if not os.path.isdir(os.path.dirname(socket_file)):
+    os.makedirs(os.path.dirname(socket_file), 0o700)
+
+  if os.path.exists(socket_file):
+    # Left over from a daemon that died, unless something still answers on it.
+    try:
+      BuilddClient(socket_file).call('ping')
+      assert False, "bento-buildd is already running on %s" % socket_file
+    except socket.error as e:
+      if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+        raise
+      os.remove(socket_file)
+
+  # Anyone who can talk to the daemon can run commands as us, so the socket must be ours alone from
+  # the moment bind() creates it (a chmod() afterwards would leave a window).
+  old_umask = os.umask(0o177)
+  try:
+    server = _Server(socket_file, _RequestHandler)
+  finally:
+    os.umask(old_umask)
+  server.buildd = buildd
+  buildd.server = server
+  logging.info("bento-buildd listening on %s" % socket_file)
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    if os.path.exists(socket_file):
+      os.remove(socket_file)
+
+
+class BentoBuilddTool(object):
+
+  # List of commands available to the user.
+  possible_actions = [
+      'help-actions',
+      'serve',
+      'call',
+      'shutdown',
+  ]
+
+  actions_help = {
+      'serve':
+        "Run the daemon in the foreground until it gets a 'shutdown' request.",
+
+      'call':
+        "Send one request (--method, with --params as a JSON object) to the daemon, and print the "
+        "result as JSON.  Exits with 1 if the request failed.",
+
+      'shutdown':
+        "Stop the daemon (it finishes the requests that it is working on first).",
+    }
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        "action",
+        nargs='*',
+        help="Action to take (%s)" % self.possible_actions)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '-r',
+        '--root-dir',
+        type=str,
+        default=os.getcwd(),
+        help='Root directory (containing tgz for bento) for requests that do not give one [pwd]')
+
+    parser.add_argument(
+        '--socket',
+        type=str,
+        default=default_socket_file,
+        help='Unix socket that the daemon listens on [%s]' % default_socket_file)
+
+    parser.add_argument(
+        '--no-scan-cache',
+        action='store_true',
+        default=False,
+        help='Do not remember directory listings between runs (see jar_discovery.py).')
+
+    parser.add_argument(
+        '--method',
+        type=str,
+        default=None,
+        help='For call, the method to call (e.g., "local-jar", "reboot")')
+
+    parser.add_argument(
+        '--params',
+        type=str,
+        default='{}',
+        help='For call, the parameters as a JSON object [{}]')
+
+    return parser
+
+  def _help_actions(self):
+    """ Print detailed information about how the different actions work """
+    actions_str = ""
+    for action in self.possible_actions:
+      if action == 'help-actions': continue
+      actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
+    print(actions_str)
+    sys.exit(0)
+
+  def go(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    for action in args.action:
+      assert action in self.possible_actions, \
+        "Action '%s' is not one of %s" % (action, self.possible_actions)
+
+    if 'help-actions' in args.action: self._help_actions()
+
+    if 'serve' in args.action:
+      scan_cache_file = None if args.no_scan_cache else workspace.jar_discovery.default_cache_file
+      serve(BentoBuildd(args.root_dir, scan_cache_file), args.socket)
+
+    if 'call' in args.action:
+      assert args.method is not None, "Say which method to call with --method"
+      try:
+        result = BuilddClient(args.socket).call(args.method, **json.loads(args.params))
+      except BuilddError as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+      print(json.dumps(result, indent=2))
+
+    if 'shutdown' in args.action:
+      BuilddClient(args.socket).call('shutdown')
+
+if __name__ == "__main__":
+  foo = BentoBuilddTool()
+  foo.go(sys.argv[1:])
@@ -10,22 +10,271 @@ writes out a file that you can source at the command line.
 
 import argparse
 import collections
-import functools
 import logging
 import os
 import re
 import shutil
-import subprocess
 import sys
 
+import command_runner
+import script_output
+
+# intern moved into sys in Python 3.
+try:
+  intern
+except NameError:
+  from sys import intern
+
 myname = os.path.split(sys.argv[0])[-1]
 description = """This script will set up your classpath appropriately."""
 
-def run(cmd):
-  return subprocess.check_output(cmd, shell=True)
+run = command_runner.run
+
+# Maven prints one of these lines when it starts running a goal for a module in the reactor, e.g.:
+# [INFO] --- maven-dependency-plugin:2.8:build-classpath (default-cli) @ kiji-schema ---
+p_maven_goal = re.compile(r'^\[INFO\] --- (?P<plugin>\S+):(?P<goal>[\w-]+) \([^)]*\) @ (?P<artifact>\S+) ---')
+
+# With -Dmdep.outputFile, the dependency plugin writes the classpath to a file and prints this.
+p_maven_wrote_file = re.compile(r"^\[INFO\] Wrote classpath file '(?P<file>.*)'\.")
+
+def _echo_maven_info(line):
+  """ Show the user what Maven is up to while it runs (unless the script is quiet). """
+  if line.startswith('[INFO]'):
+    script_output.echo(line)
+
+def _split_classpath(classpath):
+  """ Turn a classpath string into a list of JARs (an empty classpath has no JARs). """
+  classpath = classpath.strip()
+  if classpath == '':
+    return []
+  return classpath.split(':')
+
+def read_classpath_file(classpath_file):
+  """ Read a classpath written by mvn dependency:build-classpath -Dmdep.outputFile=... """
+  f = open(classpath_file)
+  classpath = f.read()
+  f.close()
+  return _split_classpath(classpath)
+
+def _get_pom_children(element, tag):
+  """ Return the children of a pom.xml element with this tag (ignoring the Maven XML namespace). """
+  # Tags look like '{http://maven.apache.org/POM/4.0.0}artifactId'.
+  return [child for child in element if child.tag.split('}')[-1] == tag]
+
+def get_pom_artifact_id(pom_file):
+  """ Return the artifactId of the project in this pom.xml (not that of its parent). """
+  # The XML parser only gets loaded by the few actions that read pom.xml files themselves.
+  import xml.etree.ElementTree as ElementTree
+
+  root = ElementTree.parse(pom_file).getroot()
+  for child in _get_pom_children(root, 'artifactId'):
+    return child.text.strip()
+  return None
+
+def get_reactor_dirs(build_dir):
+  """
+  Return the directories of all of the projects in the reactor rooted at this directory (the
+  directory itself, its <modules>, their <modules>, and so on).
+  """
+  import xml.etree.ElementTree as ElementTree
+
+  reactor_dirs = set()
+  to_visit = [os.path.abspath(build_dir)]
+  while to_visit:
+    project_dir = to_visit.pop()
+    pom_file = os.path.join(project_dir, 'pom.xml')
+    if project_dir in reactor_dirs or not os.path.isfile(pom_file):
+      continue
+    reactor_dirs.add(project_dir)
+
+    root = ElementTree.parse(pom_file).getroot()
+    for modules in _get_pom_children(root, 'modules'):
+      for module in _get_pom_children(modules, 'module'):
+        to_visit.append(os.path.normpath(os.path.join(project_dir, module.text.strip())))
+  return reactor_dirs
+
+# Pom for a generated reactor that builds projects from several different checkouts.
+aggregator_pom_template = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>org.kiji.bento</groupId>
+  <artifactId>bento-classpath-aggregator</artifactId>
+  <version>1</version>
+  <packaging>pom</packaging>
+  <modules>
+%s
+  </modules>
+</project>
+"""
+
+# Where each module in a reactor build writes its classpath (relative to the module directory).
+reactor_classpath_file = os.path.join('target', 'bento-classpath.txt')
+
+class MavenClasspathParser(object):
+  """
+  Picks the classpaths for each module out of the output of mvn dependency:build-classpath, one
+  line at a time, as Maven prints it.  Works for a single project or for a multi-module reactor
+  (classpaths are keyed by artifactId).
+  """
+
+  def __init__(self, wanted_modules=None):
+    super(MavenClasspathParser, self).__init__()
+
+    # Map from artifactId to a list of JARs, in the order in which Maven got to each module.
+    self.classpaths = collections.OrderedDict()
+
+    # If set, the artifactIds whose classpaths we need (we are done as soon as we have all of them).
+    self._wanted_modules = None if wanted_modules is None else set(wanted_modules)
+
+    # artifactId of the module whose build-classpath goal is running right now.
+    self._current_module = None
+
+    self._b_expect_on_next_line = False
+
+  def feed(self, line):
+    """ Process the next line of Maven output. """
+    if self._b_expect_on_next_line:
+      assert not line.startswith('[INFO]'), line
+      self._add_classpath(_split_classpath(line))
+      self._b_expect_on_next_line = False
+      return
+
+    m_goal = p_maven_goal.match(line)
+    if m_goal:
+      if m_goal.group('goal') == 'build-classpath':
+        self._current_module = m_goal.group('artifact')
+      else:
+        self._current_module = None
+      return
+
+    if line == '[INFO] Dependencies classpath:':
+      # Should be the next line
+      self._b_expect_on_next_line = True
+      return
+
+    m_file = p_maven_wrote_file.match(line)
+    if m_file:
+      self._add_classpath(read_classpath_file(m_file.group('file')))
+
+  def _add_classpath(self, dependencies):
+    # Older versions of Maven may not print the goal line, so make up a name for the module.
+    module = self._current_module
+    if module is None:
+      module = 'module-%d' % len(self.classpaths)
+
+    assert module not in self.classpaths, "Got two classpaths for module %s" % module
+    self.classpaths[module] = dependencies
+    logging.info("Found %d dependencies for %s" % (len(dependencies), module))
+
+  def is_done(self):
+    """ True if we have the classpaths for all of the modules that we wanted. """
+    if self._wanted_modules is None:
+      return False
+    return self._wanted_modules.issubset(self.classpaths.keys())
+
+def get_artifact_coordinate(jar):
+  """
+  Return ((groupId, artifactId, classifier), version) for a JAR in a Maven repository, or None if
+  the JAR is not laid out like one, i.e., not like:
+  .../repository/<groupId dirs>/<artifactId>/<version>/<artifactId>-<version>[-<classifier>].jar
+  """
+  parts = jar.split('/')
+  if len(parts) < 4 or not jar.endswith('.jar'):
+    return None
+
+  (artifact_id, version, jar_name) = parts[-3:]
+  prefix = '%s-%s' % (artifact_id, version)
+  if not jar_name.startswith(prefix):
+    return None
+  classifier = jar_name[len(prefix):-len('.jar')].lstrip('-')
+
+  # Everything between the repository root and the artifactId is the groupId.
+  group_id = None
+  if 'repository' in parts[:-3]:
+    repo_index = len(parts) - 4 - parts[-4::-1].index('repository')
+    group_id = '.'.join(parts[repo_index + 1:-3])
+
+  return ((group_id, artifact_id, classifier), version)
+
+class ClasspathSet(object):
+  """
+  An ordered classpath without duplicates.  A JAR is dropped if the same path is already on the
+  classpath, or if another version of the same Maven artifact is.  The first occurrence always
+  wins, which is how Maven itself resolves version conflicts.
+  """
+
+  def __init__(self, jars=None):
+    super(ClasspathSet, self).__init__()
+
+    # JARs on the classpath, in order.
+    self._jars = []
+    self._jar_set = set()
+
+    # Map from artifact coordinate to the JAR (and version) that we kept for it.
+    self._artifacts = {}
+
+    # JARs that we dropped because the same path was already present.
+    self.duplicates = []
+
+    # (kept JAR, dropped JAR) pairs for different versions of the same artifact.
+    self.conflicts = []
+
+    if jars is not None:
+      self.update(jars)
+
+  def add(self, jar):
+    """ Add a JAR to the end of the classpath, unless we already have it.  Return True if added. """
+    # Lots of the same strings show up in many classpaths, keep only one copy of each.
+    jar = intern(str(jar))
+
+    if jar in self._jar_set:
+      self.duplicates.append(jar)
+      return False
+
+    coordinate = get_artifact_coordinate(jar)
+    if coordinate is not None:
+      (artifact, version) = coordinate
+      if artifact in self._artifacts:
+        (kept_jar, kept_version) = self._artifacts[artifact]
+        if kept_version == version:
+          self.duplicates.append(jar)
+        else:
+          self.conflicts.append((kept_jar, jar))
+        return False
+      self._artifacts[artifact] = (jar, version)
+
+    self._jars.append(jar)
+    self._jar_set.add(jar)
+    return True
+
+  def update(self, jars):
+    for jar in jars:
+      self.add(jar)
+
+  def __iter__(self):
+    return iter(self._jars)
+
+  def __len__(self):
+    return len(self._jars)
+
+  def __contains__(self, jar):
+    return jar in self._jar_set
+
+  def to_classpath(self):
+    return ':'.join(self._jars)
+
+  def log_removed(self):
+    """ Tell the user about the duplicates and version conflicts that we removed. """
+    logging.info("Removed %d duplicate JARs from the classpath." % len(self.duplicates))
+    for (kept_jar, dropped_jar) in self.conflicts:
+      logging.warning("Version conflict: using %s rather than %s" % (kept_jar, dropped_jar))
 
 class BentoClasspath(object):
 
+  def __init__(self):
+    super(BentoClasspath, self).__init__()
+    self._output = script_output.ScriptOutput('bento_classpath.py')
+
   def create_parser(self):
     """ Returns a parser for the script """
 
@@ -59,49 +308,182 @@ class BentoClasspath(object):
         default='KIJI_CLASSPATH',
         help='Name of environment variable to set [KIJI_CLASSPATH]')
 
+    parser.add_argument(
+        '--mdep-output-file',
+        type=str,
+        default=None,
+        help='Have Maven write the classpath to this file (-Dmdep.outputFile) rather than reading\n'
+            'it from the Maven log [None]')
+
+    script_output.add_arguments(parser)
+
     return parser
 
 
-  def get_classpath_from_maven(self):
-    """ Run maven to gather the classpath.  Return as a list of strings. """
-    maven_output = run("mvn dependency:build-classpath")
+  def get_classpaths_from_maven(self, maven_args='', wanted_modules=None, output_file=None):
+    """
+    Run maven to gather the classpaths for all of the modules in the reactor.  Return a map from
+    artifactId to a list of JARs.
 
-    dependencies = None
+    If we know which modules we want, stop Maven as soon as we have their classpaths, rather than
+    waiting for it to get through the rest of the reactor.  If output_file is set, Maven writes each
+    module's classpath to that file (relative paths are relative to each module's directory) and we
+    read it from there instead of picking it out of the log.
+    """
+    parser = MavenClasspathParser(wanted_modules)
 
-    b_expect_on_next_line = False
+    cmd = "mvn dependency:build-classpath"
+    if output_file is not None:
+      cmd += " -Dmdep.outputFile=%s" % output_file
+    if maven_args:
+      cmd += " " + maven_args
 
-    for line in maven_output.splitlines():
-      if line.startswith('[INFO]'):
-        print(line)
+    def _on_maven_line(line):
+      _echo_maven_info(line)
+      parser.feed(line)
+      if parser.is_done() and maven.is_running():
+        logging.info("Got all of the classpaths we need, stopping Maven.")
+        maven.cancel()
 
-      if line == '[INFO] Dependencies classpath:':
-        # Should be the next line
-        assert dependencies == None
-        b_expect_on_next_line = True
+    # Create the command before starting it, since _on_maven_line needs to be able to cancel it.
+    maven = command_runner.Command(cmd, on_stdout=_on_maven_line)
+    maven.start()
+    command_runner.wait_or_die(maven)
 
-      elif b_expect_on_next_line:
-        assert dependencies == None
-        assert not line.startswith('[INFO]')
-        dependencies = line.split(':')
-        print("Found %d dependencies" % len(dependencies))
-        b_expect_on_next_line = False
+    return parser.classpaths
 
-    assert dependencies != None
+  def get_classpath_from_maven(self, output_file=None):
+    """ Run maven to gather the classpath.  Return as a list of strings. """
+
+    # Only the classpath for the project in this directory matters (not those of its submodules).
+    module = get_pom_artifact_id('pom.xml') if os.path.isfile('pom.xml') else None
+    wanted_modules = None if module is None else [module]
+
+    classpaths = self.get_classpaths_from_maven(wanted_modules=wanted_modules, output_file=output_file)
+
+    if module is not None and module in classpaths:
+      dependencies = classpaths[module]
+    elif output_file is not None and os.path.isfile(output_file):
+      # This version of the dependency plugin does not say where it wrote the file.
+      dependencies = read_classpath_file(output_file)
+    else:
+      assert len(classpaths) == 1, \
+          "Expected exactly one classpath from Maven, got %s" % classpaths.keys()
+      dependencies = list(classpaths.values())[0]
+
+    script_output.echo("Found %d dependencies" % len(dependencies))
     return dependencies
 
+  def get_classpath_for_build_dir(self, build_dir):
+    """
+    Run maven on the project in this build directory (without changing directories).  Return its
+    classpath as a list of strings.
+    """
+    pom_file = os.path.join(build_dir, 'pom.xml')
+    module = get_pom_artifact_id(pom_file)
+    classpaths = self.get_classpaths_from_maven(
+        maven_args='-f %s' % pom_file, wanted_modules=[module])
+    if module in classpaths:
+      return classpaths[module]
+    assert len(classpaths) == 1, \
+        "Expected exactly one classpath from Maven for %s, got %s" % (build_dir, classpaths.keys())
+    return list(classpaths.values())[0]
+
+  def _find_common_reactor_root(self, build_dirs):
+    """
+    Return a directory whose pom.xml has all of these build directories somewhere in its reactor,
+    or None if there is not one.
+    """
+    common_dir = os.path.dirname(os.path.commonprefix([d + os.sep for d in build_dirs]))
+    while True:
+      if os.path.isfile(os.path.join(common_dir, 'pom.xml')):
+        if set(build_dirs).issubset(get_reactor_dirs(common_dir)):
+          return common_dir
+      parent_dir = os.path.dirname(common_dir)
+      if parent_dir == common_dir:
+        return None
+      common_dir = parent_dir
+
+  def _write_aggregator_pom(self, build_dirs):
+    """ Write a pom.xml listing all of these build directories as modules.  Return its directory. """
+    import tempfile
+
+    common_dir = os.path.dirname(os.path.commonprefix([d + os.sep for d in build_dirs]))
+    aggregator_dir = tempfile.mkdtemp(prefix='bento-reactor-', dir=common_dir)
+    modules = ['    <module>%s</module>' % os.path.relpath(d, aggregator_dir) for d in build_dirs]
+    f = open(os.path.join(aggregator_dir, 'pom.xml'), 'w')
+    f.write(aggregator_pom_template % '\n'.join(modules))
+    f.close()
+    return aggregator_dir
+
+  def get_classpaths_for_build_dirs(self, build_dirs):
+    """
+    Get the classpaths for the projects in all of these build directories with a single Maven
+    invocation (so that Maven boots and resolves shared parent poms and plugins once, not once per
+    project).  Return a map from build directory to a list of JARs.
+
+    If the projects are all part of one reactor, we run Maven with -pl on just those projects.
+    Otherwise (e.g., they are in different checkouts) we generate an aggregator pom for them.
+    """
+    build_dirs = [os.path.abspath(d) for d in build_dirs]
+    artifact_ids = [get_pom_artifact_id(os.path.join(d, 'pom.xml')) for d in build_dirs]
+    assert len(set(artifact_ids)) == len(artifact_ids), \
+        "Cannot build projects with the same artifactId in one reactor: %s" % artifact_ids
+
+    aggregator_dir = None
+    reactor_root = self._find_common_reactor_root(build_dirs)
+    if reactor_root is None:
+      aggregator_dir = self._write_aggregator_pom(build_dirs)
+      reactor_root = aggregator_dir
+      logging.info("Generated aggregator pom in %s" % aggregator_dir)
+
+    project_list = ','.join([':' + artifact_id for artifact_id in artifact_ids])
+    maven_args = "-f %s -pl %s" % (os.path.join(reactor_root, 'pom.xml'), project_list)
+
+    try:
+      classpaths = self.get_classpaths_from_maven(
+          maven_args=maven_args,
+          wanted_modules=artifact_ids,
+          output_file=reactor_classpath_file)
+    finally:
+      if aggregator_dir is not None:
+        shutil.rmtree(aggregator_dir)
+
+    # Split the results back out by build directory.
+    result = collections.OrderedDict()
+    for (build_dir, artifact_id) in zip(build_dirs, artifact_ids):
+      if artifact_id in classpaths:
+        result[build_dir] = classpaths[artifact_id]
+        continue
+
+      # This version of the dependency plugin does not say where it wrote the file.
+      classpath_file = os.path.join(build_dir, reactor_classpath_file)
+      assert os.path.isfile(classpath_file), \
+          "Maven did not produce a classpath for %s (%s)" % (artifact_id, build_dir)
+      result[build_dir] = read_classpath_file(classpath_file)
+
+    return result
+
   def remove_kiji_dependencies(self, dependencies):
     """ Remove any of the Kiji stuff to avoid CLASSPATH hell... """
     return [dep for dep in dependencies if dep.find('kiji') == -1]
 
   def write_classpath_file(self, ofile, var_name, dependencies):
     """ Write out all of the dependencies to a classpath file """
+    if not isinstance(dependencies, ClasspathSet):
+      dependencies = ClasspathSet(dependencies)
+      dependencies.log_removed()
+
     myfile = open(ofile, 'w')
-    myfile.write('export %s=%s\n' % (var_name, ':'.join(dependencies)))
+    myfile.write('export %s=%s\n' % (var_name, dependencies.to_classpath()))
 
-    for dep in dependencies:
-      myfile.write("# %s\n" % dep)
+    # The JARs one per line, for people to read (quiet scripts report them in their results).
+    if not script_output.is_quiet():
+      for dep in dependencies:
+        myfile.write("# %s\n" % dep)
 
     myfile.close()
+    script_output.add_file('written', ofile)
 
   def create_kiji_mr_lib_directory(self, lib_dir_name, dependencies):
     """ Create a "lib" directory with symlinks to all of the dependencies needed on the cluster. """
@@ -121,6 +503,7 @@ class BentoClasspath(object):
 
       # Create a symlink!
       os.symlink(dep, link)
+    script_output.add_file('written', lib_dir_name)
 
   def go(self, cmd_line_args):
 
@@ -142,13 +525,25 @@ class BentoClasspath(object):
     if args.verbose:
       logging.basicConfig(level=logging.INFO)
 
-    dependencies = self.get_classpath_from_maven()
-    dependencies_without_kiji = self.remove_kiji_dependencies(dependencies)
-    self.write_classpath_file(output_file, env_var, dependencies_without_kiji)
-    print("source '%s' to set up your KIJI_CLASSPATH." % output_file)
-    self.create_kiji_mr_lib_directory(lib_dir_name, dependencies_without_kiji)
-
-    self.dependencies = dependencies_without_kiji
+    self._output.set_options(args)
+
+    def _run():
+      dependencies = self._output.run_action(
+          'get-classpath', self.get_classpath_from_maven, args.mdep_output_file)
+      dependencies_without_kiji = ClasspathSet(self.remove_kiji_dependencies(dependencies))
+      dependencies_without_kiji.log_removed()
+      self._output.run_action(
+          'write-classpath-file',
+          self.write_classpath_file, output_file, env_var, dependencies_without_kiji)
+      script_output.echo("source '%s' to set up your KIJI_CLASSPATH." % output_file)
+      self._output.run_action(
+          'create-lib-dir',
+          self.create_kiji_mr_lib_directory, lib_dir_name, dependencies_without_kiji)
+
+      self.dependencies = dependencies_without_kiji
+      self._output.set_result('classpath', list(dependencies_without_kiji))
+
+    self._output.run(_run)
 
 if __name__ == "__main__":
   foo = BentoClasspath()
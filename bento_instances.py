@@ -0,0 +1,562 @@
+#!/usr/bin/env python2.7
+
+"""
+Runs several Bento Boxes side by side on one machine.
+
+Each instance gets its own directory (<root>/bento-instances/<name>/kiji-bento-...) and its own
+block of ports for ZooKeeper, HBase, HDFS, MapReduce, the scoring server and Cassandra.  The
+provisioning scheduler brings up a bunch of instances concurrently, after checking that all of them
+fit in a memory budget.
+
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+import script_output
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script installs and starts several Bento Boxes side by side, each with its own directory and
+block of ports, so that you can (for example) test against different Bento / Kiji versions at once.
+"""
+
+# Directory (within the root directory) that holds all of the instances.
+instances_dir_name = 'bento-instances'
+
+# File (within each instance directory) describing the instance.
+instance_file_name = 'instance.json'
+
+# The ports that a Bento Box uses out of the box.  Every instance gets its own block of ports, and
+# the nth service here gets the nth port in the block.
+default_ports = collections.OrderedDict([
+    ('zookeeper', 2181),
+    ('hdfs-namenode', 8020),
+    ('hdfs-namenode-http', 50070),
+    ('hdfs-datanode', 50010),
+    ('hdfs-datanode-http', 50075),
+    ('hdfs-datanode-ipc', 50020),
+    ('hdfs-secondary-namenode-http', 50090),
+    ('mapred-jobtracker', 8021),
+    ('mapred-jobtracker-http', 50030),
+    ('mapred-tasktracker-http', 50060),
+    ('hbase-master', 60000),
+    ('hbase-master-http', 60010),
+    ('hbase-regionserver', 60020),
+    ('hbase-regionserver-http', 60030),
+    ('scoring-server', 7080),
+    ('cassandra-storage', 7000),
+    ('cassandra-ssl-storage', 7001),
+    ('cassandra-jmx', 7199),
+    ('cassandra-native', 9042),
+    ('cassandra-thrift', 9160),
+])
+
+# The services that only a Cassandra Bento Box (with a cassandra/ directory, see
+# make_cassandra_bento.py) runs.
+cassandra_services = [service for service in default_ports if service.startswith('cassandra-')]
+
+# First port of block 0, and the number of ports in each block.
+default_port_base = 20000
+port_block_size = 50
+
+# The config properties that hold each service's port: property names in the Hadoop / HBase XML
+# files (<name>...</name><value>...</value>), or keys of 'key=value' and 'key: value' lines
+# (zoo.cfg, cassandra.yaml, cassandra-env.sh).  configure_ports only rewrites the port within these values,
+# so that other numbers that happen to look like a port (timeouts, heap sizes) stay as they are.
+# The scoring server gets its port separately (see _configure_scoring_server_port).
+port_properties = collections.OrderedDict([
+    ('zookeeper', ['hbase.zookeeper.property.clientPort', 'clientPort']),
+    ('hdfs-namenode', ['fs.default.name', 'fs.defaultFS']),
+    ('hdfs-namenode-http', ['dfs.http.address', 'dfs.namenode.http-address']),
+    ('hdfs-datanode', ['dfs.datanode.address']),
+    ('hdfs-datanode-http', ['dfs.datanode.http.address']),
+    ('hdfs-datanode-ipc', ['dfs.datanode.ipc.address']),
+    ('hdfs-secondary-namenode-http',
+        ['dfs.secondary.http.address', 'dfs.namenode.secondary.http-address']),
+    ('mapred-jobtracker', ['mapred.job.tracker']),
+    ('mapred-jobtracker-http', ['mapred.job.tracker.http.address']),
+    ('mapred-tasktracker-http', ['mapred.task.tracker.http.address']),
+    ('hbase-master', ['hbase.master.port']),
+    ('hbase-master-http', ['hbase.master.info.port']),
+    ('hbase-regionserver', ['hbase.regionserver.port']),
+    ('hbase-regionserver-http', ['hbase.regionserver.info.port']),
+    ('cassandra-storage', ['storage_port']),
+    ('cassandra-ssl-storage', ['ssl_storage_port']),
+    ('cassandra-jmx', ['JMX_PORT']),
+    ('cassandra-native', ['native_transport_port']),
+    ('cassandra-thrift', ['rpc_port']),
+])
+
+# Only rewrite ports in config files like these, within directories named 'conf'.
+config_file_extensions = ['.xml', '.properties', '.cfg', '.conf', '.yaml', '.json', '.sh', '.env']
+
+# Default guess at how much memory a running Bento Box needs (HDFS, MapReduce, HBase, ZooKeeper).
+default_memory_per_box_mb = 3072
+
+
+def get_available_memory_mb():
+  """ Return the memory available on this machine (from /proc/meminfo), or None if unknown. """
+  if not os.path.isfile('/proc/meminfo'):
+    return None
+  f = open('/proc/meminfo')
+  meminfo = f.read()
+  f.close()
+  m_available = re.search(r'^MemAvailable:\s+(\d+) kB', meminfo, re.MULTILINE)
+  if not m_available:
+    return None
+  return int(m_available.group(1)) // 1024
+
+def get_box_ports(bento_dir, ports=default_ports):
+  """ The ports (out of a map from service to port) that the services of this Bento Box use. """
+  b_cassandra = os.path.isdir(os.path.join(bento_dir, 'cassandra'))
+  return [port for (service, port) in ports.items()
+      if b_cassandra or service not in cassandra_services]
+
+def get_process_dirs(pid):
+  """ Return the working directory and command line of a process (empty strings if it is gone). """
+  try:
+    cwd = os.readlink('/proc/%s/cwd' % pid)
+  except OSError:
+    cwd = ''
+  try:
+    f = open('/proc/%s/cmdline' % pid)
+    cmdline = f.read().replace('\0', ' ')
+    f.close()
+  except IOError:
+    cmdline = ''
+  return (cwd, cmdline)
+
+
+class BentoInstance(object):
+  """ One of several Bento Boxes installed side by side under the root directory. """
+
+  def __init__(self, root_dir, name, port_block, port_base=default_port_base):
+    super(BentoInstance, self).__init__()
+
+    assert re.match(r'^[\w.-]+$', name), "Bad instance name '%s'" % name
+
+    self.name = name
+    self.port_block = port_block
+    self.root_dir = os.path.abspath(root_dir)
+    self.instance_dir = os.path.join(self.root_dir, instances_dir_name, name)
+
+    # Map from service name to the port that this instance uses for it.
+    block_start = port_base + port_block * port_block_size
+    assert len(default_ports) <= port_block_size
+    self.ports = collections.OrderedDict(
+        [(service, block_start + i) for (i, service) in enumerate(default_ports.keys())])
+
+  @staticmethod
+  def load(root_dir, name):
+    """ Load an instance that was already set up. """
+    instance_file = os.path.join(root_dir, instances_dir_name, name, instance_file_name)
+    f = open(instance_file)
+    info = json.load(f)
+    f.close()
+    return BentoInstance(root_dir, info['name'], info['port_block'], info['port_base'])
+
+  @staticmethod
+  def load_all(root_dir):
+    instances_dir = os.path.join(root_dir, instances_dir_name)
+    if not os.path.isdir(instances_dir):
+      return []
+    return [
+        BentoInstance.load(root_dir, name) for name in sorted(os.listdir(instances_dir))
+        if os.path.isfile(os.path.join(instances_dir, name, instance_file_name))
+    ]
+
+  def get_bento_dir(self, bento_dir_name):
+    return os.path.join(self.instance_dir, bento_dir_name)
+
+  def find_bento_dir(self):
+    """ Return the Bento Box that is installed in this instance (None if there isn't one). """
+    if not os.path.isdir(self.instance_dir):
+      return None
+    bento_dirs = sorted([d for d in os.listdir(self.instance_dir) if d.startswith('kiji-bento-')])
+    if len(bento_dirs) == 0:
+      return None
+    return os.path.join(self.instance_dir, bento_dirs[-1])
+
+  def get_kiji_uri(self, instance='default'):
+    return 'kiji://localhost:%d/%s' % (self.ports['zookeeper'], instance)
+
+  def write_instance_file(self):
+    if not os.path.isdir(self.instance_dir):
+      os.makedirs(self.instance_dir)
+    f = open(os.path.join(self.instance_dir, instance_file_name), 'w')
+    json.dump({
+        'name': self.name,
+        'port_block': self.port_block,
+        'port_base': list(self.ports.values())[0] - self.port_block * port_block_size,
+        'ports': self.ports,
+    }, f, indent=2)
+    f.close()
+
+  def configure_ports(self, bento_dir):
+    """
+    Rewrite the default ports in the config files of a freshly-untarred Bento Box to use this
+    instance's ports.  Only the values of the properties in port_properties get rewritten.
+    """
+    # Property -> (default port, this instance's port).
+    property_ports = {}
+    for (service, properties) in port_properties.items():
+      if service not in self.ports:
+        continue
+      for prop in properties:
+        property_ports[prop] = (str(default_ports[service]), str(self.ports[service]))
+    names = '|'.join([re.escape(prop) for prop in sorted(property_ports.keys())])
+    p_xml_property = re.compile(
+        r'(<name>\s*(%s)\s*</name>\s*<value>)([^<]*)(</value>)' % names)
+    p_line_property = re.compile(
+        r'^(\s*(?:export\s+)?(%s)\s*[=:]\s*)([^\n]*)$' % names, re.MULTILINE)
+
+    def _rewrite_value(m):
+      (default_port, port) = property_ports[m.group(2)]
+      value = re.sub(r'(?<![\d.])%s(?!\d)' % default_port, port, m.group(3))
+      return m.group(1) + value + (m.group(4) if m.lastindex >= 4 else '')
+
+    num_files = 0
+    for (dirpath, _, filenames) in os.walk(bento_dir):
+      if os.path.basename(dirpath) != 'conf':
+        continue
+      for fname in filenames:
+        if os.path.splitext(fname)[1] not in config_file_extensions:
+          continue
+        config_file = os.path.join(dirpath, fname)
+        f = open(config_file)
+        config = f.read()
+        f.close()
+
+        new_config = p_line_property.sub(_rewrite_value, p_xml_property.sub(_rewrite_value, config))
+        if new_config == config:
+          continue
+
+        f = open(config_file, 'w')
+        f.write(new_config)
+        f.close()
+        num_files += 1
+
+    self._configure_scoring_server_port(bento_dir)
+    logging.info("Rewrote ports in %d config files for instance %s" % (num_files, self.name))
+
+  def _configure_scoring_server_port(self, bento_dir):
+    """ The scoring server picks a random port unless configured otherwise, so set one. """
+    config_file = os.path.join(bento_dir, 'scoring-server', 'conf', 'configuration.json')
+    if not os.path.isfile(config_file):
+      return
+    f = open(config_file)
+    config = json.load(f, object_pairs_hook=collections.OrderedDict)
+    f.close()
+    config['port'] = self.ports['scoring-server']
+    f = open(config_file, 'w')
+    json.dump(config, f, indent=2)
+    f.close()
+
+
+def get_instances(root_dir, names=None):
+  """
+  Return the instances with these names, setting up new ones (with the lowest free port blocks) for
+  names that do not exist yet.  Returns all of the existing instances if names is None.
+  """
+  existing = collections.OrderedDict(
+      [(instance.name, instance) for instance in BentoInstance.load_all(root_dir)])
+  if names is None:
+    return list(existing.values())
+
+  # Give new instances the lowest port blocks that nobody is using.
+  used_blocks = set([instance.port_block for instance in existing.values()])
+  instances = []
+  for name in names:
+    if name in existing:
+      instances.append(existing[name])
+      continue
+    port_block = 0
+    while port_block in used_blocks:
+      port_block += 1
+    used_blocks.add(port_block)
+    instances.append(BentoInstance(root_dir, name, port_block))
+  return instances
+
+
+class BentoInstanceProvisioner(object):
+
+  # List of commands available to the user.
+  possible_actions = [
+      'help-actions',
+      'provision',
+      'list',
+      'stop',
+  ]
+
+  actions_help = {
+      'provision':
+        "Install and start --num-instances Bento Boxes (or the ones named with --names) "
+        "concurrently, each in its own directory with its own ports.  Fails up front if the "
+        "memory that they need does not fit in --memory-budget-mb.",
+
+      'list':
+        "List the instances, their directories and their ZooKeeper ports.",
+
+      'stop':
+        "Stop the instances (all of them, or the ones named with --names), killing only processes "
+        "that belong to each instance.",
+    }
+
+  def __init__(self):
+    super(BentoInstanceProvisioner, self).__init__()
+
+    # Per-instance results of the provision action: name -> (ok, seconds, error message).
+    self.results = collections.OrderedDict()
+
+    # What we did, for --format=json (see script_output.py).  Its 'instances' result maps every
+    # instance that we provisioned or listed to what we know about it.
+    self._output = script_output.ScriptOutput('bento_instances.py')
+    self._instance_results = collections.OrderedDict()
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        "action",
+        nargs='*',
+        help="Action to take (%s)" % self.possible_actions)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '-r',
+        '--root-dir',
+        type=str,
+        default=os.getcwd(),
+        help='Root directory (containing tgz for bento) [pwd]')
+
+    parser.add_argument(
+        '-n',
+        '--num-instances',
+        type=int,
+        default=None,
+        help='Number of instances to provision (named box0, box1, ...)')
+
+    parser.add_argument(
+        '--names',
+        type=str,
+        default=None,
+        help='CSV of instance names')
+
+    parser.add_argument(
+        '--bento-version',
+        type=str,
+        default=None,
+        help='Bento version to install (e.g., "1.4.3") [latest tgz in pwd]')
+
+    parser.add_argument(
+        '-l',
+        '--link-modules',
+        type=str,
+        default=None,
+        help='CSV of modules whose JAR files should get symlinked into each instance [None].')
+
+    parser.add_argument(
+        '--memory-budget-mb',
+        type=int,
+        default=None,
+        help='Total memory that the running instances may use [memory available now]')
+
+    parser.add_argument(
+        '--memory-per-box-mb',
+        type=int,
+        default=default_memory_per_box_mb,
+        help='Memory that one running instance needs [%d]' % default_memory_per_box_mb)
+
+    parser.add_argument(
+        '--max-parallel',
+        type=int,
+        default=4,
+        help='Maximum number of instances to install / start at the same time [4]')
+
+    script_output.add_arguments(parser)
+
+    return parser
+
+  def _help_actions(self):
+    """ Print detailed information about how the different actions work """
+    actions_str = ""
+    for action in self.possible_actions:
+      if action == 'help-actions': continue
+      actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
+    print(actions_str)
+    sys.exit(0)
+
+  def _parse_options(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    self._output.set_options(args)
+
+    self._actions = args.action
+    for action in self._actions:
+      assert action in self.possible_actions, \
+        "Action '%s' is not one of %s" % (action, self.possible_actions)
+
+    if 'help-actions' in self._actions: self._help_actions()
+
+    self._root_dir = os.path.abspath(args.root_dir)
+    assert os.path.isdir(self._root_dir)
+
+    if args.names is not None:
+      self._names = args.names.split(',')
+    elif args.num_instances is not None:
+      self._names = ['box%d' % i for i in range(args.num_instances)]
+    else:
+      self._names = None
+
+    self._args = args
+
+  def _set_instance_result(self, name, **values):
+    self._instance_results.setdefault(name, collections.OrderedDict()).update(values)
+    script_output.set_result('instances', self._instance_results)
+
+  def _get_instances(self):
+    """ The instances to act on: the ones named on the command line (new or not), or all of them. """
+    return get_instances(self._root_dir, self._names)
+
+  def provision(
+      self,
+      instances,
+      memory_budget_mb=None,
+      memory_per_box_mb=default_memory_per_box_mb,
+      max_parallel=4,
+      bento_version=None,
+      link_modules=None):
+    """
+    Install and start all of these instances, at most max_parallel at a time.  A failure in one
+    instance does not stop the others.  Returns True if all of them came up.
+
+    The memory budget (memory available now by default) is only a check up front that all of the
+    instances fit in it: a box keeps its memory for as long as it runs, so there is no point in
+    queueing the later boxes for memory that the earlier ones will not give back.
+    """
+    per_box_mb = memory_per_box_mb
+    budget_mb = memory_budget_mb
+    if budget_mb is None:
+      budget_mb = get_available_memory_mb()
+      assert budget_mb is not None, "Cannot tell how much memory is free, use --memory-budget-mb"
+
+    assert len(instances) * per_box_mb <= budget_mb, \
+        "%d instances x %d MB will not fit in a memory budget of %d MB" % \
+            (len(instances), per_box_mb, budget_mb)
+
+    # Imported here to avoid a circular import (bento_reboot uses BentoInstance), and so that the
+    # scripts that only want BentoInstance do not load multiprocessing.
+    import bento_reboot
+    import workspace
+    from multiprocessing.pool import ThreadPool
+
+    # All of the instances share one JAR index (the local builds only get found once).
+    workspaces = {}
+    for instance in instances:
+      if instance.root_dir not in workspaces:
+        workspaces[instance.root_dir] = workspace.Workspace(instance.root_dir)
+
+    def _provision_one(instance):
+      start = time.time()
+      try:
+        instance.write_instance_file()
+        actions = ['install-bento']
+        if link_modules:
+          actions.append('link-jars')
+        actions.append('run-bento')
+        rebooter = bento_reboot.BentoRebooter(workspaces[instance.root_dir])
+        rebooter.configure(
+            actions,
+            link_modules=link_modules.split(',') if link_modules else [],
+            bento_version=bento_version,
+            instance=instance.name,
+            port_block=instance.port_block)
+        rebooter.run()
+        return (instance.name, True, time.time() - start, None)
+      except Exception as e:
+        logging.exception("Failed to provision instance %s" % instance.name)
+        return (instance.name, False, time.time() - start, str(e))
+
+    pool = ThreadPool(max(1, min(max_parallel, len(instances))))
+    try:
+      for (name, ok, seconds, error) in pool.map(script_output.bind(_provision_one), instances):
+        self.results[name] = (ok, seconds, error)
+    finally:
+      pool.close()
+      pool.join()
+
+    for (name, (ok, seconds, error)) in self.results.items():
+      script_output.echo(
+          "%-20s %-8s %6.1fs %s" % (name, 'OK' if ok else 'FAILED', seconds, error or ''))
+      self._set_instance_result(name, ok=ok, seconds=round(seconds, 3), error=error)
+
+    return all([ok for (ok, _, _) in self.results.values()])
+
+  def _do_action_list(self, instances):
+    for instance in instances:
+      script_output.echo("%-20s zookeeper=%-6d %s" % (
+          instance.name, instance.ports['zookeeper'], instance.instance_dir))
+      self._set_instance_result(
+          instance.name, instance_dir=instance.instance_dir, ports=instance.ports)
+
+  def _do_action_stop(self, instances):
+    import bento_reboot
+    import workspace
+    ws = workspace.Workspace(self._root_dir)
+    for instance in instances:
+      rebooter = bento_reboot.BentoRebooter(ws)
+      rebooter.configure(['stop-bento'], instance=instance.name, port_block=instance.port_block)
+      rebooter.run()
+
+  def _do_action_provision(self, instances):
+    assert self._names is not None, "Say which instances to provision with -n or --names"
+    ok = self.provision(
+        instances,
+        memory_budget_mb=self._args.memory_budget_mb,
+        memory_per_box_mb=self._args.memory_per_box_mb,
+        max_parallel=self._args.max_parallel,
+        bento_version=self._args.bento_version,
+        link_modules=self._args.link_modules)
+    if not ok:
+      sys.exit(1)
+
+  def _run_actions(self):
+    run_action = self._output.run_action
+    instances = self._get_instances()
+
+    if 'provision' in self._actions:
+      run_action('provision', self._do_action_provision, instances)
+
+    if 'list' in self._actions:
+      run_action('list', self._do_action_list, instances)
+
+    if 'stop' in self._actions:
+      run_action('stop', self._do_action_stop, instances)
+
+  def go(self, cmd_line_args):
+    self._parse_options(cmd_line_args)
+    self._output.run(self._run_actions)
+
+if __name__ == "__main__":
+  foo = BentoInstanceProvisioner()
+  foo.go(sys.argv[1:])
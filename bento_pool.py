@@ -0,0 +1,467 @@
+#!/usr/bin/env python2.7
+
+"""
+Keeps a pool of Bento Boxes already started, so that integration tests can lease one in seconds
+rather than waiting minutes for install-bento + run-bento.
+
+The pool is a set of instances (see bento_instances.py) named pool0, pool1, ...  Its state lives in
+bento-instances/pool.json, guarded by a lock file, so that several jobs on the same machine can
+lease and return boxes at once.  A returned box gets reset by deleting its Kiji instances; it only
+gets reinstalled if that fails.
+
+"""
+
+import argparse
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+import bento_instances
+import command_runner
+import script_output
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script manages a warm pool of running Bento Boxes.  Fill the pool once, then lease a box for
+each test job and return it afterwards.  lease prints a JSON description of the box (including its
+Kiji URI) on stdout.
+"""
+
+# Files (within the instances directory) with the state of the pool and its metrics.
+pool_file_name = 'pool.json'
+lock_file_name = 'pool.lock'
+metrics_file_name = 'pool-metrics.prom'
+
+# Instances in the pool are called this, followed by a number.
+pool_instance_prefix = 'pool'
+
+# A ready box counts as still running if something listens on the ports of these services.
+running_check_services = ['zookeeper', 'hdfs-namenode', 'hbase-master']
+
+# Keep this many of the most-recent lease latencies for the metrics.
+max_latencies = 1000
+
+# States that a box in the pool can be in.
+state_starting = 'starting'
+state_ready = 'ready'
+state_leased = 'leased'
+state_broken = 'broken'
+
+run = command_runner.run
+
+
+def _get_percentile(values, fraction):
+  if len(values) == 0:
+    return 0.0
+  values = sorted(values)
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class BentoPool(object):
+  """ The pool of Bento Boxes under one root directory. """
+
+  def __init__(
+      self,
+      root_dir,
+      bento_version=None,
+      memory_per_box_mb=bento_instances.default_memory_per_box_mb,
+      memory_budget_mb=None):
+    super(BentoPool, self).__init__()
+
+    self._root_dir = os.path.abspath(root_dir)
+    self._bento_version = bento_version
+    self._memory_per_box_mb = memory_per_box_mb
+    self._memory_budget_mb = memory_budget_mb
+
+    self._instances_dir = os.path.join(self._root_dir, bento_instances.instances_dir_name)
+    self._pool_file = os.path.join(self._instances_dir, pool_file_name)
+    self._metrics_file = os.path.join(self._instances_dir, metrics_file_name)
+
+  @contextlib.contextmanager
+  def _locked_state(self):
+    """ Hold the pool lock, and yield the pool state (written back at the end). """
+    if not os.path.isdir(self._instances_dir):
+      os.makedirs(self._instances_dir)
+    lock_file = open(os.path.join(self._instances_dir, lock_file_name), 'a')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+      state = self._read_state()
+      yield state
+      self._write_state(state)
+    finally:
+      fcntl.flock(lock_file, fcntl.LOCK_UN)
+      lock_file.close()
+
+  def _read_state(self):
+    if not os.path.isfile(self._pool_file):
+      return {
+          'boxes': collections.OrderedDict(),
+          'metrics': {'leases': 0, 'hits': 0, 'misses': 0, 'returns': 0, 'resets_failed': 0},
+          'latencies': [],
+      }
+    f = open(self._pool_file)
+    state = json.load(f, object_pairs_hook=collections.OrderedDict)
+    f.close()
+    return state
+
+  def _write_state(self, state):
+    tmp_file = self._pool_file + '.tmp'
+    f = open(tmp_file, 'w')
+    json.dump(state, f, indent=2)
+    f.close()
+    os.rename(tmp_file, self._pool_file)
+    self._write_metrics(state)
+
+  def _get_names_to_start(self, state, count):
+    """
+    Names for boxes to start: the broken boxes first (reinstalling one reuses its directory and its
+    ports, rather than leaving them to pile up), then new names that are not in the pool already.
+    """
+    names = [name for (name, box) in state['boxes'].items() if box['state'] == state_broken][:count]
+    i = 0
+    while len(names) < count:
+      name = '%s%d' % (pool_instance_prefix, i)
+      if name not in state['boxes']:
+        names.append(name)
+      i += 1
+    return names
+
+  def _provision(self, names):
+    """ Install and start boxes (from scratch).  Returns the names of the ones that came up. """
+    instances = bento_instances.get_instances(self._root_dir, names)
+    provisioner = bento_instances.BentoInstanceProvisioner()
+    provisioner.provision(
+        instances,
+        memory_budget_mb=self._memory_budget_mb,
+        memory_per_box_mb=self._memory_per_box_mb,
+        bento_version=self._bento_version)
+    return [name for (name, (ok, _, _)) in provisioner.results.items() if ok]
+
+  def _reinstall(self, name):
+    """ Start a box over from scratch.  Returns True if it came up. """
+    return len(self._provision([name])) == 1
+
+  def _describe(self, name):
+    """ What a user of a leased box needs to know about it. """
+    instance = bento_instances.BentoInstance.load(self._root_dir, name)
+    return collections.OrderedDict([
+        ('name', name),
+        ('kiji_uri', instance.get_kiji_uri()),
+        ('bento_dir', instance.find_bento_dir()),
+        ('ports', instance.ports),
+    ])
+
+  def fill(self, size):
+    """ Start new boxes until the pool has size boxes (leased or not). """
+    with self._locked_state() as state:
+      num_missing = size - len([b for b in state['boxes'].values() if b['state'] != state_broken])
+      names = self._get_names_to_start(state, max(0, num_missing))
+      # Claim the names now, so that a concurrent fill does not pick them too.
+      for name in names:
+        state['boxes'][name] = {'state': state_starting}
+
+    if len(names) == 0:
+      logging.info("Pool already has %d boxes" % size)
+      return
+
+    logging.info("Starting %d boxes for the pool..." % len(names))
+    started = []
+    try:
+      started = self._provision(names)
+    finally:
+      # Also when provisioning blew up, so that the names do not stay claimed as starting forever.
+      with self._locked_state() as state:
+        for name in names:
+          state['boxes'][name] = {'state': state_ready if name in started else state_broken}
+
+  def _is_box_running(self, name):
+    """ Whether the services of a box still listen on their ports (e.g., after a reboot, not). """
+    import process_terminator
+
+    instance = bento_instances.BentoInstance.load(self._root_dir, name)
+    ports = [instance.ports[service] for service in running_check_services]
+    return len(process_terminator.get_listening_ports(ports)) == len(ports)
+
+  def lease(self):
+    """ Hand out a running box, starting a new one if none are ready.  Returns its description. """
+    start = time.time()
+
+    while True:
+      with self._locked_state() as state:
+        ready = [name for (name, box) in state['boxes'].items() if box['state'] == state_ready]
+        name = ready[0] if len(ready) > 0 else self._get_names_to_start(state, 1)[0]
+        state['boxes'][name] = {'state': state_leased, 'leased_at': time.time()}
+      if len(ready) == 0 or self._is_box_running(name):
+        break
+      # The box died since it was put in the pool, so it needs a reinstall.
+      logging.info("%s is not running any more, marking it broken" % name)
+      with self._locked_state() as state:
+        state['boxes'][name] = {'state': state_broken}
+
+    with self._locked_state() as state:
+      state['metrics']['hits' if len(ready) > 0 else 'misses'] += 1
+
+    if len(ready) == 0:
+      logging.info("No boxes ready in the pool, starting %s..." % name)
+      b_started = False
+      try:
+        b_started = self._reinstall(name)
+      finally:
+        if not b_started:
+          # Give up the lease, so that the box does not stay leased to nobody forever.
+          with self._locked_state() as state:
+            state['boxes'][name] = {'state': state_broken}
+      assert b_started, "Could not start a Bento Box for %s" % name
+
+    with self._locked_state() as state:
+      state['metrics']['leases'] += 1
+      state['latencies'] = (state['latencies'] + [time.time() - start])[-max_latencies:]
+
+    return self._describe(name)
+
+  def _get_kiji_instances(self, name):
+    """ Return the URIs of all of the Kiji instances in a box. """
+    instance = bento_instances.BentoInstance.load(self._root_dir, name)
+    cluster_uri = 'kiji://localhost:%d' % instance.ports['zookeeper']
+    cmd = 'source %s/bin/kiji-env.sh; kiji ls %s' % (instance.find_bento_dir(), cluster_uri)
+    # kiji ls may print the instance URIs with a trailing slash.
+    p_instance = re.compile(r'^(%s/[\w]+)/?$' % re.escape(cluster_uri))
+    matches = [p_instance.match(line.strip()) for line in run(cmd).splitlines()]
+    return [m.group(1) for m in matches if m is not None]
+
+  def _reset(self, name):
+    """ Delete every Kiji instance in a box.  Much cheaper than reinstalling it. """
+    instance = bento_instances.BentoInstance.load(self._root_dir, name)
+    bento_dir = instance.find_bento_dir()
+    kiji_uris = self._get_kiji_instances(name)
+    # A box that was leased should have some Kiji instance in it.  Finding none more likely means
+    # that we could not make sense of the listing than that the box is clean, and reinstalling is
+    # the safe side of that (return_box does it when this fails).
+    assert len(kiji_uris) > 0, "Found no Kiji instances in %s" % name
+    logging.info("Resetting %s: deleting %d Kiji instances" % (name, len(kiji_uris)))
+    command_runner.run_all([
+        'source %s/bin/kiji-env.sh; kiji delete --target=%s --interactive=false' % (bento_dir, uri)
+        for uri in kiji_uris
+    ])
+
+  def return_box(self, name):
+    """ Take back a leased box, reset it, and make it ready for the next lease. """
+    with self._locked_state() as state:
+      assert name in state['boxes'], "%s is not in the pool" % name
+      assert state['boxes'][name]['state'] == state_leased, "%s is not leased" % name
+
+    new_state = state_broken
+    try:
+      try:
+        self._reset(name)
+        new_state = state_ready
+      except Exception:
+        logging.exception("Could not reset %s, reinstalling it" % name)
+        new_state = state_ready if self._reinstall(name) else state_broken
+    finally:
+      # Even if the reinstall blew up, so that the box does not stay leased forever.
+      with self._locked_state() as state:
+        state['boxes'][name] = {'state': new_state}
+        state['metrics']['returns'] += 1
+        if new_state != state_ready:
+          state['metrics']['resets_failed'] += 1
+
+  def get_metrics(self):
+    """ Return the pool metrics in Prometheus text format. """
+    return self._format_metrics(self._read_state())
+
+  def _format_metrics(self, state):
+    metrics = state['metrics']
+    latencies = state['latencies']
+    num_in_state = collections.Counter([box['state'] for box in state['boxes'].values()])
+    lookups = metrics['hits'] + metrics['misses']
+
+    lines = []
+    def _add(name, metric_type, help_str, values):
+      lines.append('# HELP bento_pool_%s %s' % (name, help_str))
+      lines.append('# TYPE bento_pool_%s %s' % (name, metric_type))
+      for (labels, value) in values:
+        lines.append('bento_pool_%s%s %s' % (name, labels, value))
+
+    _add('leases_total', 'counter', 'Boxes handed out.', [('', metrics['leases'])])
+    _add('hits_total', 'counter', 'Leases served by a box that was already running.',
+        [('', metrics['hits'])])
+    _add('misses_total', 'counter', 'Leases that had to start a new box.', [('', metrics['misses'])])
+    _add('hit_ratio', 'gauge', 'Fraction of leases served by a running box.',
+        [('', float(metrics['hits']) / lookups if lookups else 0.0)])
+    _add('returns_total', 'counter', 'Boxes returned.', [('', metrics['returns'])])
+    _add('resets_failed_total', 'counter', 'Returned boxes that could not be reset cheaply.',
+        [('', metrics['resets_failed'])])
+    _add('boxes', 'gauge', 'Boxes in the pool, by state.', [
+        ('{state="%s"}' % s, num_in_state[s])
+        for s in [state_starting, state_ready, state_leased, state_broken]])
+    _add('lease_latency_seconds', 'summary', 'Time to lease a box.', [
+        ('{quantile="0.5"}', '%.3f' % _get_percentile(latencies, 0.5)),
+        ('{quantile="0.95"}', '%.3f' % _get_percentile(latencies, 0.95)),
+        ('_sum', '%.3f' % sum(latencies)),
+        ('_count', len(latencies)),
+    ])
+    return '\n'.join(lines) + '\n'
+
+  def _write_metrics(self, state):
+    """ Write the metrics where a node_exporter textfile collector can pick them up. """
+    tmp_file = self._metrics_file + '.tmp'
+    f = open(tmp_file, 'w')
+    f.write(self._format_metrics(state))
+    f.close()
+    os.rename(tmp_file, self._metrics_file)
+
+  def list_boxes(self):
+    return self._read_state()['boxes']
+
+
+class BentoPoolTool(object):
+
+  # List of commands available to the user.
+  possible_actions = [
+      'help-actions',
+      'fill',
+      'lease',
+      'return',
+      'status',
+      'metrics',
+  ]
+
+  actions_help = {
+      'fill':
+        "Start boxes until the pool has --size of them.",
+
+      'lease':
+        "Hand out a running box (starting one if none are ready) and print a JSON description of "
+        "it.  Give it back with 'return --box <name>' when done.",
+
+      'return':
+        "Take back the box named with --box, delete its Kiji instances and put it back in the "
+        "pool.  Boxes that cannot be reset get reinstalled.",
+
+      'status':
+        "List the boxes in the pool and their states.",
+
+      'metrics':
+        "Print the pool's hit rate and lease latency, in Prometheus text format (these also get "
+        "written to bento-instances/%s after every change)." % metrics_file_name,
+    }
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        "action",
+        nargs='*',
+        help="Action to take (%s)" % self.possible_actions)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '-r',
+        '--root-dir',
+        type=str,
+        default=os.getcwd(),
+        help='Root directory (containing tgz for bento) [pwd]')
+
+    parser.add_argument(
+        '-s',
+        '--size',
+        type=int,
+        default=2,
+        help='Number of boxes to keep in the pool [2]')
+
+    parser.add_argument(
+        '--box',
+        type=str,
+        default=None,
+        help='Name of the box to return')
+
+    parser.add_argument(
+        '--bento-version',
+        type=str,
+        default=None,
+        help='Bento version to install (e.g., "1.4.3") [latest tgz in pwd]')
+
+    parser.add_argument(
+        '--memory-budget-mb',
+        type=int,
+        default=None,
+        help='Total memory that the boxes being started may use [memory available now]')
+
+    parser.add_argument(
+        '--memory-per-box-mb',
+        type=int,
+        default=bento_instances.default_memory_per_box_mb,
+        help='Memory that one running box needs [%d]' % bento_instances.default_memory_per_box_mb)
+
+    return parser
+
+  def _help_actions(self):
+    """ Print detailed information about how the different actions work """
+    actions_str = ""
+    for action in self.possible_actions:
+      if action == 'help-actions': continue
+      actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
+    print(actions_str)
+    sys.exit(0)
+
+  def go(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    for action in args.action:
+      assert action in self.possible_actions, \
+        "Action '%s' is not one of %s" % (action, self.possible_actions)
+
+    if 'help-actions' in args.action: self._help_actions()
+
+    pool = BentoPool(
+        args.root_dir,
+        bento_version=args.bento_version,
+        memory_per_box_mb=args.memory_per_box_mb,
+        memory_budget_mb=args.memory_budget_mb)
+
+    if 'return' in args.action:
+      assert args.box is not None, "Say which box to return with --box"
+      pool.return_box(args.box)
+
+    if 'fill' in args.action:
+      pool.fill(args.size)
+
+    if 'lease' in args.action:
+      # Starting a box (on a miss) prints what it is doing, but callers parse our stdout, so that
+      # only gets the description of the box.
+      output = script_output.ScriptOutput(myname)
+      output.b_quiet = True
+      box = []
+      output.run(lambda: box.append(pool.lease()))
+      print(json.dumps(box[0], indent=2))
+
+    if 'status' in args.action:
+      for (name, box) in pool.list_boxes().items():
+        print("%-20s %s" % (name, box['state']))
+
+    if 'metrics' in args.action:
+      sys.stdout.write(pool.get_metrics())
+
+if __name__ == "__main__":
+  foo = BentoPoolTool()
+  foo.go(sys.argv[1:])
@@ -8,16 +8,19 @@ Also symlinks some JARs.
 """
 
 import argparse
-import collections
-import functools
 import logging
 import os
 import re
 import shutil
-import subprocess
 import sys
+import time
 
-import bento_classpath
+# The other scripts' modules (bento_classpath, bento_instances, classpath_index, jar_links,
+# jar_watcher, process_terminator and workspace) are imported where we first use them, so that,
+# e.g., help-actions does not have to load them (see bench_startup.py).
+import command_runner
+import jar_discovery
+import script_output
 
 myname = os.path.split(sys.argv[0])[-1]
 description = \
@@ -30,28 +33,25 @@ description = \
 # (makes getting the most-recent version easy - just sort lexographically).
 p_bento = re.compile(r'kiji-bento-(?P<name>\w+)-(?P<version>\d\.\d\.\d)-release\.tar\.gz')
 
-def run(cmd):
-  result = ""
-  try:
-    result = subprocess.check_output(cmd, shell=True)
-  except subprocess.CalledProcessError as e:
-    sys.stderr.write("Error running command '%s'\n" % cmd)
-    sys.stderr.write("Exit code = %s\n" % e.returncode)
-    sys.stderr.write("Output = %s\n" % e.output)
-    raise e
-  return result
+run = command_runner.run
+
+# How long to give the scoring server to exit (when restarting it) before we kill it.
+scoring_server_stop_timeout = 10.0
 
 class BentoRebooter(object):
 
   # List of commands available to the user.
-  # TODO: Add something to unlink JARs
   possible_actions = [
       'help-actions',
       'install-bento',
+      'unlink-jars',
       'link-jars',
+      'build-classpath-index',
       #'setup-classpath',
       'run-bento',
       #'run-scoring-server',
+      'stop-bento',
+      'watch',
   ]
 
   actions_help = {
@@ -59,14 +59,26 @@ class BentoRebooter(object):
         "Will set up a bento box for you.  Assumes you are in a directory with a .tar.gz file "
         "for the appropriate bento build.  If you don't specify a specific build, this script "
         "will use the most-recent tar file in the current directory.  The scripts will rm -rf "
-        "your current bento directory, kill any stale java processes, and untar the .tar.gz file. "
-        "NOTE: This will kill ANY PROCESS that shows up when you run 'jps'.",
+        "your current bento directory, stop any stale java processes, and untar the .tar.gz file. "
+        "Only the JVMs running from the Bento Box (with --instance, from that instance) get "
+        "stopped: SIGTERM first, then SIGKILL if they take too long, and then we wait for the "
+        "Bento Box's ports to be free.",
 
       'link-jars':
         "Will create symlinks from locally-built JARs to the JARs in your Bento Box.  The "
         "script will search your Bento Box's directory structure for all occurrences of JAR "
         "files for the projects that you specify.",
 
+      'unlink-jars':
+        "Undo link-jars: put all of the original Bento Box JARs back (this is quick, and does not "
+        "need the tgz file).  Also cleans up after a link-jars that died partway through.",
+
+      'build-classpath-index':
+        "Build an index of the classes in the Bento Box lib dir (lib-index/bento-classpath.jar), "
+        "so that JVMs started with it at the front of their classpath do not have to scan every "
+        "JAR.  Once built, the index gets rebuilt automatically whenever link-jars changes the "
+        "lib dir.  See classpath_index.py for building an AppCDS archive as well.",
+
       'setup-classpath':
         "Will use the mvn dependency:build-classpath command to get the Maven classpaths used for "
         "building the collection of locally-built JARs that you indicate.  This can be useful if "
@@ -82,20 +94,49 @@ class BentoRebooter(object):
 
       'run-scoring-server':
         "Starts the scoring server, after starting the Bento Box.",
+
+      'stop-bento':
+        "Calls 'bento stop' and then stops any Java processes left over from the Bento Box (with "
+        "--instance, only the processes that belong to that instance).",
+
+      'watch':
+        "Watch the target/ directories of the --link-modules checkouts, and link each module's JAR "
+        "into the Bento Box again as soon as Maven finishes writing it (only that module's Bento "
+        "JARs get touched).  With --restart-scoring-server, also restart the scoring server after "
+        "each change.  Runs after the other actions, until you hit Ctrl-C.",
     }
 
-  def __init__(self):
+  def __init__(self, ws=None):
     super(BentoRebooter, self).__init__()
 
+    # JAR index, classpath cache and process table (see workspace.py).  If None, we make one from
+    # the command-line arguments.
+    self._workspace = ws
+
     # List of different actions for this tool to execute.
     self._actions = None
 
     # Root bento box directory.
     self._bento_dir = None
 
+    # One of several Bento Boxes running side by side (see bento_instances.py), or None.
+    self._instance = None
+
     # Kiji JARs to symlink from local builds to the Bento Box lib directories.
     self._link_modules = None
 
+    # Get the classpaths for all of the link modules with one Maven invocation.
+    self._single_reactor = False
+
+    # For watch: how long a JAR has to keep its size (None for jar_watcher's default), and whether
+    # to restart the scoring server.
+    self._debounce_seconds = None
+    self._restart_scoring_server = False
+    self._poll = False
+
+    # What we did, for --format=json (see script_output.py).
+    self._output = script_output.ScriptOutput('bento_reboot.py')
+
   def _create_parser(self):
     """ Returns a parser for the script """
 
@@ -142,6 +183,13 @@ class BentoRebooter(object):
         default=None,
         help='CSV of modules whose JAR files should get symlinked to Bento lib/*.jar locations (e.g., "model-repository,modeling") [None].')
 
+    parser.add_argument(
+        '--single-reactor',
+        action='store_true',
+        default=False,
+        help='Get the classpaths for all of the --link-modules with one Maven reactor build, rather\n'
+            'than running Maven once per module.')
+
     parser.add_argument(
         '-c',
         '--classpath',
@@ -149,12 +197,63 @@ class BentoRebooter(object):
         default=None,
         help='Value to which to set KIJI_CLASSPATH when running the scoring server.')
 
+    parser.add_argument(
+        '--instance',
+        type=str,
+        default=None,
+        help='Name of the Bento Box instance to manage, for running several side by side. The box\n'
+            'goes in bento-instances/<name>/ under the root directory, and uses its own ports.')
+
+    parser.add_argument(
+        '--port-block',
+        type=int,
+        default=0,
+        help='Block of ports to use for --instance (each block has its own ports, see\n'
+            'bento_instances.py) [0]')
+
+    parser.add_argument(
+        '--debounce-seconds',
+        type=float,
+        default=None,
+        help='For watch, how long a rebuilt JAR has to keep its size before we link it\n'
+            '[the default in jar_watcher.py]')
+
+    parser.add_argument(
+        '--restart-scoring-server',
+        action='store_true',
+        default=False,
+        help='For watch, restart the scoring server after linking each rebuilt JAR.')
+
+    parser.add_argument(
+        '--poll',
+        action='store_true',
+        default=False,
+        help='For watch, look for rebuilt JARs by polling rather than with inotify.')
+
+    parser.add_argument(
+        '--no-scan-cache',
+        action='store_true',
+        default=False,
+        help='Walk the whole root directory to find JARs, rather than only the directories that\n'
+            'have changed since the last run (see jar_discovery.py).')
+
+    parser.add_argument(
+        '--max-depth',
+        type=int,
+        default=None,
+        help='How many directories below the root directory (or the Bento Box) to look for JARs.\n'
+            'Directories listed in %s in the root directory never get searched. [no limit]' % \
+                jar_discovery.ignore_file_name)
+
+    script_output.add_arguments(parser)
+
     return parser
 
   def _help_actions(self):
     """ Print detailed information about how the different actions work """
     actions_str = ""
     for action in self.possible_actions:
+      if action == 'help-actions': continue
       actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
     print(actions_str)
     sys.exit(0)
@@ -179,123 +278,121 @@ class BentoRebooter(object):
     if args.debug:
       logging.basicConfig(level=logging.DEBUG)
 
-    if args.link_modules == None:
-      self._link_modules = []
-    else:
-      self._link_modules = args.link_modules.split(',')
-
-    self._args_bento_version = args.bento_version
-
-    self._root_dir = args.root_dir
-    assert os.path.isdir(self._root_dir)
+    self._output.set_options(args)
+
+    if 'help-actions' in args.action: self._help_actions()
+
+    if self._workspace is None or self._workspace.root_dir != os.path.abspath(args.root_dir):
+      import workspace
+      self._workspace = workspace.Workspace(
+          args.root_dir,
+          scan_cache_file=None if args.no_scan_cache else jar_discovery.default_cache_file,
+          max_depth=args.max_depth)
+
+    self.configure(
+        args.action,
+        link_modules=[] if args.link_modules == None else args.link_modules.split(','),
+        bento_version=args.bento_version,
+        instance=args.instance,
+        port_block=args.port_block,
+        classpath=args.classpath,
+        single_reactor=args.single_reactor,
+        debounce_seconds=args.debounce_seconds,
+        restart_scoring_server=args.restart_scoring_server,
+        poll=args.poll)
+
+  def configure(self, actions, link_modules=(), bento_version=None, instance=None, port_block=0,
+      classpath=None, single_reactor=False, debounce_seconds=None,
+      restart_scoring_server=False, poll=False):
+    """
+    Set up to run some actions, with the same options as on the command line.  For using this from
+    another program (with a Workspace) without building a command line for go().
+    """
+    assert self._workspace is not None, "Create the BentoRebooter with a Workspace"
+    self._root_dir = self._workspace.root_dir
 
-    self._actions = args.action
+    self._actions = list(actions)
     for action in self._actions:
       assert action in self.possible_actions, \
         "Action '%s' is not one of %s" % (action, self.possible_actions)
 
-    if 'help-actions' in self._actions: self._help_actions()
+    self._link_modules = list(link_modules)
+    self._single_reactor = single_reactor
+
+    self._debounce_seconds = debounce_seconds
+    self._restart_scoring_server = restart_scoring_server
+    self._poll = poll
+
+    self._args_bento_version = bento_version
 
     # Figure out what directory to use for the bento box.
-    self._bento_dir = os.path.join(
-        self._root_dir,
-        self._get_bento_dir_name(self._args_bento_version)
-    )
+    if instance is None:
+      self._instance = None
+      self._bento_dir = os.path.join(
+          self._root_dir,
+          self._get_bento_dir_name(self._args_bento_version)
+      )
+    else:
+      import bento_instances
+      self._instance = bento_instances.BentoInstance(self._root_dir, instance, port_block)
+      self._bento_dir = self._instance.get_bento_dir(
+          self._get_bento_dir_name(self._args_bento_version))
     logging.info("Bento directory is " + self._bento_dir)
 
-    self._classpath = args.classpath if args.classpath != None else ''
+    self._classpath = classpath if classpath != None else ''
 
 
   def get_dependency_jars(self):
     """
-    For every one of the modules that we are linking, add more stuff to the classpath.
-
+    For every one of the modules that we are linking, add more stuff to the classpath (the
+    Workspace keeps the classpaths from Maven, and only asks again when a pom.xml changes).
     """
-
-    def _get_dependencies_for_building_target(local_jar):
-      """
-      Use the Bento classpath script to get the dependencies for building this JAR.  The build
-      directory should just be the root directory of this JAR file.
-      """
-      assert os.path.isfile(local_jar)
-      assert local_jar.endswith('.jar')
-
-      target_dir = os.path.dirname(local_jar)
-      assert os.path.isdir(target_dir)
-      assert target_dir.endswith('target')
-
-      dirs = target_dir.split('/')
-      assert dirs[-1] == 'target'
-      build_dir = '/'.join(dirs[:-1])
-      assert os.path.isdir(build_dir)
-
-      logging.info("Getting dependency JARs from %s..." % build_dir)
-
-      # Cache the current PWD, switch directories for the call to this script, then switch back.
-      cwd = os.getcwd()
-      os.chdir(build_dir)
-
-      # Run the script that puts all of the dependencies into a file.
-      bentocp = bento_classpath.BentoClasspath()
-      bentocp.go('-f'.split())
-
-      os.chdir(cwd)
-
-      logging.info("...Done")
-
-      return bentocp.dependencies
-
-    # Capture all of the JARs in the classpaths for all of these projects in a big set.  If the
-    # ordering of these JARs matters, then we may need to do something smarter here (and we are
-    # probably dead).
-    dependency_jars = []
-
-    for module in self._link_modules:
-      kiji_target = 'kiji-' + module
-
-      # Get the JAR file location in the target's target/ directory
-      local_jar = self._get_locally_built_jar_for_target(kiji_target)
-
-      #dependency_jars.update(_get_dependencies_for_building_target(local_jar))
-      dependency_jars.extend(_get_dependencies_for_building_target(local_jar))
-
-    logging.info("Found %s unique dependencies." % len(dependency_jars))
-
-    return dependency_jars
+    # Get the JAR file locations in the targets' target/ directories
+    local_jars = [
+        self._get_locally_built_jar_for_target('kiji-' + module) for module in self._link_modules
+    ]
+    return self._workspace.get_dependency_jars(local_jars, self._single_reactor)
 
   def _write_file_that_sets_classpath(self, dependencies, var_name, ofile):
     """
     Output a file that the user can source to set up the entire maven build classpath for all of the
     locally-built JARs.
     """
+    import bento_classpath
+
     #deps_to_write = [x for x in dependencies if x.find('scala') == -1]
     deps_to_write = dependencies
+    if not isinstance(deps_to_write, bento_classpath.ClasspathSet):
+      deps_to_write = bento_classpath.ClasspathSet(deps_to_write)
+      deps_to_write.log_removed()
 
     myfile = open(ofile, 'w')
-    myfile.write('export %s=%s\n' % (var_name, ':'.join(deps_to_write)))
+    myfile.write('export %s=%s\n' % (var_name, deps_to_write.to_classpath()))
 
-    for dep in deps_to_write:
-      myfile.write("# %s\n" % dep)
+    if not script_output.is_quiet():
+      for dep in deps_to_write:
+        myfile.write("# %s\n" % dep)
 
     myfile.close()
+    script_output.add_file('written', ofile)
+    script_output.set_result('classpath', list(deps_to_write))
 
 
   #-------------------------------------------------------------------------------------------------
   # Stuff for installing the Bento Box
 
+  def _get_ports(self):
+    """ Map from service to the port that the Bento Box runs it on. """
+    import bento_instances
+    return bento_instances.default_ports if self._instance is None else self._instance.ports
+
   def _kill_stale_java_processes(self):
-    logging.info("Killing stale Java processes.")
-    jps_results = run('jps')
-
-    # Kill all of the bento processes
-    for line in jps_results.splitlines():
-      toks = line.split()
-      if len(toks) == 1: continue
-      assert len(toks) == 2, toks
-      (pid, job) = toks
-      if job == 'Jps': continue
-      cmd = "kill -9 " + pid
-      run(cmd)
+    logging.info("Stopping stale Java processes.")
+    import bento_instances
+    # Leave other Bento Boxes (and everything else) alone.
+    self._workspace.kill_java_processes(
+        self._bento_dir if self._instance is None else self._instance.instance_dir,
+        bento_instances.get_box_ports(self._bento_dir, self._get_ports()))
 
   def _find_bento_tgz(self, bento_version_or_none):
     """
@@ -330,11 +427,19 @@ class BentoRebooter(object):
 
     assert not os.path.exists(self._bento_dir)
 
-    cmd = 'cd %s; tar -zxvf %s' % (self._root_dir, bento_tgz)
+    # The tgz stays in the root directory, but an instance's box gets untarred into its own dir.
+    extract_dir = os.path.dirname(self._bento_dir)
+    if not os.path.isdir(extract_dir):
+      os.makedirs(extract_dir)
+    cmd = 'cd %s; tar -zxvf %s' % (extract_dir, os.path.join(os.path.abspath(self._root_dir), bento_tgz))
     run(cmd)
 
     assert os.path.exists(self._bento_dir)
 
+    if self._instance is not None:
+      self._instance.write_instance_file()
+      self._instance.configure_ports(self._bento_dir)
+
   def _do_action_install_bento(self):
     """
     Install a Bento Box!  Kill any stale Java processes and untar the Bento Box.
@@ -348,100 +453,35 @@ class BentoRebooter(object):
 
     # Untar the bento box, possibly deleting the previous install.
     self._untar_bento(bento_tgz)
+    self._workspace.forget_bento_jars(self._bento_dir)
 
 
   #-------------------------------------------------------------------------------------------------
   # Stuff for linking the Bento JARs
+  def _get_kiji_targets(self, kiji_target):
+    """ kiji_target and the targets of all of the --link-modules, so one walk finds them all. """
+    return [kiji_target] + \
+        ['kiji-' + module for module in self._link_modules if 'kiji-' + module != kiji_target]
+
   def _get_locally_built_jar_for_target(self, kiji_target):
     """
-    Return the JAR created by maven for this Kiji target.  Some of the Kiji projects have submodules
-    that may contain the JAR files.
+    Return the JAR created by maven for this Kiji target (looking for those of all of the
+    --link-modules at the same time).
     """
-
-    # If you are building locally, the the JAR should look like:
-    # <kiji target>-x.y.z-SNAPSHOT.jar
-    p_jar = re.compile(kiji_target + r'-(?P<version>\d+\.\d+\.\d+)-SNAPSHOT.jar')
-
-    # Hopefully we'll get only one of these!
-    matching_jars = set()
-
-    # TODO: Make this more efficient?
-    for (dirpath, _, filenames) in os.walk(self._root_dir):
-      # Only count JARs found within target/ (not within target/something/lib, for example).
-      assert os.path.split(dirpath)[1] != ''
-      if os.path.split(dirpath)[1] != 'target':
-        continue
-
-      for fname in filenames:
-        m_jar = p_jar.match(fname)
-        if m_jar:
-          matching_jars.add(os.path.join(dirpath, fname))
-
-    logging.info("Matching JARs for Kiji target " + kiji_target + ":")
-    for jar in sorted(matching_jars):
-      logging.info("\t" + jar)
-
-    assert len(matching_jars) != 0, "Did not find any JARs built by Maven for %s!" % kiji_target
-    assert len(matching_jars) == 1, \
-      "Found multiple potential matches for JARs built by Maven for target %s!" % kiji_target
-
-    return list(matching_jars)[0]
+    return self._workspace.get_local_jar(kiji_target, self._get_kiji_targets(kiji_target))
 
   def _get_bento_jars_for_target(self, kiji_target):
-    """
-    Go into the bento lib directory and find the JAR file for this target (some of these, like
-    kiji-mapreduce, are tricky and will need hard-coding).
-    """
-    all_jars = set()
-
-    # Create a regex to match a jar for this kiji target
-    p_jar = re.compile(kiji_target + r'-\d+\.\d+\.\d+.jar')
-
-    for (dirpath, _, filenames) in os.walk(self._bento_dir):
-
-      for fname in filenames:
-        if fname.startswith(kiji_target) and fname.endswith('.jar'):
-          m_jar = p_jar.match(fname)
+    """ Return the JAR files for this target in the Bento Box lib directory. """
+    return self._workspace.get_bento_jars(
+        self._bento_dir, kiji_target, self._get_kiji_targets(kiji_target))
 
-          # Make sure that you aren't doing something like sym linking 'kiji-scoring' to
-          # 'kiji-scoring-server'
-          if not m_jar: continue
-
-          all_jars.add(os.path.join(dirpath, fname))
-
-    logging.info("Bento Box JARs found for Kiji target " + kiji_target + ":")
-    for bento_jar in all_jars:
-      logging.info('\t' + bento_jar)
-
-    return all_jars
-
-  def _backup_bento_jar(self, bento_jar):
+  def _do_action_link_jars(self):
     """
-    Back up this Bento Box JAR to a .bak file.  If the current JAR file is a sym link, remove that
-    link (since we are about to relink).
+    Link all of the modules specified here to the appropriate <bento location>/lib/*.jar file.  All
+    of the links happen in one transaction, which unlink-jars can undo.
     """
-    backup_jar = bento_jar.replace('.jar', '.bak')
-
-    # If the current JAR is a symlink, then it should already have been backed up.  Just delete the
-    # symlink and return.
-    if os.path.islink(bento_jar):
-      assert os.path.isfile(backup_jar)
-      os.remove(bento_jar)
-      logging.info("Bento JAR %s is already backed up.  Remove symlink." % bento_jar)
-      return
-
-    logging.info("Backing up JAR file %s to %s..." % (bento_jar, backup_jar))
-    os.rename(bento_jar, backup_jar)
-    assert os.path.isfile(backup_jar)
-
-  def _symlink_local_jar_to_bento(self, local_jar, bento_jar):
-    assert not os.path.isfile(bento_jar), \
-        "Bento JAR %s should not exist - it should have already been moved to *.bak" % bento_jar
-    logging.info("Creating symlink %s pointing to %s..." % (bento_jar, local_jar))
-    os.symlink(local_jar, bento_jar)
-
-  def _do_action_link_jars(self):
-    """ Link all of the modules specified here to the appropriate <bento location>/lib/*.jar file. """
+    import jar_links
+    transaction = jar_links.LinkTransaction(self._bento_dir)
     for module in self._link_modules:
       kiji_target = 'kiji-' + module
 
@@ -454,8 +494,61 @@ class BentoRebooter(object):
 
       # Back up the bento file and symlink the new file!
       for bento_jar in bento_jar_list:
-        self._backup_bento_jar(bento_jar)
-        self._symlink_local_jar_to_bento(local_jar, bento_jar)
+        transaction.add(bento_jar, local_jar, 'symlink')
+    transaction.commit()
+
+  def _do_action_watch(self):
+    """
+    Link each module's JAR again whenever Maven rebuilds it.  We find the local build and the Bento
+    JARs for every module once; after that, only the events from the watcher say what to do.
+    """
+    assert len(self._link_modules) > 0, "Specify the modules to watch with --link-modules"
+    import jar_links
+    import jar_watcher
+    import workspace
+
+    debounce_seconds = self._debounce_seconds
+    if debounce_seconds is None:
+      debounce_seconds = jar_watcher.default_debounce_seconds
+    bento_jars = {}
+    watcher = jar_watcher.JarWatcher(debounce_seconds, self._poll)
+    for module in self._link_modules:
+      kiji_target = 'kiji-' + module
+      local_jar = self._get_locally_built_jar_for_target(kiji_target)
+      bento_jars[kiji_target] = self._get_bento_jars_for_target(kiji_target)
+      build_dir = os.path.dirname(os.path.dirname(local_jar))
+      watcher.add_build(kiji_target, build_dir, workspace.get_local_jar_pattern(kiji_target))
+
+    script_output.echo(
+        "Watching %s for rebuilt JARs (Ctrl-C to stop)..." % ', '.join(self._link_modules))
+    try:
+      for (kiji_target, local_jar) in watcher.watch():
+        start = time.time()
+        transaction = jar_links.LinkTransaction(self._bento_dir)
+        for bento_jar in bento_jars[kiji_target]:
+          transaction.add(bento_jar, local_jar, 'symlink')
+        transaction.commit()
+        self._do_action_rebuild_classpath_index()
+        if self._restart_scoring_server:
+          self._restart_scoring_server_process()
+        script_output.echo(
+            "Linked %s into the Bento Box (%.1f seconds)" % (local_jar, time.time() - start))
+    except KeyboardInterrupt:
+      script_output.echo("Stopped watching.")
+
+  def _do_action_build_classpath_index(self):
+    import classpath_index
+    classpath_index.ClasspathIndexer(self._bento_dir).build()
+
+  def _do_action_rebuild_classpath_index(self):
+    """ Rebuild the classpath index (if there is one) after the lib dir changed. """
+    import classpath_index
+    classpath_index.ClasspathIndexer(self._bento_dir).rebuild_if_stale()
+
+  def _do_action_unlink_jars(self):
+    """ Put back all of the original Bento Box JARs. """
+    import jar_links
+    jar_links.rollback(self._bento_dir)
 
   def _do_action_link_classpath(self):
     # Create a classpath variable with the classpaths for *all* of the different modules that we
@@ -471,7 +564,7 @@ class BentoRebooter(object):
       "locally-built Kiji projects you specified.  Note that if those locally-build " + \
       "have vastly different dependencies than your bento box (e.g., different scala " + \
       "versions), then sourcing '%s' may hose everything."
-    print(msg % (src_file, var_name, src_file))
+    script_output.echo(msg % (src_file, var_name, src_file))
 
   def _do_action_run_bento(self):
     """ Just call "bento start" """
@@ -481,16 +574,28 @@ class BentoRebooter(object):
     # Source kiji-env.sh and start the bento box
     cmd = 'cd %s; source bin/kiji-env.sh; bento start' % self._bento_dir
     results = run(cmd)
+    self._workspace.forget_processes()
 
     # Make sure that it starts correctly
     assert results.find('bento-cluster started') != -1, \
         "Bento cluster appears not to have started correctly: %s" % results
     logging.info("Started bento box...")
 
+  def _do_action_stop_bento(self):
+    """ Call "bento stop", then kill anything that is left over. """
+    logging.info("Stopping Bento Box...")
+    if os.path.isdir(self._bento_dir):
+      cmd = 'cd %s; source bin/kiji-env.sh; bento stop' % self._bento_dir
+      try:
+        run(cmd)
+      except command_runner.CommandError:
+        logging.info("'bento stop' failed, killing the Bento Box processes instead")
+    self._kill_stale_java_processes()
+
   def _do_action_run_scoring_server(self):
     """ Set up the classpath, run the scoring server, check that it started okay. """
 
-    scoring_server_dir = os.path.join(self.bento_dir, 'scoring-server')
+    scoring_server_dir = os.path.join(self._bento_dir, 'scoring-server')
 
     # Source kiji-env.sh and start the bento box
     cmd = 'cd %s; source ../bin/kiji-env.sh; bin/kiji-scoring-server' % scoring_server_dir
@@ -502,26 +607,65 @@ class BentoRebooter(object):
       "Kiji scoring server did not start correctly - no PID file found in %s" % pid_file
     logging.info("Starting scoring server...")
 
+  def _restart_scoring_server_process(self):
+    """ Stop the scoring server (if it is running) and start it again, leaving the rest alone. """
+    import process_terminator
+
+    pid_file = os.path.join(self._bento_dir, 'scoring-server', 'kiji-scoring-server.pid')
+    if os.path.isfile(pid_file):
+      f = open(pid_file)
+      pid = int(f.read().strip())
+      f.close()
+      logging.info("Stopping scoring server (pid %d)..." % pid)
+      process_terminator.terminate(
+          [pid],
+          [self._get_ports()['scoring-server']],
+          term_timeout=scoring_server_stop_timeout)
+      os.remove(pid_file)
+    self._do_action_run_scoring_server()
+
   def _run_actions(self):
+    run_action = self._output.run_action
+
+    if 'stop-bento' in self._actions:
+      run_action('stop-bento', self._do_action_stop_bento)
+      return
+
     if 'install-bento' in self._actions:
-      self._do_action_install_bento()
+      run_action('install-bento', self._do_action_install_bento)
     assert os.path.isdir(self._bento_dir)
 
+    if 'unlink-jars' in self._actions:
+      run_action('unlink-jars', self._do_action_unlink_jars)
+
     if 'link-jars' in self._actions:
-      self._do_action_link_jars()
+      run_action('link-jars', self._do_action_link_jars)
+
+    if 'link-jars' in self._actions or 'unlink-jars' in self._actions:
+      run_action('rebuild-classpath-index', self._do_action_rebuild_classpath_index)
+
+    if 'build-classpath-index' in self._actions:
+      run_action('build-classpath-index', self._do_action_build_classpath_index)
 
     if 'setup_classpath' in self._actions:
-      self._do_action_link_classpath()
+      run_action('setup_classpath', self._do_action_link_classpath)
 
     if 'run-bento' in self._actions:
-      self._do_action_run_bento()
+      run_action('run-bento', self._do_action_run_bento)
 
     if 'run-scoring-server' in self._actions:
-      self._do_action_run_scoring_server()
+      run_action('run-scoring-server', self._do_action_run_scoring_server)
+
+    if 'watch' in self._actions:
+      run_action('watch', self._do_action_watch)
+
+  def run(self):
+    """ Run the actions that we were configured with. """
+    self._output.run(self._run_actions)
 
   def go(self, cmd_line_args):
     self._parse_options(cmd_line_args)
-    self._run_actions()
+    self.run()
 
 if __name__ == "__main__":
   foo = BentoRebooter()
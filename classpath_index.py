@@ -0,0 +1,309 @@
+#!/usr/bin/env python2.7
+
+"""
+Builds an index of the JARs in a Bento Box's lib dir, so that JVMs started from the box do not have
+to open and scan every JAR on the classpath at startup.
+
+The index is a small JAR (lib-index/bento-classpath.jar) whose manifest Class-Path lists every JAR
+in lib/ and whose META-INF/INDEX.LIST maps each package to the JAR that contains it.  Optionally,
+it also builds an AppCDS archive of the classes that a typical command loads.
+
+The index records a signature of lib/, and gets rebuilt whenever the JARs there change.
+
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+
+try:
+  from urllib import quote
+except ImportError:
+  from urllib.parse import quote
+
+import command_runner
+import script_output
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script builds a class index (and optionally an AppCDS archive) for the JARs in a Bento Box lib
+directory.  Put the index JAR at the front of a classpath to use it.
+"""
+
+# Everything lives in this directory within the bento box (not in lib/, where it would get picked
+# up by the Kiji scripts' lib/*.jar).
+index_dir_name = 'lib-index'
+index_jar_name = 'bento-classpath.jar'
+stamp_file_name = 'stamp.json'
+class_list_name = 'classes.lst'
+cds_archive_name = 'bento.jsa'
+
+# Command to run to see which classes get loaded when building the CDS archive.
+default_cds_command = 'kiji version'
+
+# Manifest lines may not be longer than this (in bytes), including the newline.
+max_manifest_line = 72
+
+
+def _get_manifest(class_path_entries):
+  """ Return the contents of a JAR manifest with a Class-Path attribute. """
+  lines = ['Manifest-Version: 1.0', 'Created-By: %s' % myname]
+
+  # Long values get wrapped onto continuation lines, which start with a single space.
+  value = 'Class-Path: ' + ' '.join(class_path_entries)
+  lines.append(value[:max_manifest_line - 2])
+  value = value[max_manifest_line - 2:]
+  while value:
+    lines.append(' ' + value[:max_manifest_line - 3])
+    value = value[max_manifest_line - 3:]
+
+  return '\r\n'.join(lines) + '\r\n\r\n'
+
+def _get_index_entries(jar_entries):
+  """
+  Return the entries for one JAR in an INDEX.LIST: the directories (packages) that contain classes
+  or resources, plus the names of any files at the top level.
+  """
+  index_entries = set()
+  for entry in jar_entries:
+    if entry.endswith('/') or entry.startswith('META-INF/'):
+      continue
+    index_entries.add(os.path.dirname(entry) or entry)
+  return sorted(index_entries)
+
+
+class ClasspathIndexer(object):
+  """ Builds, checks and uses the classpath index for one Bento Box. """
+
+  def __init__(self, bento_dir):
+    super(ClasspathIndexer, self).__init__()
+
+    self._bento_dir = bento_dir
+    self._lib_dir = os.path.join(bento_dir, 'lib')
+    self._index_dir = os.path.join(bento_dir, index_dir_name)
+
+  def get_index_jar(self):
+    return os.path.join(self._index_dir, index_jar_name)
+
+  def get_cds_archive(self):
+    return os.path.join(self._index_dir, cds_archive_name)
+
+  def _get_lib_jars(self):
+    return sorted([f for f in os.listdir(self._lib_dir) if f.endswith('.jar')])
+
+  def _get_signature(self, lib_jars):
+    """ Hash of the names, sizes and modification times of the JARs in lib/. """
+    signature = hashlib.sha1()
+    for jar in lib_jars:
+      # Follow symlinks, so that relinking to a rebuilt local JAR counts as a change.
+      jar_stat = os.stat(os.path.join(self._lib_dir, jar))
+      signature.update(('%s %d %d\n' % (jar, jar_stat.st_size, int(jar_stat.st_mtime))).encode())
+    return signature.hexdigest()
+
+  def _read_stamp(self):
+    stamp_file = os.path.join(self._index_dir, stamp_file_name)
+    if not os.path.isfile(stamp_file):
+      return None
+    f = open(stamp_file)
+    stamp = json.load(f)
+    f.close()
+    return stamp
+
+  def _write_stamp(self, signature, b_cds):
+    f = open(os.path.join(self._index_dir, stamp_file_name), 'w')
+    json.dump({'signature': signature, 'cds': b_cds}, f)
+    f.close()
+
+  def exists(self):
+    return self._read_stamp() is not None and os.path.isfile(self.get_index_jar())
+
+  def is_stale(self):
+    """ True if there is no index, or if the JARs in lib/ have changed since we built it. """
+    stamp = self._read_stamp()
+    if stamp is None:
+      return True
+    return stamp['signature'] != self._get_signature(self._get_lib_jars())
+
+  def build(self, b_cds=False, cds_command=default_cds_command):
+    """ (Re)build the index JAR, and the CDS archive if b_cds is set. """
+    # Only building reads and writes JARs; the scripts check is_stale() far more often than that.
+    import jar_reader
+    import zipfile
+
+    assert os.path.isdir(self._lib_dir), self._lib_dir
+    if not os.path.isdir(self._index_dir):
+      os.mkdir(self._index_dir)
+
+    lib_jars = self._get_lib_jars()
+    logging.info("Indexing %d JARs in %s..." % (len(lib_jars), self._lib_dir))
+
+    class_path_entries = []
+    index_sections = []
+    for jar in lib_jars:
+      entry = quote('../lib/' + jar)
+      class_path_entries.append(entry)
+      index_sections.append('\n'.join([entry] + _get_index_entries(
+          jar_reader.read_jar_entries(os.path.join(self._lib_dir, jar)))))
+
+    index_list = 'JarIndex-Version: 1.0\n\n' + '\n\n'.join(index_sections) + '\n\n'
+
+    # Write to a temp file and rename, so that a JVM never sees a half-written index.
+    tmp_jar = self.get_index_jar() + '.tmp'
+    jar_file = zipfile.ZipFile(tmp_jar, 'w', zipfile.ZIP_DEFLATED)
+    jar_file.writestr('META-INF/MANIFEST.MF', _get_manifest(class_path_entries))
+    jar_file.writestr('META-INF/INDEX.LIST', index_list)
+    jar_file.close()
+    os.rename(tmp_jar, self.get_index_jar())
+
+    if b_cds:
+      self._build_cds_archive(cds_command)
+    elif os.path.isfile(self.get_cds_archive()):
+      # An archive for the old classpath is worse than none at all.
+      os.remove(self.get_cds_archive())
+
+    self._write_stamp(self._get_signature(lib_jars), b_cds)
+    logging.info("Wrote classpath index %s" % self.get_index_jar())
+    script_output.add_file('written', self.get_index_jar())
+
+  def _build_cds_archive(self, cds_command):
+    """
+    Run a command to find the classes that it loads, then dump those classes into an AppCDS
+    archive.  Needs a JVM that supports -XX:SharedArchiveFile for application classes.
+    """
+    class_list = os.path.join(self._index_dir, class_list_name)
+    logging.info("Getting list of loaded classes from '%s'..." % cds_command)
+    cmd = "source {bento}/bin/kiji-env.sh; export KIJI_CLASSPATH={index}:$KIJI_CLASSPATH; " \
+        "export KIJI_JAVA_OPTS=\"$KIJI_JAVA_OPTS -XX:DumpLoadedClassList={class_list}\"; " \
+        "{cmd}".format(
+            bento=self._bento_dir, index=self.get_index_jar(), class_list=class_list, cmd=cds_command)
+    command_runner.run(cmd)
+    assert os.path.isfile(class_list), "No class list written to %s" % class_list
+
+    logging.info("Dumping CDS archive...")
+    cmd = "java -Xshare:dump -XX:SharedClassListFile={class_list} " \
+        "-XX:SharedArchiveFile={archive} -cp {index}".format(
+            class_list=class_list, archive=self.get_cds_archive(), index=self.get_index_jar())
+    command_runner.run(cmd)
+    assert os.path.isfile(self.get_cds_archive())
+
+  def rebuild_if_stale(self):
+    """
+    Rebuild an existing index if lib/ has changed.  Does nothing for a bento box that has no index
+    (nobody asked for one).
+    """
+    if not self.exists() or not self.is_stale():
+      return
+    logging.info("JARs in %s have changed, rebuilding classpath index..." % self._lib_dir)
+    self.build(b_cds=self._read_stamp()['cds'])
+
+  def get_classpath_prefix(self):
+    """ What to put at the front of the classpath to use the index ('' if it is missing or stale). """
+    if not self.exists() or self.is_stale():
+      return ''
+    return self.get_index_jar()
+
+  def get_java_opts(self):
+    """ JVM options to use the CDS archive ('' if it is missing or stale). """
+    if not os.path.isfile(self.get_cds_archive()) or self.is_stale():
+      return ''
+    return '-Xshare:auto -XX:SharedArchiveFile=%s' % self.get_cds_archive()
+
+
+class ClasspathIndexTool(object):
+
+  # List of commands available to the user.
+  possible_actions = [
+      'help-actions',
+      'build-classpath-index',
+      'check-classpath-index',
+  ]
+
+  actions_help = {
+      'build-classpath-index':
+        "Build the class index JAR (and, with --cds, the AppCDS archive) for the Bento Box lib "
+        "dir.  link-jars, copy-kiji-jars and update-lib-jars rebuild an existing index when they "
+        "change lib/.",
+
+      'check-classpath-index':
+        "Exit with a non-zero status if the classpath index is missing or out of date.",
+    }
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        "action",
+        nargs='*',
+        help="Action to take (%s)" % self.possible_actions)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '-b',
+        '--bento-dir',
+        type=str,
+        required=True,
+        help='Bento Box directory (containing lib/)')
+
+    parser.add_argument(
+        '--cds',
+        action='store_true',
+        default=False,
+        help='Also build an AppCDS archive')
+
+    parser.add_argument(
+        '--cds-command',
+        type=str,
+        default=default_cds_command,
+        help='Command to run to find the classes to put in the AppCDS archive [%s]' % \
+            default_cds_command)
+
+    return parser
+
+  def _help_actions(self):
+    """ Print detailed information about how the different actions work """
+    actions_str = ""
+    for action in self.possible_actions:
+      if action == 'help-actions': continue
+      actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
+    print(actions_str)
+    sys.exit(0)
+
+  def go(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    for action in args.action:
+      assert action in self.possible_actions, \
+        "Action '%s' is not one of %s" % (action, self.possible_actions)
+
+    if 'help-actions' in args.action: self._help_actions()
+
+    indexer = ClasspathIndexer(args.bento_dir)
+
+    if 'build-classpath-index' in args.action:
+      indexer.build(b_cds=args.cds, cds_command=args.cds_command)
+
+    if 'check-classpath-index' in args.action:
+      if indexer.is_stale():
+        print("Classpath index for %s is missing or out of date." % args.bento_dir)
+        sys.exit(1)
+      print("Classpath index for %s is up to date." % args.bento_dir)
+
+if __name__ == "__main__":
+  foo = ClasspathIndexTool()
+  foo.go(sys.argv[1:])
@@ -0,0 +1,273 @@
+#!/usr/bin/env python2.7
+
+"""
+Shared code for running shell commands from the bento scripts.
+
+Commands run in their own process group, so that a timeout or a cancel takes out everything the
+shell started.  Output is read line by line as it arrives and can be handed to callbacks (e.g., to
+echo Maven's [INFO] lines) while the command is still running.  Only a bounded amount of stdout is
+kept around for the caller.
+
+Several commands can be running at once: start() returns right away, and run_all() runs a list of
+independent commands concurrently.
+
+"""
+
+import collections
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import script_output
+
+# Keep at most this much stdout in memory for each command (older output gets dropped).
+default_max_buffer_bytes = 64 * 1024 * 1024
+
+# How long to wait after sending SIGTERM to a cancelled command before sending SIGKILL.
+default_kill_grace_seconds = 5.0
+
+
+class CommandError(subprocess.CalledProcessError):
+  """ A command exited with a non-zero exit code. """
+  pass
+
+
+class CommandTimeout(CommandError):
+  """ A command ran for longer than its timeout and was killed. """
+
+  def __str__(self):
+    return "Command '%s' timed out" % self.cmd
+
+
+class Command(object):
+  """
+  A shell command running in the background.  Usually created with start() (below); create one
+  directly and call its start() method if a callback needs a handle on the command (e.g., to cancel
+  it) before any output arrives.
+  """
+
+  def __init__(
+      self,
+      cmd,
+      on_stdout=None,
+      on_stderr=None,
+      timeout=None,
+      cwd=None,
+      env=None,
+      max_buffer_bytes=default_max_buffer_bytes,
+      b_stdin=False):
+    super(Command, self).__init__()
+
+    self.cmd = cmd
+
+    # Callbacks that get every line (without the trailing newline) as soon as it is read.  They run
+    # in reader threads, so bind them to the output of the script that is running the command.
+    self._on_stdout = script_output.bind(on_stdout) if on_stdout is not None else None
+    self._on_stderr = script_output.bind(on_stderr) if on_stderr is not None else None
+
+    self._timeout = timeout
+    self._cwd = cwd
+    self._env = env
+    self._max_buffer_bytes = max_buffer_bytes
+
+    # Give the command a pipe for stdin (see write_line) rather than our stdin.
+    self._b_stdin = b_stdin
+
+    # Most-recent stdout lines (with newlines), and their total size.
+    self._buffer = collections.deque()
+    self._buffer_bytes = 0
+
+    # True if we had to drop some stdout to stay under max_buffer_bytes.
+    self.truncated = False
+
+    # The first exception that a callback raised.  We stop calling the callbacks after that, but
+    # keep reading the output (so that the command does not block on a full pipe), and wait()
+    # raises it.
+    self._callback_error = None
+
+    self.cancelled = False
+    self.timed_out = False
+    self.returncode = None
+    self.elapsed = None
+
+    self._proc = None
+    self._threads = []
+    self._timers = []
+    self._lock = threading.Lock()
+    self._start_time = None
+
+  def start(self):
+    logging.debug("Running command: '%s'" % self.cmd)
+    self._start_time = time.time()
+    self._proc = subprocess.Popen(
+        self.cmd,
+        shell=True,
+        cwd=self._cwd,
+        env=self._env,
+        stdin=subprocess.PIPE if self._b_stdin else None,
+        stdout=subprocess.PIPE,
+        # Without a callback stderr goes straight to our stderr (like check_output).
+        stderr=subprocess.PIPE if self._on_stderr is not None else None,
+        universal_newlines=True,
+        close_fds=True,
+        # New process group, so that we can kill the shell and all of its children.
+        preexec_fn=os.setsid)
+
+    self._start_reader(self._proc.stdout, self._on_stdout, True)
+    if self._on_stderr is not None:
+      self._start_reader(self._proc.stderr, self._on_stderr, False)
+
+    if self._timeout is not None:
+      self._start_timer(self._timeout, self._on_timeout)
+
+    return self
+
+  def _start_reader(self, pipe, callback, b_buffer):
+    thread = threading.Thread(target=self._read_lines, args=(pipe, callback, b_buffer))
+    thread.daemon = True
+    thread.start()
+    self._threads.append(thread)
+
+  def _start_timer(self, seconds, func):
+    timer = threading.Timer(seconds, func)
+    timer.daemon = True
+    timer.start()
+    self._timers.append(timer)
+
+  def _read_lines(self, pipe, callback, b_buffer):
+    # Use readline() rather than iterating over the pipe, which would read ahead in big chunks.
+    for line in iter(pipe.readline, ''):
+      if b_buffer:
+        self._append_to_buffer(line)
+      if callback is not None and self._callback_error is None:
+        try:
+          callback(line.rstrip('\r\n'))
+        except Exception as e:
+          logging.exception("Output callback for command '%s' failed" % self.cmd)
+          with self._lock:
+            if self._callback_error is None:
+              self._callback_error = e
+    pipe.close()
+
+  def _append_to_buffer(self, line):
+    if self._max_buffer_bytes is None:
+      self._buffer.append(line)
+      return
+
+    self._buffer.append(line)
+    self._buffer_bytes += len(line)
+    while self._buffer_bytes > self._max_buffer_bytes and self._buffer:
+      self._buffer_bytes -= len(self._buffer.popleft())
+      self.truncated = True
+
+  def write_line(self, line):
+    """ Send a line to the command's stdin (for commands started with b_stdin=True). """
+    assert self._b_stdin, "Command '%s' has no stdin pipe" % self.cmd
+    self._proc.stdin.write(line + '\n')
+    self._proc.stdin.flush()
+
+  def close_stdin(self):
+    if self._b_stdin and not self._proc.stdin.closed:
+      self._proc.stdin.close()
+
+  @property
+  def output(self):
+    """ Stdout so far (or the tail of it, if it was truncated). """
+    return ''.join(self._buffer)
+
+  def _signal(self, signum):
+    try:
+      os.killpg(self._proc.pid, signum)
+    except OSError:
+      # Already gone.
+      pass
+
+  def _terminate(self):
+    with self._lock:
+      if self._proc.poll() is not None:
+        return
+      self._signal(signal.SIGTERM)
+    self._start_timer(default_kill_grace_seconds, lambda: self._signal(signal.SIGKILL))
+
+  def _on_timeout(self):
+    with self._lock:
+      # The command may have finished just as the timer went off.
+      if self._proc.poll() is not None:
+        return
+      self.timed_out = True
+    logging.info("Command '%s' timed out after %s seconds, killing it." % (self.cmd, self._timeout))
+    self._terminate()
+
+  def cancel(self):
+    """ Kill the command.  wait() will not raise an error for a command that we cancelled. """
+    self.cancelled = True
+    self._terminate()
+
+  def is_running(self):
+    return self._proc.poll() is None
+
+  def wait(self):
+    """
+    Wait for the command to finish and return its stdout.  Raises the exception that an output
+    callback raised, if one did.
+    """
+    self.close_stdin()
+    for thread in self._threads:
+      thread.join()
+    self.returncode = self._proc.wait()
+    for timer in self._timers:
+      timer.cancel()
+    self.elapsed = time.time() - self._start_time
+
+    if self._callback_error is not None:
+      raise self._callback_error
+
+    if self.timed_out:
+      raise CommandTimeout(self.returncode, self.cmd, self.output)
+
+    if self.returncode != 0 and not self.cancelled:
+      raise CommandError(self.returncode, self.cmd, self.output)
+
+    return self.output
+
+
+def start(cmd, **kwargs):
+  """ Start running a command in the background.  Takes the same arguments as Command. """
+  return Command(cmd, **kwargs).start()
+
+def wait_or_die(command):
+  """ Wait for a started command and return its stdout.  Die with some information on an error. """
+  try:
+    return command.wait()
+  except CommandError as e:
+    sys.stderr.write("Error running command '%s'\n" % command.cmd)
+    sys.stderr.write("Exit code = %s\n" % e.returncode)
+    sys.stderr.write("Output = %s\n" % e.output)
+    raise e
+
+def run(cmd, **kwargs):
+  """ Run a command, wait for it, and return its stdout.  Die with some information on an error. """
+  return wait_or_die(start(cmd, **kwargs))
+
+def run_all(cmds, max_parallel=None, **kwargs):
+  """
+  Run a bunch of independent commands concurrently, at most max_parallel at a time (all at once by
+  default).  Returns a list of their outputs, in the same order as cmds.
+  """
+  if len(cmds) == 0:
+    return []
+
+  # Every script imports this module, and multiprocessing takes longer to import than all of the
+  # rest of it, so wait until someone runs commands in parallel.
+  from multiprocessing.pool import ThreadPool
+
+  pool = ThreadPool(max_parallel or len(cmds))
+  try:
+    return pool.map(script_output.bind(lambda cmd: run(cmd, **kwargs)), cmds)
+  finally:
+    pool.close()
+    pool.join()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python2.7
+
+"""
+Finds classes that more than one JAR on a classpath provides, and JARs for different versions of
+Scala or Hadoop, before they cause trouble at runtime.
+
+For every JAR we only read the zip central directory (see jar_reader.py), which has the name, size
+and CRC of every class, so comparing hundreds of JARs takes well under a second.  When two JARs
+have the same class, the one earlier on the classpath wins.  If the two copies are identical (same
+CRC and size), that is harmless; if they differ, the later JAR's class is shadowed, and whatever
+uses it gets the other version.
+
+"""
+
+import argparse
+import collections
+import logging
+import os
+import re
+import sys
+
+import bento_classpath
+import jar_reader
+
+myname = os.path.split(sys.argv[0])[-1]
+description = """
+This script looks for duplicate classes, split packages and Scala / Hadoop version clashes among the
+JARs of a Bento Box lib dir (or of a classpath).
+"""
+
+# Default number of JARs to read at once.
+default_max_parallel = 8
+
+# How many example classes to show for each pair of JARs that conflict.
+max_examples = 3
+
+# JAR file name outside of a Maven repository: <artifactId>-<version>[-<classifier>].jar
+p_jar_name = re.compile(
+    r'^(?P<artifact>.+?)-(?P<version>\d[^-]*(?:-(?:SNAPSHOT|cdh[\d.]+|hadoop\d|mr\d|\d+))*)'
+    r'(?:-(?P<classifier>[a-zA-Z][\w.-]*))?\.jar$')
+
+# The artifacts that Apache Hadoop releases together, all with the same version.  Other hadoop-*
+# artifacts (e.g., hadoop-lzo-0.4.15) have versions of their own, and do not count.
+p_hadoop_artifact = re.compile(
+    r'^hadoop-(?:common|hdfs|core|client|annotations|auth|mapreduce-[\w-]+|yarn-[\w-]+)$')
+
+# Hadoop's MapReduce 1 JARs (e.g., hadoop-core-2.0.0-mr1-cdh4.3.0) go with the rest of that version.
+p_hadoop_mr1 = re.compile(r'-mr1(?=-|$)')
+
+# Scala artifacts are either Scala itself, or built for one Scala binary version (e.g., foo_2.10).
+scala_artifacts = set(['scala-library', 'scala-reflect', 'scala-compiler', 'scala-actors'])
+p_scala_suffix = re.compile(r'_(?P<scala>2\.\d+)$')
+
+
+def get_artifact_version(jar):
+  """ Return (artifactId, version) for a JAR in a Maven repo or a lib dir, or None. """
+  coordinate = bento_classpath.get_artifact_coordinate(jar)
+  if coordinate is not None:
+    ((_, artifact_id, _), version) = coordinate
+    return (artifact_id, version)
+  m_jar = p_jar_name.match(os.path.basename(jar))
+  if m_jar is None:
+    return None
+  return (m_jar.group('artifact'), m_jar.group('version'))
+
+def _get_scala_version(artifact_id, version):
+  """ The Scala binary version (e.g., '2.10') that an artifact needs, or None. """
+  if artifact_id in scala_artifacts:
+    return '.'.join(version.split('.')[:2])
+  m_scala = p_scala_suffix.search(artifact_id)
+  return m_scala.group('scala') if m_scala else None
+
+def _get_package(class_entry):
+  return os.path.dirname(class_entry).replace('/', '.')
+
+def _is_class(entry_name):
+  # Multi-release JARs keep more versions of the same classes under META-INF/versions.
+  return entry_name.endswith('.class') and not entry_name.startswith('META-INF/') and \
+      entry_name != 'module-info.class'
+
+
+class ConflictReport(object):
+  """ What ClassConflictAnalyzer found. """
+
+  def __init__(self):
+    super(ConflictReport, self).__init__()
+
+    # Number of JARs and classes that we looked at.
+    self.num_jars = 0
+    self.num_classes = 0
+
+    # JARs that we could not read, with the reason.
+    self.bad_jars = []
+
+    # Map from (winning JAR, shadowed JAR) to the classes that the first hides and that differ.
+    self.shadowed = collections.OrderedDict()
+
+    # Map from (winning JAR, other JAR) to the classes that both have, identically.
+    self.redundant = collections.OrderedDict()
+
+    # Map from package to the JARs that have classes in it, for packages in more than one JAR.
+    self.split_packages = collections.OrderedDict()
+
+    # Map from what clashes ('Scala', 'Hadoop' or an artifact) to version -> JARs.
+    self.version_clashes = collections.OrderedDict()
+
+  def has_problems(self):
+    """ True for the things that break a Bento Box (shadowed classes, version clashes). """
+    return len(self.shadowed) > 0 or len(self.version_clashes) > 0
+
+  def _get_messages(self):
+    """ Yield (logging level, line) for the report. """
+    yield (logging.INFO, "Looked at %d classes in %d JARs." % (self.num_classes, self.num_jars))
+    for (jar, error) in self.bad_jars:
+      yield (logging.WARNING, "Could not read %s: %s" % (jar, error))
+    for (name, versions) in self.version_clashes.items():
+      yield (logging.WARNING, "Version clash for %s:" % name)
+      for (version, jars) in versions.items():
+        yield (logging.WARNING,
+            "  %s: %s" % (version, ', '.join(sorted([os.path.basename(j) for j in jars]))))
+    for ((winner, loser), classes) in self.shadowed.items():
+      yield (logging.WARNING, "%d classes in %s are shadowed by different ones in %s (e.g., %s)" % \
+          (len(classes), loser, winner, ', '.join(classes[:max_examples])))
+    num_redundant = sum([len(classes) for classes in self.redundant.values()])
+    if num_redundant > 0:
+      yield (logging.INFO, "%d identical classes are in more than one JAR (%d pairs of JARs)" % \
+          (num_redundant, len(self.redundant)))
+    for ((winner, other), classes) in self.redundant.items():
+      yield (logging.DEBUG, "  %d in %s and %s" % (len(classes), winner, other))
+    if len(self.split_packages) > 0:
+      yield (logging.INFO, "%d packages are split across JARs" % len(self.split_packages))
+    for (package, jars) in self.split_packages.items():
+      yield (logging.DEBUG, "  %s: %s" % (package, ', '.join(jars)))
+
+  def get_lines(self):
+    """ Human-readable report (without the details of the harmless things). """
+    return [line for (level, line) in self._get_messages() if level > logging.DEBUG]
+
+  def log(self):
+    """ Log the report: the problems as warnings, the rest as info or debug. """
+    for (level, line) in self._get_messages():
+      logging.log(level, line)
+
+
+class ClassConflictAnalyzer(object):
+  """ Looks for conflicts among the JARs of a classpath (in classpath order). """
+
+  def __init__(self, jars, max_parallel=default_max_parallel):
+    super(ClassConflictAnalyzer, self).__init__()
+    self._jars = list(jars)
+    self._max_parallel = max_parallel
+
+  def _read_jar(self, jar):
+    """ Return ([(class, crc, size)], None) for a JAR, or (None, error). """
+    try:
+      entries = jar_reader.read_jar_index(jar)
+      return ([(e.name, e.crc, e.size) for e in entries if _is_class(e.name)], None)
+    except (IOError, OSError, ValueError, jar_reader.BadJarError) as e:
+      return (None, str(e))
+
+  def _read_jars(self):
+    if len(self._jars) <= 1 or self._max_parallel <= 1:
+      return [self._read_jar(jar) for jar in self._jars]
+    # Imported here, as in command_runner.run_all(), since multiprocessing is slow to import.
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(self._max_parallel, len(self._jars)))
+    try:
+      return pool.map(self._read_jar, self._jars)
+    finally:
+      pool.close()
+      pool.join()
+
+  def _find_version_clashes(self, report):
+    """ Scala binary versions, Hadoop versions, and more than one version of any artifact. """
+    scala_versions = collections.defaultdict(list)
+    hadoop_versions = collections.defaultdict(list)
+    artifact_versions = collections.defaultdict(lambda: collections.defaultdict(list))
+    for jar in self._jars:
+      artifact_version = get_artifact_version(jar)
+      if artifact_version is None:
+        continue
+      (artifact_id, version) = artifact_version
+      artifact_versions[artifact_id][version].append(jar)
+      scala_version = _get_scala_version(artifact_id, version)
+      if scala_version is not None:
+        scala_versions[scala_version].append(jar)
+      if p_hadoop_artifact.match(artifact_id):
+        hadoop_versions[p_hadoop_mr1.sub('', version)].append(jar)
+
+    if len(scala_versions) > 1:
+      report.version_clashes['Scala'] = collections.OrderedDict(sorted(scala_versions.items()))
+    if len(hadoop_versions) > 1:
+      report.version_clashes['Hadoop'] = collections.OrderedDict(sorted(hadoop_versions.items()))
+    for (artifact_id, versions) in sorted(artifact_versions.items()):
+      if len(versions) > 1:
+        report.version_clashes[artifact_id] = collections.OrderedDict(sorted(versions.items()))
+
+  def analyze(self):
+    """ Return a ConflictReport. """
+    report = ConflictReport()
+    report.num_jars = len(self._jars)
+
+    # Map from class to (first JAR with it, CRC, size), and from package to JARs.
+    first_seen = {}
+    package_jars = collections.defaultdict(list)
+    for (jar, (classes, error)) in zip(self._jars, self._read_jars()):
+      if classes is None:
+        report.bad_jars.append((jar, error))
+        continue
+      for (class_entry, crc, size) in classes:
+        package = _get_package(class_entry)
+        if not package_jars[package] or package_jars[package][-1] != jar:
+          package_jars[package].append(jar)
+
+        if class_entry not in first_seen:
+          first_seen[class_entry] = (jar, crc, size)
+          continue
+        (winner, winner_crc, winner_size) = first_seen[class_entry]
+        if winner == jar:
+          continue
+        conflicts = report.redundant if (crc, size) == (winner_crc, winner_size) \
+            else report.shadowed
+        conflicts.setdefault((winner, jar), []).append(class_entry.replace('/', '.')[:-6])
+    report.num_classes = len(first_seen)
+
+    for (package, jars) in sorted(package_jars.items()):
+      if len(set(jars)) > 1:
+        report.split_packages[package] = sorted(set(jars))
+
+    self._find_version_clashes(report)
+    return report
+
+
+def check_jars(jars, max_parallel=default_max_parallel):
+  """ Analyze a list of JARs, log what we found, and return the ConflictReport. """
+  report = ClassConflictAnalyzer(jars, max_parallel).analyze()
+  report.log()
+  return report
+
+def get_lib_jars(bento_dir):
+  """ The JARs in a Bento Box's lib dir, in the order that the Kiji scripts put them. """
+  lib_dir = os.path.join(bento_dir, 'lib')
+  return [os.path.join(lib_dir, f) for f in sorted(os.listdir(lib_dir)) if f.endswith('.jar')]
+
+
+class JarConflictTool(object):
+
+  # List of commands available to the user.
+  possible_actions = [
+      'help-actions',
+      'check-conflicts',
+  ]
+
+  actions_help = {
+      'check-conflicts':
+        "Report duplicate classes, split packages and version clashes among the JARs in the Bento "
+        "Box lib dir (or on --classpath, in order).  Exits with a non-zero status if a JAR shadows "
+        "classes of another with different versions of them, or if there is more than one version "
+        "of Scala, of Hadoop or of any other artifact.",
+    }
+
+  def _create_parser(self):
+    """ Returns a parser for the script """
+
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        "action",
+        nargs='*',
+        help="Action to take (%s)" % self.possible_actions)
+
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Verbose mode (turn on logging.info)')
+
+    parser.add_argument(
+        '-b',
+        '--bento-dir',
+        type=str,
+        default=None,
+        help='Bento Box directory (containing lib/)')
+
+    parser.add_argument(
+        '--classpath',
+        type=str,
+        default=None,
+        help='Classpath (colon-separated JARs) to check, rather than a Bento Box lib dir')
+
+    parser.add_argument(
+        '--max-parallel',
+        type=int,
+        default=default_max_parallel,
+        help='Number of JARs to read at once [%d]' % default_max_parallel)
+
+    return parser
+
+  def _help_actions(self):
+    """ Print detailed information about how the different actions work """
+    actions_str = ""
+    for action in self.possible_actions:
+      if action == 'help-actions': continue
+      actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
+    print(actions_str)
+    sys.exit(0)
+
+  def go(self, cmd_line_args):
+    args = self._create_parser().parse_args(cmd_line_args)
+
+    if args.verbose:
+      logging.basicConfig(level=logging.INFO)
+
+    for action in args.action:
+      assert action in self.possible_actions, \
+        "Action '%s' is not one of %s" % (action, self.possible_actions)
+
+    if 'help-actions' in args.action: self._help_actions()
+
+    if 'check-conflicts' in args.action:
+      assert (args.bento_dir is None) != (args.classpath is None), \
+          "Specify either --bento-dir or --classpath"
+      if args.classpath is not None:
+        jars = [jar for jar in args.classpath.split(':') if jar.endswith('.jar')]
+      else:
+        jars = get_lib_jars(args.bento_dir)
+
+      report = ClassConflictAnalyzer(jars, args.max_parallel).analyze()
+      print('\n'.join(report.get_lines()))
+      if report.has_problems():
+        sys.exit(1)
+
+if __name__ == "__main__":
+  foo = JarConflictTool()
+  foo.go(sys.argv[1:])
@@ -0,0 +1,349 @@
+#!/usr/bin/env python2.7
+
+"""
+Finds JARs (and Bento Boxes) under a directory tree, remembering what it found between runs.
+
+PrunedWalker does not go into directories that cannot have the JARs that we are looking for
+(.git, source trees, Bento Boxes when looking for local builds, HDFS and HBase data when looking in
+a Bento Box), using .gitignore-style rules and a maximum depth.  find_files() finds the files for
+several regexes in one walk.
+
+Every script here walks the whole root directory (all of the Kiji checkouts and Bento Boxes) to find
+a handful of JARs.  ScanCache keeps the listing of every directory that it has walked in a SQLite
+file, along with the directory's mtime.  Adding, removing or renaming anything in a directory
+changes its mtime, so on the next walk a directory whose mtime has not changed gets its listing
+from the cache, like the stat shortcut of git's index: one stat per directory, rather than a
+listdir and a stat per entry.  Only the directories that changed get listed again.
+
+As with git's index, a directory that changed within a couple of seconds of when we listed it is
+"racy" (it might change again without its mtime changing), so we list it again next time.
+
+"""
+
+import collections
+import logging
+import os
+import re
+import stat
+import time
+
+# Where the scan cache lives, shared by all of the scripts and all of the root directories.
+default_cache_file = os.path.join(
+    os.path.expanduser('~'), '.cache', 'kiji-build-scripts', 'scan-cache.sqlite')
+
+# Bump this when the table changes, and the old cache gets thrown away.
+cache_schema_version = 1
+
+# How close to the time of a listing a directory's mtime can be and still be trusted next time.
+racy_seconds = 2.0
+
+# Directories that never have locally-built JARs in them.
+local_build_ignore_patterns = [
+    '.git/',
+    '.svn/',
+    '.hg/',
+    '.m2/',
+    'node_modules/',
+    'src/',
+    # Bento Boxes (and their instances) are not local builds.
+    'kiji-bento-*/',
+    '/bento-instances/',
+    # Maven only puts the JAR right in target/ (not in target/classes, target/something/lib, ...).
+    '**/target/*/',
+]
+
+# Directories in a Bento Box that have data rather than JARs.
+bento_ignore_patterns = [
+    '/cluster/state/',
+    '/cassandra/data/',
+    '/cassandra/commitlog/',
+    '/cassandra/saved_caches/',
+    'logs/',
+    'tmp/',
+]
+
+# File in the root directory with more ignore rules (in .gitignore syntax) for the root walk.
+ignore_file_name = '.bento-scan-ignore'
+
+
+def _join_names(names):
+  return '/'.join(names)
+
+def _split_names(joined):
+  return joined.split('/') if joined else []
+
+
+class ScanCache(object):
+  """
+  A cache of directory listings, in a SQLite file (or only in memory, if cache_file is None).  Use
+  one ScanCache per thread.
+  """
+
+  def __init__(self, cache_file=default_cache_file):
+    super(ScanCache, self).__init__()
+
+    # Not at the top, so that the scripts can use default_cache_file without loading SQLite.
+    import sqlite3
+
+    try:
+      if cache_file is not None and not os.path.isdir(os.path.dirname(cache_file)):
+        os.makedirs(os.path.dirname(cache_file))
+      self._conn = sqlite3.connect(cache_file or ':memory:', timeout=30.0)
+    except (OSError, sqlite3.Error) as e:
+      # We can still walk the tree, just without remembering anything.
+      logging.info("Cannot use scan cache %s (%s)" % (cache_file, e))
+      self._conn = sqlite3.connect(':memory:')
+    self._conn.text_factory = str
+
+    if self._conn.execute('PRAGMA user_version').fetchone()[0] != cache_schema_version:
+      self._conn.execute('DROP TABLE IF EXISTS dirs')
+      self._conn.execute('PRAGMA user_version = %d' % cache_schema_version)
+    self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS dirs ('
+        'path TEXT PRIMARY KEY, mtime REAL, ino INTEGER, dirnames TEXT, filenames TEXT)')
+    self._conn.commit()
+
+    # How many directories the last walk listed, and how many came out of the cache.
+    self.num_listed = 0
+    self.num_cached = 0
+
+  def _list(self, path):
+    """ Really list a directory.  Return (dirnames, filenames) as os.walk would. """
+    dirnames = []
+    filenames = []
+    for name in sorted(os.listdir(path)):
+      full_path = os.path.join(path, name)
+      if os.path.isdir(full_path):
+        dirnames.append(name)
+      else:
+        filenames.append(name)
+    return (dirnames, filenames)
+
+  def _forget_subtree(self, path):
+    self._conn.execute(
+        'DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?',
+        (path, len(path) + 1, path + os.sep))
+
+  def listdir(self, path, scan_time=None, dir_stat=None):
+    """ Return (dirnames, filenames) for a directory, from the cache if it has not changed. """
+    path = os.path.abspath(path)
+    dir_stat = dir_stat if dir_stat is not None else os.stat(path)
+    row = self._conn.execute(
+        'SELECT mtime, ino, dirnames, filenames FROM dirs WHERE path = ?', (path,)).fetchone()
+    if row is not None and row[0] == dir_stat.st_mtime and row[1] == dir_stat.st_ino:
+      self.num_cached += 1
+      return (_split_names(row[2]), _split_names(row[3]))
+
+    self.num_listed += 1
+    (dirnames, filenames) = self._list(path)
+    if row is not None:
+      for old_dirname in set(_split_names(row[2])) - set(dirnames):
+        self._forget_subtree(os.path.join(path, old_dirname))
+
+    scan_time = scan_time if scan_time is not None else time.time()
+    mtime = dir_stat.st_mtime
+    if abs(scan_time - mtime) < racy_seconds:
+      mtime = -1.0
+    self._conn.execute(
+        'INSERT OR REPLACE INTO dirs (path, mtime, ino, dirnames, filenames) '
+        'VALUES (?, ?, ?, ?, ?)',
+        (path, mtime, dir_stat.st_ino, _join_names(dirnames), _join_names(filenames)))
+    return (dirnames, filenames)
+
+  def walk(self, top):
+    """
+    Like os.walk(top) (top-down, you can prune the walk by changing dirnames in place, and symlinks
+    to directories are in dirnames but do not get walked), but with the listings of unchanged
+    directories coming from the cache.
+    """
+    self.num_listed = 0
+    self.num_cached = 0
+    scan_time = time.time()
+    stack = [top]
+    try:
+      while stack:
+        dirpath = stack.pop()
+        try:
+          dir_stat = os.stat(dirpath) if dirpath == top else os.lstat(dirpath)
+          if stat.S_ISLNK(dir_stat.st_mode):
+            continue
+          (dirnames, filenames) = self.listdir(dirpath, scan_time, dir_stat)
+        except OSError:
+          # Gone since we listed its parent.
+          self._forget_subtree(dirpath)
+          continue
+        yield (dirpath, dirnames, filenames)
+        stack.extend([os.path.join(dirpath, d) for d in reversed(dirnames)])
+    finally:
+      self.commit()
+      logging.debug("Scanned %s: listed %d directories, %d unchanged from the cache" % \
+          (top, self.num_listed, self.num_cached))
+
+  def commit(self):
+    self._conn.commit()
+
+  def close(self):
+    self._conn.close()
+
+
+class IgnoreRules(object):
+  """
+  Directories not to walk into, in .gitignore syntax: 'name' matches at any depth, a pattern with a
+  slash before its end matches from the top of the walk, '*', '?' and '[...]' match within a name,
+  '**' matches any number of directories, and '!pattern' un-ignores.  The last matching rule wins.
+  Rules only apply to directories, so a trailing slash makes no difference.
+  """
+
+  def __init__(self, patterns=()):
+    super(IgnoreRules, self).__init__()
+
+    # List of (compiled regex for the path relative to the top, b_negate).
+    self._rules = []
+    self.add(patterns)
+
+  @staticmethod
+  def _glob_to_regex(glob):
+    """ Translate a path glob, where '*' and '?' do not match '/' but '**' does. """
+    regex = ''
+    i = 0
+    while i < len(glob):
+      if glob.startswith('**/', i):
+        regex += '(?:.*/)?'
+        i += 3
+      elif glob.startswith('**', i):
+        regex += '.*'
+        i += 2
+      elif glob[i] == '*':
+        regex += '[^/]*'
+        i += 1
+      elif glob[i] == '?':
+        regex += '[^/]'
+        i += 1
+      elif glob[i] == '[' and glob.find(']', i + 1) != -1:
+        end = glob.find(']', i + 1)
+        chars = glob[i + 1:end]
+        regex += '[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']'
+        i = end + 1
+      else:
+        regex += re.escape(glob[i])
+        i += 1
+    return regex
+
+  def add(self, patterns):
+    for pattern in patterns:
+      pattern = pattern.strip()
+      if pattern == '' or pattern.startswith('#'):
+        continue
+      negate = pattern.startswith('!')
+      pattern = pattern.lstrip('!').rstrip('/')
+      if '/' in pattern:
+        regex = self._glob_to_regex(pattern.lstrip('/'))
+      else:
+        regex = '(?:.*/)?' + self._glob_to_regex(pattern)
+      self._rules.append((re.compile('^' + regex + '$'), negate))
+
+  def add_file(self, ignore_file):
+    """ Add the rules in a .gitignore-style file, if it exists. """
+    if not os.path.isfile(ignore_file):
+      return
+    f = open(ignore_file)
+    self.add(f.read().splitlines())
+    f.close()
+
+  def is_ignored(self, rel_path):
+    """ Whether to skip a directory (given as a path relative to the top, with '/'). """
+    ignored = False
+    for (p_rule, negate) in self._rules:
+      if p_rule.match(rel_path):
+        ignored = not negate
+    return ignored
+
+
+class PrunedWalker(object):
+  """
+  Walks a tree like ScanCache.walk, but skips directories that the ignore rules match, and those
+  more than max_depth directories below the top.  Afterwards, num_visited and num_skipped say how
+  many directories it went into and how many it left out.
+  """
+
+  def __init__(self, ignore_rules=None, max_depth=None, cache_file=default_cache_file):
+    super(PrunedWalker, self).__init__()
+    self._ignore_rules = ignore_rules if ignore_rules is not None else IgnoreRules()
+    self._max_depth = max_depth
+    self._cache_file = cache_file
+
+    self.num_visited = 0
+    self.num_skipped = 0
+
+  def walk(self, top):
+    self.num_visited = 0
+    num_subdirs = 0
+    cache = ScanCache(self._cache_file)
+    try:
+      for (dirpath, dirnames, filenames) in cache.walk(top):
+        self.num_visited += 1
+        num_subdirs += len(dirnames)
+
+        rel_dir = dirpath[len(top):].strip(os.sep).replace(os.sep, '/')
+        depth = 0 if rel_dir == '' else rel_dir.count('/') + 1
+        if self._max_depth is not None and depth >= self._max_depth:
+          dirnames[:] = []
+        else:
+          prefix = rel_dir + '/' if rel_dir else ''
+          dirnames[:] = [d for d in dirnames if not self._ignore_rules.is_ignored(prefix + d)]
+
+        yield (dirpath, dirnames, filenames)
+    finally:
+      cache.close()
+      # Everything that we saw in a listing but did not go into (including symlinks).
+      self.num_skipped = num_subdirs - max(0, self.num_visited - 1)
+      logging.info(
+          "Walked %s: visited %d directories (%d listed, %d from the cache), skipped %d" % \
+              (top, self.num_visited, cache.num_listed, cache.num_cached, self.num_skipped))
+
+
+def find_files(top, patterns, walker=None, dir_name=None):
+  """
+  Walk a tree once to find the files for several regexes.  patterns maps a key (e.g., a Kiji
+  target) to a compiled regex for file names.  Return a map from each key to the set of files whose
+  names match its regex.  With dir_name, only look in directories with that name.
+  """
+  walker = walker if walker is not None else PrunedWalker()
+  matches = collections.OrderedDict([(key, set()) for key in patterns])
+  for (dirpath, _, filenames) in walker.walk(top):
+    if dir_name is not None and os.path.basename(dirpath) != dir_name:
+      continue
+    for fname in filenames:
+      for (key, p_file) in patterns.items():
+        if p_file.match(fname):
+          matches[key].add(os.path.join(dirpath, fname))
+  return matches
+
+def get_local_build_walker(root_dir, max_depth=None, cache_file=default_cache_file):
+  """ A PrunedWalker for finding locally-built JARs under root_dir. """
+  ignore_rules = IgnoreRules(local_build_ignore_patterns)
+  ignore_rules.add_file(os.path.join(root_dir, ignore_file_name))
+  return PrunedWalker(ignore_rules, max_depth, cache_file)
+
+def get_bento_walker(max_depth=None, cache_file=default_cache_file):
+  """ A PrunedWalker for finding JARs in a Bento Box. """
+  return PrunedWalker(IgnoreRules(bento_ignore_patterns), max_depth, cache_file)
+
+def walk(top, cache_file=default_cache_file):
+  """ ScanCache.walk, with a ScanCache of its own. """
+  cache = ScanCache(cache_file)
+  try:
+    for entry in cache.walk(top):
+      yield entry
+  finally:
+    cache.close()
+
+def listdir(path, cache_file=default_cache_file):
+  """ ScanCache.listdir, with a ScanCache of its own. """
+  cache = ScanCache(cache_file)
+  try:
+    (dirnames, filenames) = cache.listdir(path)
+    cache.commit()
+    return (dirnames, filenames)
+  finally:
+    cache.close()
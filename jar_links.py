@@ -0,0 +1,249 @@
+#!/usr/bin/env python2.7
+
+"""
+Swaps JARs in a Bento Box for locally-built ones as a single transaction, with a journal that lets
+us put the original JARs back later (or after a crash partway through).
+
+All of the new JARs (symlinks or copies) get staged next to their targets first, and the original
+JARs get hard-linked to *.bak files.  Only then does each staged JAR get renamed over its target, so
+every JAR in lib/ is always either the original or the new one.  The journal (jar-links.json in the
+Bento Box) lists every JAR that we replaced or added, so that rollback() can undo all of them with
+renames, without reinstalling the Bento Box.  Paths within the Bento Box are relative to it in the
+journal, so that it stays right if the Bento Box moves.
+
+"""
+
+import collections
+import json
+import logging
+import os
+import shutil
+
+import script_output
+
+# Journal file within the bento box.
+journal_file_name = 'jar-links.json'
+
+# Suffix for new JARs that have been staged but not renamed into place yet.
+staged_suffix = '.link-tmp'
+
+# Journal states.
+state_staging = 'staging'
+state_committed = 'committed'
+
+
+def get_backup_jar(jar):
+  """ Where the original of a replaced JAR goes (foo.jar -> foo.bak, as we have always done). """
+  return jar.replace('.jar', '.bak')
+
+
+class LinkTransaction(object):
+  """
+  A set of JARs to put into a Bento Box.  Call add() for each JAR, then commit().  Transactions
+  build on each other: the journal keeps the original JAR for every target until rollback().
+  """
+
+  def __init__(self, bento_dir):
+    super(LinkTransaction, self).__init__()
+
+    self._bento_dir = bento_dir
+    self._journal_file = os.path.join(bento_dir, journal_file_name)
+
+    # Map from target JAR to (source JAR, 'symlink' or 'copy').
+    self._plan = collections.OrderedDict()
+
+  def add(self, target_jar, source_jar, mode='symlink'):
+    """ Plan to put source_jar at target_jar (replacing whatever is there now). """
+    assert mode in ('symlink', 'copy'), mode
+    assert os.path.isfile(source_jar), "Cannot link missing JAR %s" % source_jar
+    self._plan[os.path.abspath(target_jar)] = (os.path.abspath(source_jar), mode)
+
+  def _to_journal_path(self, path):
+    """ Paths within the Bento Box are relative to it in the journal; others stay absolute. """
+    if path is None:
+      return None
+    rel_path = os.path.relpath(path, self._bento_dir)
+    return path if rel_path.startswith(os.pardir) else rel_path
+
+  def _from_journal_path(self, path):
+    # Journals from before we made the paths relative have absolute ones, which join() keeps.
+    return None if path is None else os.path.join(os.path.abspath(self._bento_dir), path)
+
+  def _map_entries(self, entries, map_path):
+    """ Apply map_path to every path in some journal entries (target JAR -> entry). """
+    mapped = collections.OrderedDict()
+    for (target_jar, entry) in entries.items():
+      if entry is not None:
+        entry = collections.OrderedDict([
+            ('source', map_path(entry['source'])),
+            ('mode', entry['mode']),
+            ('backup', map_path(entry['backup'])),
+        ])
+      mapped[map_path(target_jar)] = entry
+    return mapped
+
+  def _map_journal(self, journal, map_path):
+    mapped = collections.OrderedDict([
+        ('state', journal['state']),
+        ('entries', self._map_entries(journal['entries'], map_path)),
+    ])
+    if 'pending' in journal:
+      mapped['pending'] = self._map_entries(journal['pending'], map_path)
+    return mapped
+
+  def _read_journal(self):
+    if not os.path.isfile(self._journal_file):
+      return {'state': state_committed, 'entries': collections.OrderedDict()}
+    f = open(self._journal_file)
+    journal = json.load(f, object_pairs_hook=collections.OrderedDict)
+    f.close()
+    return self._map_journal(journal, self._from_journal_path)
+
+  def _write_journal(self, journal):
+    tmp_file = self._journal_file + '.tmp'
+    f = open(tmp_file, 'w')
+    json.dump(self._map_journal(journal, self._to_journal_path), f, indent=2)
+    f.close()
+    os.rename(tmp_file, self._journal_file)
+
+  def _stage(self, target_jar, source_jar, mode):
+    staged_jar = target_jar + staged_suffix
+    if os.path.lexists(staged_jar):
+      os.remove(staged_jar)
+    if mode == 'symlink':
+      os.symlink(source_jar, staged_jar)
+    else:
+      shutil.copyfile(source_jar, staged_jar)
+    return staged_jar
+
+  def _get_backup(self, target_jar, entries):
+    """
+    Where the original of a target JAR is (or will be) backed up: None for a JAR that was not there
+    originally.
+    """
+    if target_jar in entries:
+      return entries[target_jar]['backup']
+    if not os.path.lexists(target_jar):
+      return None
+    return get_backup_jar(target_jar)
+
+  def _back_up(self, target_jar, backup_jar):
+    """ Back up the original of a JAR, unless we already have. """
+    if backup_jar is None or os.path.islink(target_jar) and os.path.isfile(backup_jar):
+      # Nothing to back up, or already linked (maybe before we kept a journal): the .bak file is the
+      # original.
+      return
+    # A hard link, so that the original stays in place until the new JAR gets renamed over it.
+    if os.path.exists(backup_jar):
+      os.remove(backup_jar)
+    os.link(target_jar, backup_jar)
+
+  def commit(self):
+    """ Stage every JAR, back up the originals, then rename the new JARs into place. """
+    if len(self._plan) == 0:
+      return
+
+    journal = self._read_journal()
+    if journal['state'] != state_committed:
+      self._undo_unfinished(journal)
+      journal = self._read_journal()
+
+    # Record what we are about to do before doing any of it, so that a crash at any point can be
+    # undone: the pending entries are what the earlier transactions left for each target (None for
+    # a target that is new to the journal).
+    entries = journal['entries']
+    new_targets = [target_jar for target_jar in self._plan if target_jar not in entries]
+    journal['pending'] = collections.OrderedDict(
+        [(target_jar, entries.get(target_jar)) for target_jar in self._plan])
+    for (target_jar, (source_jar, mode)) in self._plan.items():
+      backup_jar = self._get_backup(target_jar, entries)
+      entries[target_jar] = {'source': source_jar, 'mode': mode, 'backup': backup_jar}
+    journal['state'] = state_staging
+    self._write_journal(journal)
+
+    # Everything that can go wrong (missing JARs, full disk) happens before we touch lib/*.jar.
+    staged = collections.OrderedDict()
+    for (target_jar, (source_jar, mode)) in self._plan.items():
+      staged[target_jar] = self._stage(target_jar, source_jar, mode)
+      if target_jar in new_targets:
+        self._back_up(target_jar, entries[target_jar]['backup'])
+
+    for (target_jar, staged_jar) in staged.items():
+      logging.info("Putting %s at %s..." % (self._plan[target_jar][0], target_jar))
+      os.rename(staged_jar, target_jar)
+      script_output.add_file('linked', target_jar)
+
+    journal['state'] = state_committed
+    del journal['pending']
+    self._write_journal(journal)
+    logging.info("Linked %d JARs into %s" % (len(staged), self._bento_dir))
+
+  def _undo_unfinished(self, journal):
+    """
+    Undo a transaction that never finished (e.g., after a crash), putting its targets back the way
+    the transactions before it left them.  Those earlier transactions stay.
+    """
+    if 'pending' not in journal:
+      # A journal from before we recorded the pending entries, so all we can do is undo everything.
+      logging.info("Found an unfinished JAR link transaction, rolling back all linked JARs")
+      rollback(self._bento_dir)
+      return
+
+    logging.info("Found an unfinished JAR link transaction, undoing it first")
+    entries = journal['entries']
+    for (target_jar, previous) in reversed(list(journal['pending'].items())):
+      _remove_staged(target_jar)
+      if previous is None:
+        _restore_original(target_jar, entries[target_jar])
+        del entries[target_jar]
+      else:
+        # Put the earlier transaction's JAR back (the original stays backed up as it was).
+        os.rename(self._stage(target_jar, previous['source'], previous['mode']), target_jar)
+        entries[target_jar] = previous
+    journal['state'] = state_committed
+    del journal['pending']
+    self._write_journal(journal)
+
+
+def get_linked_jars(bento_dir):
+  """ Return the journal entries (target JAR -> source, mode and backup) for a bento box. """
+  return LinkTransaction(bento_dir)._read_journal()['entries']
+
+def _remove_staged(target_jar):
+  staged_jar = target_jar + staged_suffix
+  if os.path.lexists(staged_jar):
+    os.remove(staged_jar)
+
+def _restore_original(target_jar, entry):
+  """ Put back the original of a JAR from its backup, or remove it if there was no original. """
+  if entry['backup'] is not None and os.path.isfile(entry['backup']):
+    logging.info("Restoring %s..." % target_jar)
+    os.rename(entry['backup'], target_jar)
+    script_output.add_file('restored', target_jar)
+    # If the new JAR never got renamed into place, both names were links to the original and the
+    # rename did nothing.
+    if os.path.exists(entry['backup']):
+      os.remove(entry['backup'])
+  elif entry['backup'] is None and os.path.lexists(target_jar):
+    logging.info("Removing %s..." % target_jar)
+    os.remove(target_jar)
+    script_output.add_file('removed', target_jar)
+
+def rollback(bento_dir):
+  """
+  Put back every original JAR that a transaction replaced, and remove every JAR that one added.
+  Returns the number of JARs restored or removed.
+  """
+  journal_file = os.path.join(bento_dir, journal_file_name)
+  if not os.path.isfile(journal_file):
+    logging.info("No JARs linked into %s" % bento_dir)
+    return 0
+
+  entries = get_linked_jars(bento_dir)
+  for (target_jar, entry) in reversed(list(entries.items())):
+    _remove_staged(target_jar)
+    _restore_original(target_jar, entry)
+
+  os.remove(journal_file)
+  logging.info("Restored %d JARs in %s" % (len(entries), bento_dir))
+  return len(entries)
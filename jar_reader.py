@@ -0,0 +1,193 @@
+#!/usr/bin/env python2.7
+
+"""
+Reads the list of entries (and the manifest) of a JAR without unpacking it.
+
+Everything that we want to know about the classes in a JAR (their names, sizes and CRCs) is in the
+zip central directory at the end of the file.  We mmap the JAR and walk the central directory with
+struct, so only the pages holding the directory get read from disk, and nothing gets decompressed.
+The only entry that we ever decompress is the manifest, and only when asked for it.
+
+"""
+
+import collections
+import mmap
+import os
+import struct
+import zlib
+
+# End of central directory record, and the ZIP64 versions of it.
+eocd_signature = b'PK\x05\x06'
+eocd_struct = struct.Struct('<4sHHHHIIH')
+eocd64_locator_signature = b'PK\x06\x07'
+eocd64_locator_struct = struct.Struct('<4sIQI')
+eocd64_signature = b'PK\x06\x06'
+eocd64_struct = struct.Struct('<4sQHHIIQQQQ')
+
+# Central directory file header, and local file header.
+central_header_signature = b'PK\x01\x02'
+central_header_struct = struct.Struct('<4sHHHHHHIIIHHHHHII')
+local_header_signature = b'PK\x03\x04'
+local_header_struct = struct.Struct('<4sHHHHHIIIHH')
+
+# The zip comment (which comes after the end record) can be up to this long.
+max_comment_length = 0xFFFF
+
+# General purpose flag: the file name is UTF-8.
+flag_utf8 = 0x800
+
+# Compression methods.
+method_stored = 0
+method_deflated = 8
+
+manifest_name = 'META-INF/MANIFEST.MF'
+
+# One entry of a JAR: name, CRC-32 and (uncompressed) size of its contents, and where it is.
+JarEntry = collections.namedtuple(
+    'JarEntry', ['name', 'crc', 'size', 'compressed_size', 'method', 'header_offset'])
+
+
+class BadJarError(Exception):
+  pass
+
+
+def _decode_name(raw_name, flags):
+  """ File names come back the same way as from zipfile. """
+  if isinstance(raw_name, str):
+    # Python 2: a str, unless it is flagged as UTF-8.
+    return raw_name.decode('utf-8') if flags & flag_utf8 else raw_name
+  return raw_name.decode('utf-8' if flags & flag_utf8 else 'cp437')
+
+def _read_zip64_extra(extra, sizes):
+  """
+  Fill in the sizes and offset (in this order: size, compressed size, offset) that did not fit in
+  32 bits from the ZIP64 extra field.
+  """
+  pos = 0
+  while pos + 4 <= len(extra):
+    (header_id, data_size) = struct.unpack_from('<HH', extra, pos)
+    if header_id == 1:
+      data_pos = pos + 4
+      for (i, value) in enumerate(sizes):
+        if value == 0xFFFFFFFF:
+          (sizes[i],) = struct.unpack_from('<Q', extra, data_pos)
+          data_pos += 8
+      break
+    pos += 4 + data_size
+  return sizes
+
+
+class _MappedJar(object):
+  """ A JAR mapped into memory, and where its central directory is. """
+
+  def __init__(self, jar):
+    super(_MappedJar, self).__init__()
+    self.jar = jar
+
+    f = open(jar, 'rb')
+    try:
+      size = os.fstat(f.fileno()).st_size
+      if size < eocd_struct.size:
+        raise BadJarError("%s is too small to be a JAR" % jar)
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      f.close()
+
+    try:
+      (self.num_entries, self.cd_offset) = self._find_central_directory(size)
+    except Exception:
+      self.mm.close()
+      raise
+
+  def _find_central_directory(self, size):
+    eocd_pos = self.mm.rfind(eocd_signature, max(0, size - eocd_struct.size - max_comment_length))
+    if eocd_pos < 0:
+      raise BadJarError("%s is not a zip file" % self.jar)
+    (_, _, _, _, num_entries, _, cd_offset, _) = eocd_struct.unpack_from(self.mm, eocd_pos)
+
+    # Too many entries, or too big, for the old end record: look for the ZIP64 one.
+    locator_pos = eocd_pos - eocd64_locator_struct.size
+    if (num_entries == 0xFFFF or cd_offset == 0xFFFFFFFF) and locator_pos >= 0 and \
+        self.mm[locator_pos:locator_pos + 4] == eocd64_locator_signature:
+      (_, _, eocd64_pos, _) = eocd64_locator_struct.unpack_from(self.mm, locator_pos)
+      fields = eocd64_struct.unpack_from(self.mm, eocd64_pos)
+      if fields[0] != eocd64_signature:
+        raise BadJarError("%s has a bad ZIP64 end of central directory" % self.jar)
+      (num_entries, cd_offset) = (fields[7], fields[9])
+    return (num_entries, cd_offset)
+
+  def entries(self):
+    """ Yield a JarEntry for everything in the central directory, in order. """
+    pos = self.cd_offset
+    for _ in range(self.num_entries):
+      fields = central_header_struct.unpack_from(self.mm, pos)
+      if fields[0] != central_header_signature:
+        raise BadJarError("%s has a bad central directory" % self.jar)
+      (_, _, _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length,
+          comment_length, _, _, _, header_offset) = fields
+      name_pos = pos + central_header_struct.size
+      name = _decode_name(self.mm[name_pos:name_pos + name_length], flags)
+      if 0xFFFFFFFF in (size, compressed_size, header_offset):
+        extra_pos = name_pos + name_length
+        (size, compressed_size, header_offset) = _read_zip64_extra(
+            self.mm[extra_pos:extra_pos + extra_length], [size, compressed_size, header_offset])
+      yield JarEntry(name, crc, size, compressed_size, method, header_offset)
+      pos = name_pos + name_length + extra_length + comment_length
+
+  def read(self, entry):
+    """ The (uncompressed) contents of one entry. """
+    fields = local_header_struct.unpack_from(self.mm, entry.header_offset)
+    if fields[0] != local_header_signature:
+      raise BadJarError("%s has a bad local header for %s" % (self.jar, entry.name))
+    data_pos = entry.header_offset + local_header_struct.size + fields[9] + fields[10]
+    data = self.mm[data_pos:data_pos + entry.compressed_size]
+    if entry.method == method_stored:
+      return data
+    if entry.method == method_deflated:
+      return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+    raise BadJarError("%s: %s uses compression method %d" % (self.jar, entry.name, entry.method))
+
+  def close(self):
+    self.mm.close()
+
+
+def read_jar_index(jar):
+  """ Return a list of the JarEntrys in a JAR (this only reads the zip central directory). """
+  mapped = _MappedJar(jar)
+  try:
+    return list(mapped.entries())
+  finally:
+    mapped.close()
+
+def read_jar_entries(jar):
+  """ Return the names of everything in a JAR (this only reads the zip central directory). """
+  return [entry.name for entry in read_jar_index(jar)]
+
+def parse_manifest(text):
+  """ Return an OrderedDict of the main attributes of a JAR manifest. """
+  attributes = collections.OrderedDict()
+  last_name = None
+  for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+    if line == '':
+      # The main section ends at the first blank line.
+      if len(attributes) > 0:
+        break
+      continue
+    if line.startswith(' ') and last_name is not None:
+      attributes[last_name] += line[1:]
+      continue
+    (name, _, value) = line.partition(':')
+    last_name = name.strip()
+    attributes[last_name] = value.strip()
+  return attributes
+
+def read_manifest(jar):
+  """ Return the main attributes of a JAR's manifest (an empty OrderedDict if it has none). """
+  mapped = _MappedJar(jar)
+  try:
+    for entry in mapped.entries():
+      if entry.name.upper() == manifest_name:
+        return parse_manifest(mapped.read(entry).decode('utf-8', 'replace'))
+    return collections.OrderedDict()
+  finally:
+    mapped.close()
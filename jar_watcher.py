@@ -0,0 +1,280 @@
+#!/usr/bin/env python2.7
+
+"""
+Watches the target/ directories of local Maven builds and reports each JAR as soon as Maven has
+finished writing it.
+
+On Linux we use inotify (through ctypes, so there is nothing to install): a JAR is a candidate when
+a process closes it after writing (or renames it into place).  Elsewhere, or if inotify is not
+available, we poll the directories instead.  Either way, a JAR only gets reported once its size has
+stayed the same for a while and it reads as a zip file, so that we never link a half-written JAR.
+
+Maven's 'clean' removes target/ altogether, so we also watch each build directory, and start
+watching its target/ again when it comes back.
+
+"""
+
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+# inotify event masks (from sys/inotify.h).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# struct inotify_event: int wd, uint32_t mask, cookie, len, then len bytes of name.
+inotify_event = struct.Struct('iIII')
+
+# How long a JAR's size has to stay the same before we believe that Maven is done with it.
+default_debounce_seconds = 2.0
+
+# How often to look at the directories when we cannot use inotify.
+default_poll_seconds = 1.0
+
+
+def _load_libc():
+  """ Return libc if it has inotify, otherwise None. """
+  # ctypes (like zipfile, below) is imported when we start watching, not whenever a script imports
+  # this module for its defaults.
+  import ctypes
+  import ctypes.util
+
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init
+    libc.inotify_add_watch
+  except (OSError, AttributeError):
+    return None
+  return libc
+
+def _to_bytes(path):
+  return path if isinstance(path, bytes) else path.encode('utf-8')
+
+
+class InotifyWatcher(object):
+  """ Reports files in a set of directories that get written and closed, or moved in. """
+
+  def __init__(self, libc):
+    super(InotifyWatcher, self).__init__()
+    self._libc = libc
+    self._fd = libc.inotify_init()
+    if self._fd < 0:
+      import ctypes
+      e = ctypes.get_errno()
+      raise OSError(e, "inotify_init failed: %s" % os.strerror(e))
+
+    # Map from watch descriptor to directory.
+    self._watches = {}
+
+  def watch(self, dir_name, b_files=True):
+    """
+    Watch a directory: for files getting written (if b_files), or only for subdirectories getting
+    created (e.g., a build directory getting its target/ back).
+    """
+    mask = IN_CREATE | IN_DELETE_SELF
+    if b_files:
+      mask |= IN_CLOSE_WRITE | IN_MOVED_TO
+    wd = self._libc.inotify_add_watch(self._fd, _to_bytes(dir_name), mask)
+    if wd < 0:
+      import ctypes
+      e = ctypes.get_errno()
+      raise OSError(e, "Cannot watch %s: %s" % (dir_name, os.strerror(e)))
+    self._watches[wd] = dir_name
+
+  def get_changes(self, timeout):
+    """
+    Wait up to timeout seconds, and return a list of (directory, name, b_dir_created) for the files
+    that got written and the directories that got created.
+    """
+    try:
+      (readable, _, _) = select.select([self._fd], [], [], timeout)
+    except select.error as e:
+      if e.args[0] == errno.EINTR:
+        return []
+      raise
+    if len(readable) == 0:
+      return []
+
+    buf = os.read(self._fd, 64 * 1024)
+    changes = []
+    offset = 0
+    while offset < len(buf):
+      (wd, mask, _, name_len) = inotify_event.unpack_from(buf, offset)
+      offset += inotify_event.size
+      name = buf[offset:offset + name_len].rstrip(b'\0').decode('utf-8')
+      offset += name_len
+
+      if mask & IN_IGNORED:
+        # The directory is gone (e.g., mvn clean).
+        dir_name = self._watches.pop(wd, None)
+        logging.info("Stopped watching %s" % dir_name)
+        continue
+      if wd not in self._watches or name == '':
+        continue
+      changes.append((self._watches[wd], name, bool(mask & IN_ISDIR and mask & IN_CREATE)))
+    return changes
+
+  def close(self):
+    os.close(self._fd)
+
+
+class PollingWatcher(object):
+  """ The same as InotifyWatcher, by looking at the directories every so often. """
+
+  def __init__(self, poll_seconds=default_poll_seconds):
+    super(PollingWatcher, self).__init__()
+    self._poll_seconds = poll_seconds
+
+    # Map from directory to (b_files, map from name to (size, mtime) or None for a subdirectory).
+    self._dirs = {}
+
+  def _scan(self, dir_name):
+    entries = {}
+    try:
+      names = os.listdir(dir_name)
+    except OSError:
+      return None
+    for name in names:
+      try:
+        name_stat = os.stat(os.path.join(dir_name, name))
+      except OSError:
+        continue
+      if os.path.isdir(os.path.join(dir_name, name)):
+        entries[name] = None
+      else:
+        entries[name] = (name_stat.st_size, name_stat.st_mtime)
+    return entries
+
+  def watch(self, dir_name, b_files=True):
+    self._dirs[dir_name] = (b_files, self._scan(dir_name) or {})
+
+  def get_changes(self, timeout):
+    time.sleep(min(timeout, self._poll_seconds))
+    changes = []
+    for (dir_name, (b_files, old_entries)) in list(self._dirs.items()):
+      entries = self._scan(dir_name)
+      if entries is None:
+        logging.info("Stopped watching %s" % dir_name)
+        del self._dirs[dir_name]
+        continue
+      self._dirs[dir_name] = (b_files, entries)
+      for (name, entry) in entries.items():
+        if entry == old_entries.get(name, False):
+          continue
+        if entry is None:
+          changes.append((dir_name, name, True))
+        elif b_files:
+          changes.append((dir_name, name, False))
+    return changes
+
+  def close(self):
+    pass
+
+
+def make_watcher(b_poll=False):
+  """ An InotifyWatcher if we can have one (and b_poll is not set), otherwise a PollingWatcher. """
+  libc = None if b_poll else _load_libc()
+  if libc is not None:
+    try:
+      return InotifyWatcher(libc)
+    except OSError as e:
+      logging.info("Cannot use inotify (%s)" % e)
+  logging.info("Polling for changes every %s seconds" % default_poll_seconds)
+  return PollingWatcher()
+
+def is_complete_jar(jar):
+  """ Whether a JAR has its zip central directory (which gets written last). """
+  import zipfile
+
+  try:
+    return zipfile.is_zipfile(jar)
+  except (IOError, OSError):
+    return False
+
+
+class JarWatcher(object):
+  """
+  Watches the target/ directories of some builds.  Call add_build() for each build, then iterate
+  over watch(), which yields (name, JAR) whenever a build's JAR has been rewritten.
+  """
+
+  def __init__(self, debounce_seconds=default_debounce_seconds, b_poll=False):
+    super(JarWatcher, self).__init__()
+    self._debounce_seconds = debounce_seconds
+    self._watcher = make_watcher(b_poll)
+
+    # Map from target directory to a list of (name, compiled regex for the JAR file name).
+    self._builds = {}
+
+    # JARs that have changed but might still be getting written: JAR -> (name, size, time).
+    self._pending = {}
+
+  def add_build(self, name, build_dir, p_jar):
+    """ Report JARs in build_dir/target whose file name matches p_jar, as belonging to name. """
+    target_dir = os.path.join(build_dir, 'target')
+    if target_dir not in self._builds:
+      self._watcher.watch(build_dir, b_files=False)
+      if os.path.isdir(target_dir):
+        self._watcher.watch(target_dir)
+    self._builds.setdefault(target_dir, []).append((name, p_jar))
+    logging.info("Watching %s for %s" % (target_dir, name))
+
+  def _on_change(self, dir_name, file_name, b_dir_created):
+    if b_dir_created:
+      target_dir = os.path.join(dir_name, file_name)
+      if file_name == 'target' and target_dir in self._builds:
+        logging.info("%s is back, watching it again" % target_dir)
+        self._watcher.watch(target_dir)
+        # The JAR might already be there by the time that we start watching.
+        for name in os.listdir(target_dir):
+          self._on_change(target_dir, name, False)
+      return
+
+    for (name, p_jar) in self._builds.get(dir_name, []):
+      if p_jar.match(file_name):
+        jar = os.path.join(dir_name, file_name)
+        logging.debug("%s changed" % jar)
+        self._pending[jar] = (name, -1, time.time())
+
+  def _get_finished_jars(self):
+    """ Return (name, JAR) for each pending JAR whose size has settled. """
+    finished = []
+    now = time.time()
+    for (jar, (name, size, last_change)) in list(self._pending.items()):
+      try:
+        new_size = os.path.getsize(jar)
+      except OSError:
+        # Gone again (e.g., renamed away, or another clean).
+        del self._pending[jar]
+        continue
+      if new_size != size:
+        self._pending[jar] = (name, new_size, now)
+        continue
+      if now - last_change < self._debounce_seconds:
+        continue
+      del self._pending[jar]
+      if not is_complete_jar(jar):
+        logging.info("%s is not a complete JAR, ignoring it" % jar)
+        continue
+      finished.append((name, jar))
+    return finished
+
+  def watch(self):
+    """ Yield (name, JAR) for every JAR that gets rebuilt, until interrupted. """
+    try:
+      while True:
+        timeout = self._debounce_seconds / 2.0 if self._pending else 60.0
+        for (dir_name, file_name, b_dir_created) in self._watcher.get_changes(timeout):
+          self._on_change(dir_name, file_name, b_dir_created)
+        for (name, jar) in self._get_finished_jars():
+          yield (name, jar)
+    finally:
+      self._watcher.close()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python2.7
+
+"""
+Compares the layout of an installed Kiji table with the CREATE TABLE statement in a schema-shell DDL
+file, so that we only touch the table when the two differ.
+
+We understand enough of the DDL to find the table's locality groups, families and columns (and the
+schemas of the columns).  If the installed table is only missing some families or columns, we
+produce the ALTER TABLE statements to add them.  Anything else (a changed schema, a dropped column,
+a new locality group) means the table has to get dropped and created again.
+
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+
+# Tokens in the DDL: quoted strings, words (identifiers, keywords, class names), punctuation.
+p_ddl_token = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[\w.$:-]+|[(),;=]""")
+
+# Comments in the DDL.
+p_ddl_comment = re.compile(r'/\*.*?\*/|^\s*(#|--).*?$', re.DOTALL | re.MULTILINE)
+
+
+def _normalize_schema(schema):
+  """
+  Turn a JSON Avro schema into a canonical string, so that whitespace does not matter.  The DDL lets
+  you write primitive types without the JSON quotes ("string" rather than "\\"string\\"").
+  """
+  try:
+    return json.dumps(json.loads(schema), sort_keys=True)
+  except ValueError:
+    return json.dumps(schema.strip())
+
+def _unquote(token):
+  """ '"double"' -> 'double' (a JSON string, in double quotes), "'desc'" -> 'desc'. """
+  if token[0] == '"':
+    return json.loads(token)
+  return token[1:-1]
+
+
+class _DdlParser(object):
+  """ Finds the families and columns in the CREATE TABLE statements of a DDL file. """
+
+  def __init__(self, text):
+    super(_DdlParser, self).__init__()
+    self._text = p_ddl_comment.sub(' ', text)
+    self._tokens = [(m.group(0), m.start(), m.end()) for m in p_ddl_token.finditer(self._text)]
+    self._pos = 0
+
+  def _peek(self, offset=0):
+    if self._pos + offset >= len(self._tokens):
+      return None
+    return self._tokens[self._pos + offset][0]
+
+  def _peek_upper(self, offset=0):
+    token = self._peek(offset)
+    return None if token is None else token.upper()
+
+  def _next(self):
+    token = self._tokens[self._pos][0]
+    self._pos += 1
+    return token
+
+  def _raw(self, start_pos, end_pos):
+    """ The original text of tokens start_pos (inclusive) to end_pos (exclusive). """
+    return self._text[self._tokens[start_pos][1]:self._tokens[end_pos - 1][2]]
+
+  def _parse_schema(self):
+    """
+    Parse a column (or map family) schema: [WITH SCHEMA] "json" | CLASS name | COUNTER | ID n.
+    Return (type, value), where value is None if we cannot compare it to an installed layout.
+    """
+    if self._peek_upper() == 'WITH' and self._peek_upper(1) == 'SCHEMA':
+      self._pos += 2
+    token = self._peek()
+    if token is None:
+      return (None, None)
+    if token[0] == '"':
+      self._next()
+      return ('INLINE', _normalize_schema(_unquote(token)))
+    if token.upper() == 'CLASS':
+      self._next()
+      return ('CLASS', self._next())
+    if token.upper() == 'COUNTER':
+      self._next()
+      return ('COUNTER', None)
+    if token.upper() == 'ID':
+      self._pos += 2
+      return ('ID', None)
+    return (None, None)
+
+  def _skip_description(self):
+    if self._peek_upper() == 'WITH' and self._peek_upper(1) == 'DESCRIPTION':
+      self._pos += 3
+
+  def _parse_columns(self):
+    """ Parse a group-type family's column list.  Return an OrderedDict column -> column info. """
+    columns = collections.OrderedDict()
+    assert self._next() == '('
+    while self._peek() != ')':
+      start = self._pos
+      name = self._next()
+      schema = self._parse_schema()
+      self._skip_description()
+      columns[name] = {'schema': schema, 'ddl': self._raw(start, self._pos)}
+      if self._peek() == ',':
+        self._next()
+    self._next()
+    return columns
+
+  def _parse_family(self, locality_group):
+    """ Parse a family declaration, starting at [MAP TYPE | GROUP TYPE] FAMILY. """
+    start = self._pos
+    map_type = False
+    if self._peek_upper(1) == 'TYPE':
+      map_type = self._peek_upper() == 'MAP'
+      self._pos += 2
+    assert self._next().upper() == 'FAMILY'
+    name = self._next()
+
+    family = {
+        'locality_group': locality_group,
+        'map_schema': None,
+        'columns': collections.OrderedDict(),
+    }
+    if map_type:
+      family['map_schema'] = self._parse_schema()
+      self._skip_description()
+    else:
+      self._skip_description()
+      if self._peek() == '(':
+        family['columns'] = self._parse_columns()
+    family['ddl'] = self._raw(start, self._pos)
+    return (name, family)
+
+  def _at_family(self):
+    upper = self._peek_upper()
+    if upper == 'FAMILY':
+      return True
+    return upper in ('MAP', 'GROUP') and self._peek_upper(1) == 'TYPE' and \
+        self._peek_upper(2) == 'FAMILY'
+
+  def _parse_locality_group(self, families):
+    """ Parse LOCALITY GROUP name [WITH DESCRIPTION ...] ( properties and families ). """
+    self._pos += 2
+    locality_group = self._next()
+    self._skip_description()
+    if self._peek() != '(':
+      return locality_group
+    self._next()
+    depth = 1
+    while depth > 0:
+      if self._at_family():
+        (name, family) = self._parse_family(locality_group)
+        families[name] = family
+        continue
+      token = self._next()
+      if token == '(':
+        depth += 1
+      elif token == ')':
+        depth -= 1
+    return locality_group
+
+  def parse(self):
+    """
+    Return a map from table name to table info: its locality groups and an OrderedDict of families.
+    """
+    tables = collections.OrderedDict()
+    while self._peek() is not None:
+      if self._peek_upper() != 'CREATE' or self._peek_upper(1) != 'TABLE':
+        self._next()
+        continue
+      self._pos += 2
+      table_name = self._next()
+      table = {'locality_groups': [], 'families': collections.OrderedDict()}
+      while self._peek() not in (None, ';'):
+        if self._peek_upper() == 'LOCALITY' and self._peek_upper(1) == 'GROUP':
+          table['locality_groups'].append(self._parse_locality_group(table['families']))
+        else:
+          self._next()
+      tables[table_name] = table
+    return tables
+
+
+def parse_ddl(text):
+  """ Return the tables created by the CREATE TABLE statements in some DDL. """
+  return _DdlParser(text).parse()
+
+def parse_ddl_file(ddl_file, cache_file=None):
+  """
+  Parse a DDL file, reusing the parse from the cache file if the DDL has not changed since.
+  """
+  f = open(ddl_file)
+  text = f.read()
+  f.close()
+  checksum = hashlib.sha1(text if isinstance(text, bytes) else text.encode('utf-8')).hexdigest()
+
+  if cache_file is not None and os.path.isfile(cache_file):
+    f = open(cache_file)
+    try:
+      cached = json.load(f, object_pairs_hook=collections.OrderedDict)
+    except ValueError:
+      cached = {}
+    f.close()
+    if cached.get('sha1') == checksum:
+      return cached['tables']
+
+  tables = parse_ddl(text)
+  if cache_file is not None:
+    f = open(cache_file, 'w')
+    json.dump({'sha1': checksum, 'tables': tables}, f, indent=2)
+    f.close()
+  return tables
+
+def _get_installed_schema(column_schema):
+  """ (type, value) for the column_schema of an installed layout, like _DdlParser._parse_schema. """
+  if column_schema is None:
+    return (None, None)
+  schema_type = column_schema.get('type')
+  if schema_type == 'INLINE':
+    return ('INLINE', _normalize_schema(column_schema['value']))
+  if schema_type == 'CLASS':
+    return ('CLASS', column_schema['value'])
+  if schema_type == 'COUNTER':
+    return ('COUNTER', None)
+  return (schema_type, None)
+
+def parse_layout(layout_json):
+  """ Return the locality groups and families of a table layout (as printed by 'kiji layout'). """
+  layout = json.loads(layout_json)
+  table = {'locality_groups': [], 'families': collections.OrderedDict()}
+  for locality_group in layout.get('locality_groups', []):
+    table['locality_groups'].append(locality_group['name'])
+    for family in locality_group.get('families', []):
+      columns = collections.OrderedDict()
+      for column in family.get('columns', []):
+        columns[column['name']] = {'schema': _get_installed_schema(column.get('column_schema'))}
+      table['families'][family['name']] = {
+          'locality_group': locality_group['name'],
+          'map_schema': _get_installed_schema(family.get('map_schema')) \
+              if family.get('map_schema') else None,
+          'columns': columns,
+      }
+  return table
+
+def _schemas_match(wanted, installed):
+  """ Schemas match unless we know both of them and they differ. """
+  if wanted is None or installed is None:
+    return wanted is None and installed is None
+  if wanted[0] is None or installed[0] is None:
+    return True
+  if wanted[0] != installed[0]:
+    return False
+  return wanted[1] is None or installed[1] is None or wanted[1] == installed[1]
+
+def get_alter_statements(table_name, wanted, installed):
+  """
+  Return the ALTER TABLE statements that turn the installed table layout into the wanted one ([] if
+  they already match), or None if that takes more than adding families and columns.
+  """
+  statements = []
+
+  # We cannot add locality groups from here (they have lots of properties).
+  for locality_group in wanted['locality_groups']:
+    if locality_group not in installed['locality_groups']:
+      logging.info("Locality group %s is missing from table %s" % (locality_group, table_name))
+      return None
+
+  # Anything in the installed table that the DDL does not have means we have to start over.
+  for (family_name, family) in installed['families'].items():
+    if family_name not in wanted['families']:
+      logging.info("Table %s has family %s, which is not in the DDL" % (table_name, family_name))
+      return None
+    for column_name in family['columns']:
+      if column_name not in wanted['families'][family_name]['columns']:
+        logging.info("Table %s has column %s:%s, which is not in the DDL" % \
+            (table_name, family_name, column_name))
+        return None
+
+  for (family_name, family) in wanted['families'].items():
+    if family_name not in installed['families']:
+      statements.append('ALTER TABLE %s ADD %s TO LOCALITY GROUP %s;' % \
+          (table_name, family['ddl'], family['locality_group']))
+      continue
+
+    installed_family = installed['families'][family_name]
+    if installed_family['locality_group'] != family['locality_group'] or \
+        not _schemas_match(family['map_schema'], installed_family['map_schema']):
+      logging.info("Family %s of table %s has changed" % (family_name, table_name))
+      return None
+
+    for (column_name, column) in family['columns'].items():
+      if column_name not in installed_family['columns']:
+        statements.append('ALTER TABLE %s ADD COLUMN %s:%s;' % \
+            (table_name, family_name, column['ddl']))
+        continue
+      if not _schemas_match(column['schema'], installed_family['columns'][column_name]['schema']):
+        logging.info("Schema of column %s:%s of table %s has changed" % \
+            (family_name, column_name, table_name))
+        return None
+
+  return statements
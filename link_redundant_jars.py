@@ -4,15 +4,14 @@
 
 import argparse
 import collections
-import functools
 import logging
 import os
 import re
-import shutil
-import subprocess
 import sys
 
-import bento_classpath
+import command_runner
+import jar_discovery
+import script_output
 
 myname = os.path.split(sys.argv[0])[-1]
 description = \
@@ -23,16 +22,7 @@ description = \
 # (makes getting the most-recent version easy - just sort lexographically).
 p_bento = re.compile(r'kiji-bento-(?P<name>\w+)-(?P<version>\d\.\d\.\d)-release\.tar\.gz')
 
-def run(cmd):
-  result = ""
-  try:
-    result = subprocess.check_output(cmd, shell=True)
-  except subprocess.CalledProcessError as e:
-    sys.stderr.write("Error running command '%s'\n" % cmd)
-    sys.stderr.write("Exit code = %s\n" % e.returncode)
-    sys.stderr.write("Output = %s\n" % e.output)
-    raise e
-  return result
+run = command_runner.run
 
 class RedundantJarLinker(object):
 
@@ -42,6 +32,12 @@ class RedundantJarLinker(object):
     # Root bento box directory.
     self._bento_dir = None
 
+    # Where to remember directory listings between runs (see jar_discovery.py), or None.
+    self._scan_cache_file = jar_discovery.default_cache_file
+
+    # What we did, for --format=json (see script_output.py).
+    self._output = script_output.ScriptOutput('link_redundant_jars.py')
+
   def _create_parser(self):
     """ Returns a parser for the script """
 
@@ -77,6 +73,15 @@ class RedundantJarLinker(object):
         default=False,
         help='Do not actually sym link')
 
+    parser.add_argument(
+        '--no-scan-cache',
+        action='store_true',
+        default=False,
+        help='Walk the whole directory to find JARs, rather than only the directories that have\n'
+            'changed since the last run (see jar_discovery.py).')
+
+    script_output.add_arguments(parser)
+
     return parser
 
   def _parse_options(self, cmd_line_args):
@@ -91,12 +96,17 @@ class RedundantJarLinker(object):
     if args.debug:
       logging.basicConfig(level=logging.DEBUG)
 
+    self._output.set_options(args)
+
     self._bento_dir = args.root_dir
     assert os.path.isdir(self._bento_dir)
     logging.info("Bento directory is " + self._bento_dir)
 
     self._do_link = not args.skip_link
 
+    if args.no_scan_cache:
+      self._scan_cache_file = None
+
   def _get_symlink_candidates(self):
     """
     Starting at the Bento root dir, create a map from JAR file names to locations.  For any JAR in
@@ -106,8 +116,8 @@ class RedundantJarLinker(object):
 
     jarsToLocations = collections.defaultdict(set)
 
-    # TODO: Make this more efficient?
-    for (dirpath, _, filenames) in os.walk(os.getcwd()):
+    walker = jar_discovery.get_bento_walker(cache_file=self._scan_cache_file)
+    for (dirpath, _, filenames) in walker.walk(os.getcwd()):
       for fname in filenames:
         if not fname.endswith('.jar'):
           continue
@@ -143,12 +153,13 @@ class RedundantJarLinker(object):
         continue
 
       relpath = os.path.relpath(target_dir, link_dir)
-      print "relpath from %s to %s is %s" % (link_dir, target_dir, relpath)
+      script_output.echo("relpath from %s to %s is %s" % (link_dir, target_dir, relpath))
 
       if self._do_link:
         os.remove(link_jar)
         os.symlink(os.path.join(relpath, jar_name), link_jar)
         self._link_count += 1
+        script_output.add_file('linked', os.path.abspath(link_jar))
 
   def _is_same_size_as_target_jar(self, target_jar, link_jar):
     """ All of the JARs should be the same size, or else something weird is going on... """
@@ -156,14 +167,20 @@ class RedundantJarLinker(object):
     size_b = os.path.getsize(link_jar)
     return size_a == size_b
 
-  def go(self, cmd_line_args):
-    self._parse_options(cmd_line_args)
+  def _run_actions(self):
     old_dir = os.getcwd()
     os.chdir(self._bento_dir)
-    jarsToLocations = self._get_symlink_candidates()
-    self._symlink_jars(jarsToLocations)
-    print "Added %d symlinks" % self._link_count
-    os.chdir(old_dir)
+    try:
+      jarsToLocations = self._output.run_action('find-jars', self._get_symlink_candidates)
+      self._output.run_action('symlink-jars', self._symlink_jars, jarsToLocations)
+    finally:
+      os.chdir(old_dir)
+    script_output.echo("Added %d symlinks" % self._link_count)
+    self._output.set_result('num_symlinks', self._link_count)
+
+  def go(self, cmd_line_args):
+    self._parse_options(cmd_line_args)
+    self._output.run(self._run_actions)
 
 
 if __name__ == "__main__":
@@ -3,16 +3,20 @@
 """ Copies all JARs needed for a project into a bento box lib dir. """
 
 import argparse
-import collections
-import functools
 import logging
 import os
 import re
 import shutil
-import subprocess
 import sys
 
-import bento_classpath
+# classpath_index and jar_conflicts are imported by the actions that use them (see
+# bench_startup.py).
+import bento_instances
+import command_runner
+import jar_discovery
+import jar_links
+import script_output
+import workspace
 
 myname = os.path.split(sys.argv[0])[-1]
 description = \
@@ -23,30 +27,22 @@ description = \
 # (makes getting the most-recent version easy - just sort lexographically).
 p_bento = re.compile(r'kiji-bento-(?P<name>\w+)-(?P<version>\d\.\d\.\d)-release\.tar\.gz')
 
-def run(cmd):
-  result = ""
-  try:
-    result = subprocess.check_output(cmd, shell=True)
-  except subprocess.CalledProcessError as e:
-    sys.stderr.write("Error running command '%s'\n" % cmd)
-    sys.stderr.write("Exit code = %s\n" % e.returncode)
-    sys.stderr.write("Output = %s\n" % e.output)
-    raise e
-  return result
+run = command_runner.run
 
 class JarCopier(object):
 
   # List of commands available to the user.
-  # TODO: Add something to unlink JARs
   possible_actions = [
       'help-actions',
       'unpack-bento',
+      'unlink-jars',
       'copy-kiji-jars',
       'update-lib-jars',
       'copy-cassandra',
       'update-bento-shell-script',
       'copy-phonebook',
       'silence-logging',
+      'check-conflicts',
       'package-bento',
       'make-local',
       'all',
@@ -60,6 +56,7 @@ class JarCopier(object):
       'update-bento-shell-script',
       'copy-phonebook',
       'silence-logging',
+      'check-conflicts',
       'package-bento',
   ]
 
@@ -69,8 +66,13 @@ class JarCopier(object):
         "Assumes you are in a directory with a .tar.gz file "
         "for the appropriate bento build.  If you don't specify a specific build, this script "
         "will use the most-recent tar file in the current directory.  The scripts will rm -rf "
-        "your current bento directory, kill any stale java processes, and untar the .tar.gz file. "
-        "NOTE: This will kill ANY PROCESS that shows up when you run 'jps'.",
+        "your current bento directory, stop any stale java processes, and untar the .tar.gz file. "
+        "Only the JVMs running from the Bento Box get stopped (SIGTERM, then SIGKILL if they take "
+        "too long).",
+
+      'unlink-jars':
+        "Undo copy-kiji-jars and update-lib-jars: put back the original Bento Box JARs and remove "
+        "the ones that were added (this is quick, and does not need the tgz file).",
 
       'copy-kiji-jars':
         "Will copy locally-built JARs to the JARs in your Bento Box.  The "
@@ -97,6 +99,11 @@ class JarCopier(object):
       'silence-logging':
         'Turn off all "INFO" level logging',
 
+      'check-conflicts':
+        "Look for classes that more than one JAR in the Bento Box lib dir has, and for JARs for "
+        "different versions of Scala or Hadoop (see jar_conflicts.py).  Stops before packaging "
+        "the box if there are different versions of Scala or Hadoop, unless --ignore-conflicts.",
+
       'package-bento':
         "Zip up the new cassandra bento box!",
 
@@ -108,9 +115,13 @@ class JarCopier(object):
 
     }
 
-  def __init__(self):
+  def __init__(self, ws=None):
     super(JarCopier, self).__init__()
 
+    # JAR index, classpath cache and process table (see workspace.py).  If None, we make one from
+    # the command-line arguments.
+    self._workspace = ws
+
     # List of different actions for this tool to execute.
     self._actions = None
 
@@ -120,6 +131,15 @@ class JarCopier(object):
     # Kiji JARs to symlink from local builds to the Bento Box lib directories.
     self._link_modules = None
 
+    # Get the classpaths for all of the link modules with one Maven invocation.
+    self._single_reactor = False
+
+    # Package the box even if it has different versions of Scala or Hadoop.
+    self._ignore_conflicts = False
+
+    # What we did, for --format=json (see script_output.py).
+    self._output = script_output.ScriptOutput('make_cassandra_bento.py')
+
   def _create_parser(self):
     """ Returns a parser for the script """
 
@@ -166,6 +186,13 @@ class JarCopier(object):
         default=None,
         help='CSV of modules whose JAR files should get symlinked to Bento lib/*.jar locations (e.g., "model-repository,modeling") [None].')
 
+    parser.add_argument(
+        '--single-reactor',
+        action='store_true',
+        default=False,
+        help='Get the classpaths for all of the --link-modules with one Maven reactor build, rather\n'
+            'than running Maven once per module.')
+
     parser.add_argument(
         '--cassandra-location',
         type=str,
@@ -185,12 +212,36 @@ class JarCopier(object):
         default='kiji-phonebook',
         help='Location of phonebook tutorial, updated for C* [kiji-phonebook].')
 
+    parser.add_argument(
+        '--no-scan-cache',
+        action='store_true',
+        default=False,
+        help='Walk the whole root directory to find JARs, rather than only the directories that\n'
+            'have changed since the last run (see jar_discovery.py).')
+
+    parser.add_argument(
+        '--max-depth',
+        type=int,
+        default=None,
+        help='How many directories below the root directory (or the Bento Box) to look for JARs.\n'
+            'Directories listed in %s in the root directory never get searched. [no limit]' % \
+                jar_discovery.ignore_file_name)
+
+    parser.add_argument(
+        '--ignore-conflicts',
+        action='store_true',
+        default=False,
+        help='For check-conflicts, only warn about different versions of Scala or Hadoop.')
+
+    script_output.add_arguments(parser)
+
     return parser
 
   def _help_actions(self):
     """ Print detailed information about how the different actions work """
     actions_str = ""
     for action in self.possible_actions:
+      if action == 'help-actions': continue
       actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
     print(actions_str)
     sys.exit(0)
@@ -214,15 +265,25 @@ class JarCopier(object):
     if args.debug:
       logging.basicConfig(level=logging.DEBUG)
 
+    self._output.set_options(args)
+
     if args.link_modules == None:
       self._link_modules = []
     else:
       self._link_modules = args.link_modules.split(',')
 
+    self._single_reactor = args.single_reactor
+
+    self._ignore_conflicts = args.ignore_conflicts
+
     self._args_bento_version = args.bento_version
 
-    self._root_dir = args.root_dir
-    assert os.path.isdir(self._root_dir)
+    if self._workspace is None or self._workspace.root_dir != os.path.abspath(args.root_dir):
+      self._workspace = workspace.Workspace(
+          args.root_dir,
+          scan_cache_file=None if args.no_scan_cache else jar_discovery.default_cache_file,
+          max_depth=args.max_depth)
+    self._root_dir = self._workspace.root_dir
 
     self._actions = args.action
     for action in self._actions:
@@ -257,18 +318,10 @@ class JarCopier(object):
   # Stuff for installing the Bento Box
 
   def _kill_stale_java_processes(self):
-    logging.info("Killing stale Java processes.")
-    jps_results = run('jps')
-
-    # Kill all of the bento processes
-    for line in jps_results.splitlines():
-      toks = line.split()
-      if len(toks) == 1: continue
-      assert len(toks) == 2, toks
-      (pid, job) = toks
-      if job == 'Jps': continue
-      cmd = "kill -9 " + pid
-      run(cmd)
+    logging.info("Stopping stale Java processes.")
+    # Only the ones running from the Bento Box, and then wait for its ports to be free.
+    self._workspace.kill_java_processes(
+        self._bento_dir, bento_instances.get_box_ports(self._bento_dir))
 
   def _find_bento_tgz(self, bento_version_or_none):
     """
@@ -321,101 +374,34 @@ class JarCopier(object):
 
     # Untar the bento box, possibly deleting the previous install.
     self._untar_bento(bento_tgz)
+    self._workspace.forget_bento_jars(self._bento_dir)
 
 
   #-------------------------------------------------------------------------------------------------
   # Stuff for linking the Bento JARs
+  def _get_kiji_targets(self, kiji_target):
+    """ kiji_target and the targets of all of the --link-modules, so one walk finds them all. """
+    return [kiji_target] + \
+        ['kiji-' + module for module in self._link_modules if 'kiji-' + module != kiji_target]
+
   def _get_locally_built_jar_for_target(self, kiji_target):
     """
-    Return the JAR created by maven for this Kiji target.  Some of the Kiji projects have submodules
-    that may contain the JAR files.
+    Return the JAR created by maven for this Kiji target (looking for those of all of the
+    --link-modules at the same time).
     """
-
-    # If you are building locally, the the JAR should look like:
-    # <kiji target>-x.y.z-SNAPSHOT.jar
-    p_jar = re.compile(kiji_target + r'-(?P<version>\d+\.\d+\.\d+)-SNAPSHOT.jar')
-
-    # Hopefully we'll get only one of these!
-    matching_jars = set()
-
-    # TODO: Make this more efficient?
-    for (dirpath, _, filenames) in os.walk(self._root_dir):
-      # Only count JARs found within target/ (not within target/something/lib, for example).
-      assert os.path.split(dirpath)[1] != ''
-      if os.path.split(dirpath)[1] != 'target':
-        continue
-
-      for fname in filenames:
-        m_jar = p_jar.match(fname)
-        if m_jar:
-          matching_jars.add(os.path.join(dirpath, fname))
-
-    logging.info("Matching JARs for Kiji target " + kiji_target + ":")
-    for jar in sorted(matching_jars):
-      logging.info("\t" + jar)
-
-    assert len(matching_jars) != 0, "Did not find any JARs built by Maven for %s!" % kiji_target
-    assert len(matching_jars) == 1, \
-        "Found multiple potential matches for JARs built by Maven for target %s!\n%s" % \
-            (kiji_target, matching_jars)
-
-    return list(matching_jars)[0]
+    return self._workspace.get_local_jar(kiji_target, self._get_kiji_targets(kiji_target))
 
   def _get_bento_jars_for_target(self, kiji_target):
-    """
-    Go into the bento lib directory and find the JAR file for this target (some of these, like
-    kiji-mapreduce, are tricky and will need hard-coding).
-    """
-    all_jars = set()
-
-    # Create a regex to match a jar for this kiji target
-    p_jar = re.compile(kiji_target + r'-\d+\.\d+\.\d+.jar')
-
-    for (dirpath, _, filenames) in os.walk(self._bento_dir):
+    """ Return the JAR files for this target in the Bento Box lib directory. """
+    return self._workspace.get_bento_jars(
+        self._bento_dir, kiji_target, self._get_kiji_targets(kiji_target))
 
-      for fname in filenames:
-        if fname.startswith(kiji_target) and fname.endswith('.jar'):
-          m_jar = p_jar.match(fname)
-
-          # Make sure that you aren't doing something like sym linking 'kiji-scoring' to
-          # 'kiji-scoring-server'
-          if not m_jar: continue
-
-          all_jars.add(os.path.join(dirpath, fname))
-
-    logging.info("Bento Box JARs found for Kiji target " + kiji_target + ":")
-    for bento_jar in all_jars:
-      logging.info('\t' + bento_jar)
-
-    return all_jars
-
-  def _backup_bento_jar(self, bento_jar):
+  def _do_action_copy_kiji_jars(self):
     """
-    Back up this Bento Box JAR to a .bak file.  If the current JAR file is a sym link, remove that
-    link (since we are about to relink).
+    Copy all of the modules specified here to the appropriate <bento location>/lib/*.jar file.  All
+    of the copies happen in one transaction, which unlink-jars can undo.
     """
-    backup_jar = bento_jar.replace('.jar', '.bak')
-
-    # If the current JAR is a symlink, then it should already have been backed up.  Just delete the
-    # symlink and return.
-    if os.path.islink(bento_jar):
-      assert os.path.isfile(backup_jar)
-      os.remove(bento_jar)
-      logging.info("Bento JAR %s is already backed up.  Remove symlink." % bento_jar)
-      return
-
-    logging.info("Backing up JAR file %s to %s..." % (bento_jar, backup_jar))
-    os.rename(bento_jar, backup_jar)
-    assert os.path.isfile(backup_jar)
-
-  def _symlink_local_jar_to_bento(self, local_jar, bento_jar):
-    assert not os.path.isfile(bento_jar), \
-        "Bento JAR %s should not exist - it should have already been moved to *.bak" % bento_jar
-    logging.info("Copying %s to %s..." % (local_jar, bento_jar))
-    shutil.copyfile(local_jar, bento_jar)
-
-  def _do_action_copy_kiji_jars(self):
-    """ Link all of the modules specified here to the appropriate <bento location>/lib/*.jar file. """
+    transaction = jar_links.LinkTransaction(self._bento_dir)
     for module in self._link_modules:
       kiji_target = 'kiji-' + module
 
@@ -426,10 +412,14 @@ class JarCopier(object):
       # There can be more than one JAR for each target (bento redundancies).
       bento_jar_list = self._get_bento_jars_for_target(kiji_target)
 
-      # Back up the bento file and symlink the new file!
+      # Back up the bento file and copy in the new file!
       for bento_jar in bento_jar_list:
-        self._backup_bento_jar(bento_jar)
-        self._symlink_local_jar_to_bento(local_jar, bento_jar)
+        transaction.add(bento_jar, local_jar, 'copy')
+    transaction.commit()
+
+  def _do_action_unlink_jars(self):
+    """ Put back all of the original Bento Box JARs, and remove the ones that we added. """
+    jar_links.rollback(self._bento_dir)
 
   def _do_action_link_classpath(self):
     # Create a classpath variable with the classpaths for *all* of the different modules that we
@@ -445,7 +435,7 @@ class JarCopier(object):
       "locally-built Kiji projects you specified.  Note that if those locally-build " + \
       "have vastly different dependencies than your bento box (e.g., different scala " + \
       "versions), then sourcing '%s' may hose everything."
-    print(msg % (src_file, var_name, src_file))
+    script_output.echo(msg % (src_file, var_name, src_file))
 
   def _do_action_run_bento(self):
     """ Just call "bento start" """
@@ -481,60 +471,14 @@ class JarCopier(object):
 
   def get_dependency_jars(self):
     """
-    For every one of the modules that we are linking, add more stuff to the classpath.
-
+    For every one of the modules that we are linking, add more stuff to the classpath (the
+    Workspace keeps the classpaths from Maven, and only asks again when a pom.xml changes).
     """
-
-    def _get_dependencies_for_building_target(local_jar):
-      """
-      Use the Bento classpath script to get the dependencies for building this JAR.  The build
-      directory should just be the root directory of this JAR file.
-      """
-      assert os.path.isfile(local_jar)
-      assert local_jar.endswith('.jar')
-
-      target_dir = os.path.dirname(local_jar)
-      assert os.path.isdir(target_dir)
-      assert target_dir.endswith('target')
-
-      dirs = target_dir.split('/')
-      assert dirs[-1] == 'target'
-      build_dir = '/'.join(dirs[:-1])
-      assert os.path.isdir(build_dir)
-
-      logging.info("Getting dependency JARs from %s..." % build_dir)
-
-      # Cache the current PWD, switch directories for the call to this script, then switch back.
-      cwd = os.getcwd()
-      os.chdir(build_dir)
-
-      # Run the script that puts all of the dependencies into a file.
-      bentocp = bento_classpath.BentoClasspath()
-      bentocp.go('-f'.split())
-
-      os.chdir(cwd)
-
-      logging.info("...Done")
-
-      return bentocp.dependencies
-
-    # Capture all of the JARs in the classpaths for all of these projects in a big set.  If the
-    # ordering of these JARs matters, then we may need to do something smarter here (and we are
-    # probably dead).
-    dependency_jars = []
-
-    for module in self._link_modules:
-      kiji_target = 'kiji-' + module
-
-      # Get the JAR file location in the target's target/ directory
-      local_jar = self._get_locally_built_jar_for_target(kiji_target)
-
-      #dependency_jars.update(_get_dependencies_for_building_target(local_jar))
-      dependency_jars.extend(_get_dependencies_for_building_target(local_jar))
-
-    logging.info("Found %s unique dependencies." % len(dependency_jars))
-
-    return dependency_jars
+    # Get the JAR file locations in the targets' target/ directories
+    local_jars = [
+        self._get_locally_built_jar_for_target('kiji-' + module) for module in self._link_modules
+    ]
+    return self._workspace.get_dependency_jars(local_jars, self._single_reactor)
 
   def _get_jar_file_name(self, jar_full_path):
     return os.path.basename(jar_full_path)
@@ -611,12 +555,13 @@ class JarCopier(object):
 
     return True
 
-  def _copy_jar_to_bento_lib(self, jar_full_path):
+  def _copy_jar_to_bento_lib(self, jar_full_path, transaction):
     logging.info("Adding JAR %s..." % jar_full_path)
     #logging.info('\tProject name = %s' % self._get_jar_project_name(jar_full_path))
-    shutil.copyfile(jar_full_path,
-        os.path.join(self._bento_dir, 'lib', self._get_jar_file_name(jar_full_path))
-    )
+    transaction.add(
+        os.path.join(self._bento_dir, 'lib', self._get_jar_file_name(jar_full_path)),
+        jar_full_path,
+        'copy')
 
   def _update_added_jars(self, jar_full_path, added_jars):
     project_name = self._get_jar_project_name(jar_full_path)
@@ -637,15 +582,31 @@ class JarCopier(object):
 
     dependency_jars = self.get_dependency_jars()
 
-    # Go through all of the JARs, copying them to the Bento lib if necessary.
+    # Go through all of the JARs, copying them to the Bento lib if necessary (all in one go, which
+    # unlink-jars can undo).
+    transaction = jar_links.LinkTransaction(self._bento_dir)
     for jar in dependency_jars:
       if not self._should_copy_jar_to_bento_lib(jar, added_jars, original_jars):
         continue
 
-      self._copy_jar_to_bento_lib(jar)
+      self._copy_jar_to_bento_lib(jar, transaction)
 
       # TODO: Update added jars
       self._update_added_jars(jar, added_jars)
+    transaction.commit()
+
+  def _do_action_check_conflicts(self):
+    """ Check the lib dir for duplicate classes and for Scala / Hadoop version clashes. """
+    import jar_conflicts
+
+    report = jar_conflicts.check_jars(jar_conflicts.get_lib_jars(self._bento_dir))
+    for name in ['Scala', 'Hadoop']:
+      if name not in report.version_clashes:
+        continue
+      message = "The Bento Box has more than one version of %s: %s" % \
+          (name, ', '.join(report.version_clashes[name].keys()))
+      assert self._ignore_conflicts, message + " (use --ignore-conflicts to package it anyway)"
+      logging.warning(message)
 
   #-------------------------------------------------------------------------------------------------
   # Code for copying Cassandra.
@@ -700,13 +661,17 @@ class JarCopier(object):
   def _do_action_package_bento(self):
     """ tar up the updated bento dir. """
     target_dir = os.path.join(self._bento_dir, '..')
-    cmd = 'cd %s; tar -czvf %s %s' % (
+    # The JAR link journal describes this install, not the Bento Box that someone untars elsewhere.
+    cmd = 'cd %s; tar -czvf %s --exclude=%s --exclude=%s.tmp %s' % (
         target_dir,
         self._cassandra_bento_name,
+        jar_links.journal_file_name,
+        jar_links.journal_file_name,
         os.path.relpath(self._bento_dir, target_dir))
     run(cmd)
     assert os.path.isfile(self._cassandra_bento_name)
-    print "Your new bento box is here: %s" % self._cassandra_bento_name
+    script_output.add_file('written', os.path.abspath(self._cassandra_bento_name))
+    script_output.echo("Your new bento box is here: %s" % self._cassandra_bento_name)
 
   #-------------------------------------------------------------------------------------------------
   # Code for copying the phonebook tutorial.
@@ -753,34 +718,48 @@ class JarCopier(object):
     f.close()
 
   def _run_actions(self):
+    run_action = self._output.run_action
+
     if 'unpack-bento' in self._actions:
-      self._do_action_install_bento()
+      run_action('unpack-bento', self._do_action_install_bento)
     assert os.path.isdir(self._bento_dir)
 
+    if 'unlink-jars' in self._actions:
+      run_action('unlink-jars', self._do_action_unlink_jars)
+
     if 'copy-kiji-jars' in self._actions:
-      self._do_action_copy_kiji_jars()
+      run_action('copy-kiji-jars', self._do_action_copy_kiji_jars)
 
     if 'update-lib-jars' in self._actions:
-      self._do_action_update_lib_jars()
+      run_action('update-lib-jars', self._do_action_update_lib_jars)
+
+    # Keep the classpath index (if there is one) in sync with any JARs that we just changed.
+    import classpath_index
+    run_action(
+        'rebuild-classpath-index',
+        classpath_index.ClasspathIndexer(self._bento_dir).rebuild_if_stale)
 
     if 'copy-cassandra' in self._actions:
-      self._do_action_copy_cassandra()
+      run_action('copy-cassandra', self._do_action_copy_cassandra)
 
     if 'update-bento-shell-script' in self._actions:
-      self._do_action_update_bento_shell_script()
+      run_action('update-bento-shell-script', self._do_action_update_bento_shell_script)
 
     if 'copy-phonebook' in self._actions:
-      self._do_action_copy_phonebook()
+      run_action('copy-phonebook', self._do_action_copy_phonebook)
 
     if 'silence-logging' in self._actions:
-      self._do_action_silence_logging()
+      run_action('silence-logging', self._do_action_silence_logging)
+
+    if 'check-conflicts' in self._actions:
+      run_action('check-conflicts', self._do_action_check_conflicts)
 
     if 'package-bento' in self._actions:
-      self._do_action_package_bento()
+      run_action('package-bento', self._do_action_package_bento)
 
   def go(self, cmd_line_args):
     self._parse_options(cmd_line_args)
-    self._run_actions()
+    self._output.run(self._run_actions)
 
 if __name__ == "__main__":
   foo = JarCopier()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2.7
+
+"""
+Turns Maven coordinates into JARs in the local Maven repository (or in local checkouts, for
+SNAPSHOT builds), with a cache of resolved paths that is shared between runs.
+
+Every path gets checked up front, and if any JAR is missing we die with a list of all of them,
+rather than letting a JVM fall over on the first one minutes later.
+
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+
+# Coordinates look like groupId:artifactId:version[:classifier].
+p_coordinate = re.compile(r'^(?P<group>[^:]+):(?P<artifact>[^:]+):(?P<version>[^:]+)(:(?P<classifier>[^:]+))?$')
+
+# Version of a locally-built SNAPSHOT JAR, e.g., kiji-modeling-0.8.0-SNAPSHOT.jar -> 0.8.0.
+p_snapshot_version = re.compile(r'-(?P<version>\d+(\.\d+)*)-SNAPSHOT\.jar$')
+
+
+def get_default_repo_dir():
+  return os.path.join(os.environ['HOME'], '.m2', 'repository')
+
+def _version_key(version):
+  return tuple([int(x) for x in version.split('.')])
+
+
+class MavenResolver(object):
+  """
+  Resolves coordinates to JAR paths.  If given a cache file, remembers each classpath that it
+  resolved, along with the sizes and modification times of the JARs and of the directories that it
+  searched for SNAPSHOT JARs.  Later runs then only have to stat those to know that nothing changed.
+  """
+
+  def __init__(self, repo_dir=None, cache_file=None):
+    super(MavenResolver, self).__init__()
+
+    self._repo_dir = repo_dir if repo_dir is not None else get_default_repo_dir()
+    self._cache_file = cache_file
+
+    # Map from a description of what to resolve to what we resolved it to last time.
+    self._cache = {}
+
+    if self._cache_file is not None and os.path.isfile(self._cache_file):
+      f = open(self._cache_file)
+      try:
+        self._cache = json.load(f)
+      except ValueError:
+        logging.warning("Ignoring corrupt Maven resolver cache %s" % self._cache_file)
+      f.close()
+
+  def get_repo_path(self, coordinate):
+    """ Return where a coordinate's JAR lives in the local repository (whether or not it exists). """
+    m_coordinate = p_coordinate.match(coordinate)
+    assert m_coordinate, "Bad Maven coordinate '%s' (want groupId:artifactId:version)" % coordinate
+
+    artifact = m_coordinate.group('artifact')
+    version = m_coordinate.group('version')
+    jar_name = '%s-%s' % (artifact, version)
+    if m_coordinate.group('classifier'):
+      jar_name += '-' + m_coordinate.group('classifier')
+
+    return os.path.join(
+        self._repo_dir,
+        os.path.join(*m_coordinate.group('group').split('.')),
+        artifact,
+        version,
+        jar_name + '.jar')
+
+  def _get_snapshot_dirs(self, checkout_dir):
+    """ The directories whose contents decide which SNAPSHOT JAR find_local_snapshot picks. """
+    # New submodules (or new target/ dirs within them) change the mtime of the directory above.
+    return [checkout_dir, os.path.join(checkout_dir, 'target')] + \
+        glob.glob(os.path.join(checkout_dir, '*', '')) + \
+        glob.glob(os.path.join(checkout_dir, '*', 'target'))
+
+  def find_local_snapshot(self, checkout_dir, artifact_id):
+    """
+    Return the newest SNAPSHOT JAR for artifact_id built in this checkout (in target/ or in
+    <submodule>/target/), or None.
+    """
+    candidates = []
+    for pattern in ['target', os.path.join('*', 'target')]:
+      candidates.extend(glob.glob(os.path.join(
+          checkout_dir, pattern, '%s-*-SNAPSHOT.jar' % artifact_id)))
+
+    versioned = []
+    for jar in candidates:
+      m_version = p_snapshot_version.search(jar)
+      # Skip, e.g., kiji-modeling-examples-0.8.0-SNAPSHOT.jar when looking for kiji-modeling.
+      if not m_version or os.path.basename(jar) != '%s%s' % (artifact_id, m_version.group(0)):
+        continue
+      versioned.append((_version_key(m_version.group('version')), os.path.getmtime(jar), jar))
+
+    if len(versioned) == 0:
+      return None
+    return max(versioned)[2]
+
+  def _stat_all(self, paths):
+    """
+    Stat all of the paths in one go.  Return a map from path to [size, mtime] (None if missing), in
+    a form that we can store in (and compare with) the JSON cache.
+    """
+    stats = {}
+    for path in paths:
+      try:
+        path_stat = os.stat(path)
+        stats[path] = [path_stat.st_size, int(path_stat.st_mtime)]
+      except OSError:
+        stats[path] = None
+    return stats
+
+  def _get_cached(self, key):
+    """ Return the cached paths for this key, if nothing that they depend on has changed. """
+    entry = self._cache.get(key)
+    if entry is None:
+      return None
+    if self._stat_all(entry['stats'].keys()) != entry['stats']:
+      logging.debug("Maven resolver cache entry is out of date")
+      return None
+    return entry['paths']
+
+  def resolve(self, coordinates, local_snapshots=None):
+    """
+    Resolve a list of coordinates, plus (optionally) a list of (checkout dir, artifactId) pairs for
+    locally-built SNAPSHOT JARs.  Return a list of JAR paths, in the same order.  Dies with a report
+    of every JAR that could not be found.
+    """
+    local_snapshots = local_snapshots or []
+    key = json.dumps([self._repo_dir, list(coordinates), [list(p) for p in local_snapshots]])
+
+    paths = self._get_cached(key)
+    if paths is not None:
+      return paths
+
+    paths = [self.get_repo_path(coordinate) for coordinate in coordinates]
+    stats = self._stat_all(paths)
+    missing = [
+        "%s (expected %s)" % (coordinate, path)
+        for (coordinate, path) in zip(coordinates, paths) if stats[path] is None
+    ]
+
+    for (checkout_dir, artifact_id) in local_snapshots:
+      stats.update(self._stat_all(self._get_snapshot_dirs(checkout_dir)))
+      path = self.find_local_snapshot(checkout_dir, artifact_id)
+      if path is None:
+        missing.append("%s (no %s-*-SNAPSHOT.jar in %s/target or %s/*/target)" % \
+            (artifact_id, artifact_id, checkout_dir, checkout_dir))
+        continue
+      stats.update(self._stat_all([path]))
+      paths.append(path)
+
+    assert len(missing) == 0, \
+        "Could not find %d JARs needed for the classpath:\n\t%s" % (len(missing), '\n\t'.join(missing))
+
+    self._cache[key] = {'paths': paths, 'stats': stats}
+    self._save()
+    return paths
+
+  def _save(self):
+    if self._cache_file is None:
+      return
+    tmp_file = self._cache_file + '.tmp'
+    f = open(tmp_file, 'w')
+    json.dump(self._cache, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(tmp_file, self._cache_file)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python2.7
+
+"""
+Writes the model container JSON for a PMML model without starting a JVM.
+
+This does the same job as 'kiji model-repo pmml' (the PMML wizard): read the model's name and
+fields out of the PMML file, and describe the score function that runs the model, the table and
+column that it reads and writes, and the Avro record that it produces.
+
+The PMML file gets read with iterparse, and we stop as soon as we have the data dictionary and the
+top-level model's mining schema and outputs, so a big ensemble model never gets loaded into memory.
+
+"""
+
+import collections
+import json
+import logging
+import xml.etree.ElementTree as ElementTree
+
+# What the PMML wizard puts in a model container.
+model_container_record_version = 'model_container-0.1.0'
+pmml_score_function_class = 'org.kiji.scoring.lib.PMMLScoreFunction'
+pmml_parameter_prefix = pmml_score_function_class + '.'
+
+# Elements that can be the model in a PMML file.
+pmml_model_elements = set([
+    'AssociationModel', 'BaselineModel', 'ClusteringModel', 'GeneralRegressionModel',
+    'MiningModel', 'NaiveBayesModel', 'NearestNeighborModel', 'NeuralNetwork', 'RegressionModel',
+    'RuleSetModel', 'Scorecard', 'SequenceModel', 'SupportVectorMachineModel', 'TextModel',
+    'TimeSeriesModel', 'TreeModel',
+])
+
+# Avro types for PMML data types.
+pmml_to_avro_types = {
+    'string': 'string',
+    'integer': 'int',
+    'float': 'float',
+    'double': 'double',
+    'boolean': 'boolean',
+}
+
+
+def _local_name(tag):
+  """ '{http://www.dmg.org/PMML-4_1}DataField' -> 'DataField' """
+  return tag.rsplit('}', 1)[-1]
+
+
+class PmmlSummary(object):
+  """ The parts of a PMML file that go into a model container. """
+
+  def __init__(self):
+    super(PmmlSummary, self).__init__()
+
+    # PMML version, model element (e.g., 'RegressionModel') and its attributes.
+    self.pmml_version = None
+    self.model_type = None
+    self.model_name = None
+    self.function_name = None
+
+    # Map from field name to PMML data type, from the DataDictionary.
+    self.data_fields = collections.OrderedDict()
+
+    # Fields that the top-level model uses, by usage type ('active', 'predicted', ...).
+    self.mining_fields = collections.OrderedDict()
+
+    # Map from output field name to data type (None if not given) from the model's Output.
+    self.output_fields = collections.OrderedDict()
+
+  def get_predicted_fields(self):
+    return [name for (name, usage) in self.mining_fields.items() if usage in ('predicted', 'target')]
+
+  def get_active_fields(self):
+    return [name for (name, usage) in self.mining_fields.items() if usage == 'active']
+
+
+def read_pmml_summary(pmml_file):
+  """ Stream through a PMML file, reading only up to the top-level model's schema. """
+  summary = PmmlSummary()
+
+  # Path from the root to the current element, by local name.
+  path = []
+  for (event, elem) in ElementTree.iterparse(pmml_file, events=('start', 'end')):
+    name = _local_name(elem.tag)
+
+    if event == 'start':
+      path.append(name)
+      if name == 'PMML':
+        summary.pmml_version = elem.get('version')
+      elif len(path) == 2 and name in pmml_model_elements:
+        summary.model_type = name
+        summary.model_name = elem.get('modelName')
+        summary.function_name = elem.get('functionName')
+      elif summary.model_type is not None and len(path) == 3 and \
+          name not in ('Extension', 'MiningSchema', 'Output', 'ModelStats', 'ModelExplanation',
+              'Targets', 'LocalTransformations'):
+        # Past the schema of the top-level model, into the model itself (e.g., the segments of an
+        # ensemble).  We have everything that we need.
+        break
+      continue
+
+    # End of an element: everything in it has been read.
+    path.pop()
+    if name == 'DataField' and path[-1:] == ['DataDictionary']:
+      summary.data_fields[elem.get('name')] = elem.get('dataType')
+    elif name == 'MiningField' and len(path) == 3 and path[-1] == 'MiningSchema':
+      summary.mining_fields[elem.get('name')] = elem.get('usageType', 'active')
+    elif name == 'OutputField' and len(path) == 3 and path[-1] == 'Output':
+      summary.output_fields[elem.get('name')] = elem.get('dataType')
+
+    # Do not keep around anything that we have already looked at.
+    if len(path) <= 2:
+      elem.clear()
+
+  assert summary.model_type is not None, "No model in PMML file %s" % pmml_file
+  return summary
+
+def get_result_record_schema(summary, record_name):
+  """ Avro schema for the record that the score function writes: predicted fields and outputs. """
+  fields = []
+  for field in summary.get_predicted_fields() + list(summary.output_fields.keys()):
+    if field in [f['name'] for f in fields]:
+      continue
+    data_type = summary.output_fields.get(field) or summary.data_fields.get(field) or 'double'
+    fields.append(collections.OrderedDict([
+        ('name', field),
+        ('type', pmml_to_avro_types.get(data_type, 'string')),
+    ]))
+  return collections.OrderedDict([
+      ('type', 'record'),
+      ('name', record_name),
+      ('fields', fields),
+  ])
+
+def make_model_container(
+    pmml_file,
+    pmml_uri,
+    table_uri,
+    model_name,
+    model_version,
+    predictor_column,
+    result_column,
+    result_record_name=None):
+  """ Return the model container for a PMML model, as an OrderedDict ready for json.dump. """
+  summary = read_pmml_summary(pmml_file)
+  logging.info("PMML %s model '%s' predicts %s from %d fields" % (
+      summary.model_type, summary.model_name, summary.get_predicted_fields(),
+      len(summary.get_active_fields())))
+
+  if result_record_name is None:
+    result_record_name = ''.join([p.capitalize() for p in model_name.split('.')[-1].split('_')]) + \
+        'Predicted'
+
+  parameters = collections.OrderedDict([
+      ('model-file', pmml_uri),
+      ('model-name', summary.model_name or model_name),
+      ('model-version', model_version),
+      ('predictor-column', predictor_column),
+      ('result-record-schema', json.dumps(get_result_record_schema(summary, result_record_name))),
+  ])
+
+  return collections.OrderedDict([
+      ('model_name', model_name),
+      ('model_version', model_version),
+      ('score_function_class', pmml_score_function_class),
+      ('parameters', collections.OrderedDict(
+          [(pmml_parameter_prefix + k, v) for (k, v) in parameters.items()])),
+      ('table_uri', table_uri),
+      ('column_name', result_column),
+      ('record_version', model_container_record_version),
+  ])
+
+def write_model_container(container, container_file):
+  f = open(container_file, 'w')
+  json.dump(container, f, indent=2)
+  f.write('\n')
+  f.close()
+
+def compare_model_containers(expected_file, actual_file):
+  """
+  Compare two model container files (e.g., from the PMML wizard and from here).  Return a list of
+  differences (empty if they match).
+  """
+  def _load(container_file):
+    f = open(container_file)
+    container = json.load(f)
+    f.close()
+    return container
+
+  def _compare(expected, actual, where, differences):
+    if isinstance(expected, dict) and isinstance(actual, dict):
+      for key in sorted(set(expected.keys()) | set(actual.keys())):
+        _compare(expected.get(key), actual.get(key), where + '/' + key, differences)
+      return
+    # Some values (e.g., schemas) are JSON strings themselves - compare what they hold.
+    if isinstance(expected, type(u'')) and isinstance(actual, type(u'')):
+      try:
+        (expected, actual) = (json.loads(expected), json.loads(actual))
+        if isinstance(expected, dict):
+          _compare(expected, actual, where, differences)
+          return
+      except ValueError:
+        pass
+    if expected != actual:
+      differences.append("%s: expected %r, got %r" % (where or '/', expected, actual))
+
+  differences = []
+  _compare(_load(expected_file), _load(actual_file), '', differences)
+  return differences
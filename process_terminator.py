@@ -0,0 +1,243 @@
+#!/usr/bin/env python2.7
+
+"""
+Stops a set of processes (e.g., the JVMs of a Bento Box) so that a new Bento Box can start on the
+same ports right away.
+
+Every process gets SIGTERM at once, so that they can all shut down cleanly side by side, and we wait
+for all of them together until a deadline.  Whatever is still running then gets SIGKILL.  Finally,
+we wait until nothing listens on the Bento Box ports that those processes had: a JVM can be gone a
+moment before the kernel lets go of its sockets, and 'bento start' fails if it finds a port taken.
+
+Where the interpreter and kernel have them (Python 3.9+, Linux 5.3+), we hold a pidfd for every
+process, so that a signal can never hit another process that got the same pid, and wait for them
+with poll().  Elsewhere we check on the pids with kill(pid, 0).
+
+"""
+
+import errno
+import logging
+import os
+import select
+import signal
+import socket
+import time
+
+# How long the processes get to exit after SIGTERM before they get SIGKILL.
+default_term_timeout = 10.0
+
+# How long to wait for the processes to be gone after SIGKILL.
+default_kill_timeout = 5.0
+
+# How long to wait for the ports to be released once the processes are gone.
+default_port_timeout = 10.0
+
+# How often to check on the processes or ports, when we cannot wait for them with poll().
+poll_seconds = 0.1
+
+# State of a listening socket in /proc/net/tcp.
+tcp_listen_state = '0A'
+
+
+class PortsInUseError(Exception):
+  pass
+
+
+def _is_gone(e):
+  return e.errno == errno.ESRCH
+
+
+class _Process(object):
+  """ One process to stop: its pid, and a pidfd for it if we can have one. """
+
+  def __init__(self, pid):
+    super(_Process, self).__init__()
+    self.pid = int(pid)
+    self.pidfd = None
+    if hasattr(os, 'pidfd_open'):
+      try:
+        self.pidfd = os.pidfd_open(self.pid)
+      except OSError as e:
+        if _is_gone(e):
+          raise
+        # An older kernel, so we have to make do with the pid.
+        logging.debug("No pidfd for %d (%s)" % (self.pid, e))
+
+  def send_signal(self, sig):
+    """ Send a signal.  Return False if the process is already gone. """
+    try:
+      if self.pidfd is not None and hasattr(signal, 'pidfd_send_signal'):
+        signal.pidfd_send_signal(self.pidfd, sig)
+      else:
+        os.kill(self.pid, sig)
+    except OSError as e:
+      if _is_gone(e):
+        return False
+      raise
+    return True
+
+  def is_running(self):
+    if self.pidfd is not None:
+      # A pidfd becomes readable when its process exits.  poll(), not select(), which cannot take
+      # fds above 1024 (a long-running bento_buildd.py can have those).
+      poller = select.poll()
+      poller.register(self.pidfd, select.POLLIN)
+      return len(poller.poll(0)) == 0
+    try:
+      os.kill(self.pid, 0)
+    except OSError as e:
+      if _is_gone(e):
+        return False
+      raise
+    return True
+
+  def close(self):
+    if self.pidfd is not None:
+      os.close(self.pidfd)
+      self.pidfd = None
+
+
+def wait_for_processes(processes, timeout):
+  """ Wait up to timeout seconds for all of the processes to exit.  Return those still running. """
+  deadline = time.time() + timeout
+  running = [p for p in processes if p.is_running()]
+
+  b_poll = hasattr(select, 'poll') and all([p.pidfd is not None for p in running])
+  while running and time.time() < deadline:
+    if b_poll:
+      # Wait on all of them at once; poll() returns as soon as any of them exits.
+      poller = select.poll()
+      for process in running:
+        poller.register(process.pidfd, select.POLLIN)
+      try:
+        poller.poll(max(0, int((deadline - time.time()) * 1000)))
+      except (select.error, IOError, OSError) as e:
+        if e.args[0] != errno.EINTR:
+          raise
+    else:
+      time.sleep(poll_seconds)
+    running = [p for p in running if p.is_running()]
+  return running
+
+def _get_proc_net_files():
+  return [f for f in ['/proc/net/tcp', '/proc/net/tcp6'] if os.path.isfile(f)]
+
+def _get_listening_sockets():
+  """ Return (port, socket inode) for every listening TCP socket on this machine. """
+  sockets = []
+  for proc_file in _get_proc_net_files():
+    f = open(proc_file)
+    lines = f.readlines()[1:]
+    f.close()
+    for line in lines:
+      # sl local_address rem_address st tx:rx tr:when retrnsmt uid timeout inode ..., with
+      # addresses like 0100007F:1F90 (port in hex).
+      toks = line.split()
+      if len(toks) < 10 or toks[3] != tcp_listen_state:
+        continue
+      sockets.append((int(toks[1].split(':')[-1], 16), toks[9]))
+  return sockets
+
+def _get_socket_inodes(pid):
+  """ Return the inodes of the sockets that a process has open (empty if we cannot tell). """
+  inodes = set()
+  fd_dir = '/proc/%d/fd' % pid
+  try:
+    fds = os.listdir(fd_dir)
+  except OSError:
+    return inodes
+  for fd in fds:
+    try:
+      target = os.readlink(os.path.join(fd_dir, fd))
+    except OSError:
+      continue
+    if target.startswith('socket:['):
+      inodes.add(target[len('socket:['):-1])
+  return inodes
+
+def get_ports_held_by(pids):
+  """
+  Return the TCP ports that these processes listen on, or None if this machine cannot tell us
+  (no /proc).
+  """
+  if len(_get_proc_net_files()) == 0:
+    return None
+  inodes = set()
+  for pid in pids:
+    inodes.update(_get_socket_inodes(int(pid)))
+  return set([port for (port, inode) in _get_listening_sockets() if inode in inodes])
+
+def get_listening_ports(ports):
+  """ Return the ones of these TCP ports that something on this machine is listening on. """
+  ports = set([int(port) for port in ports])
+  if len(_get_proc_net_files()) == 0:
+    return _get_listening_ports_by_connecting(ports)
+  return sorted(set([port for (port, _) in _get_listening_sockets() if port in ports]))
+
+def _get_listening_ports_by_connecting(ports):
+  listening = []
+  for port in sorted(ports):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+      if sock.connect_ex(('127.0.0.1', port)) == 0:
+        listening.append(port)
+    finally:
+      sock.close()
+  return listening
+
+def wait_for_ports(ports, timeout=default_port_timeout):
+  """ Wait until nothing listens on these ports.  Raise PortsInUseError if that takes too long. """
+  deadline = time.time() + timeout
+  listening = get_listening_ports(ports)
+  while listening and time.time() < deadline:
+    time.sleep(poll_seconds)
+    listening = get_listening_ports(listening)
+  if listening:
+    raise PortsInUseError("Ports still in use after %s seconds: %s" % (timeout, listening))
+
+
+def terminate(
+    pids,
+    ports=(),
+    term_timeout=default_term_timeout,
+    kill_timeout=default_kill_timeout,
+    port_timeout=default_port_timeout):
+  """
+  Stop these processes: SIGTERM for all of them, wait (for all of them together) up to term_timeout
+  seconds, then SIGKILL for any that are left.  Then wait until nothing listens on those of ports
+  that the processes were listening on.  Return the pids that we had to kill.
+  """
+  # Only wait for ports that these processes held: something else (e.g., another Bento Box) may
+  # well be listening on the others, and will not let go of them because of us.
+  held_ports = get_ports_held_by(pids)
+
+  all_processes = []
+  try:
+    for pid in pids:
+      try:
+        all_processes.append(_Process(pid))
+      except OSError as e:
+        if not _is_gone(e):
+          raise
+
+    processes = [p for p in all_processes if p.send_signal(signal.SIGTERM)]
+    if len(processes) > 0:
+      logging.info("Sent SIGTERM to %s" % ', '.join([str(p.pid) for p in processes]))
+
+    stubborn = wait_for_processes(processes, term_timeout)
+    stubborn = [p for p in stubborn if p.send_signal(signal.SIGKILL)]
+    if len(stubborn) > 0:
+      logging.info("Sent SIGKILL to %s" % ', '.join([str(p.pid) for p in stubborn]))
+      survivors = wait_for_processes(stubborn, kill_timeout)
+      assert len(survivors) == 0, \
+          "Processes still running after SIGKILL: %s" % [p.pid for p in survivors]
+  finally:
+    for process in all_processes:
+      process.close()
+
+  if held_ports is not None:
+    ports = [port for port in ports if int(port) in held_ports]
+  elif len(processes) == 0:
+    ports = []
+  wait_for_ports(ports, port_timeout)
+  return [p.pid for p in stubborn]
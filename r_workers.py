@@ -0,0 +1,239 @@
+#!/usr/bin/env python2.7
+
+"""
+A pool of long-running R processes for training models.
+
+R CMD BATCH starts a fresh R interpreter (and loads the pmml package again) for every script.  Here
+each worker is an Rscript process that loads the packages once and then reads jobs (a directory and
+a script to source in it) from stdin, one per line.  The output of each job gets streamed back to
+us as it happens, and also written to <script>.Rout as R CMD BATCH would.  A job that runs past its
+timeout takes its worker with it; the pool starts a new one.
+
+"""
+
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+import command_runner
+
+# Packages that every worker loads when it starts.
+default_packages = ['pmml']
+
+# How long to wait for a new worker to load its packages.
+worker_startup_timeout = 120.0
+
+# Lines the worker prints when it is ready for jobs, and when it finishes one.
+worker_ready_marker = '@@R-WORKER-READY'
+p_job_done = re.compile(r'^@@R-WORKER-DONE (?P<job>\S+) (?P<status>OK|ERROR)(?P<message>.*)$')
+
+# Keep only a little of each worker's output around (the jobs' output goes to their .Rout files).
+worker_max_buffer_bytes = 1024 * 1024
+
+# Runs in each worker: load the packages, then source each script that we send, in its own
+# environment (so that one model's variables do not leak into the next).
+worker_script_template = r"""
+suppressPackageStartupMessages({
+  for (p in c(%(packages)s)) library(p, character.only=TRUE)
+})
+cat("%(ready)s\n")
+flush(stdout())
+con <- file("stdin")
+open(con)
+while (length(line <- readLines(con, n=1)) > 0) {
+  job <- strsplit(line, "\t", fixed=TRUE)[[1]]
+  old_dir <- setwd(job[2])
+  status <- tryCatch({
+    source(job[3], local=new.env(parent=globalenv()), echo=TRUE, max.deparse.length=Inf)
+    "OK"
+  }, error=function(e) paste("ERROR", gsub("\n", " ", conditionMessage(e))))
+  setwd(old_dir)
+  cat(sprintf("\n@@R-WORKER-DONE %%s %%s\n", job[1], status))
+  flush(stdout())
+}
+"""
+
+
+class RJobTimeout(Exception):
+  pass
+
+
+class _RWorker(object):
+  """ One Rscript process that runs jobs one at a time. """
+
+  def __init__(self, name, worker_script):
+    super(_RWorker, self).__init__()
+
+    self.name = name
+    self._ready = threading.Event()
+    self._done = threading.Event()
+
+    # The job that is running now, its .Rout file, and how it finished.
+    self._job_id = None
+    self._job_name = None
+    self._job_log = None
+    self._status = None
+
+    # _on_line runs on both the stdout and the stderr reader threads, while run_job opens and
+    # closes the .Rout file.
+    self._job_log_lock = threading.Lock()
+
+    self._command = command_runner.Command(
+        'Rscript --vanilla %s' % worker_script,
+        on_stdout=self._on_line,
+        on_stderr=self._on_line,
+        b_stdin=True,
+        max_buffer_bytes=worker_max_buffer_bytes)
+
+  def start(self):
+    self._command.start()
+    deadline = time.time() + worker_startup_timeout
+    while not self._ready.wait(1.0):
+      assert self._command.is_running(), \
+          "R worker %s died while starting (is Rscript installed, with packages %s?):\n%s" % \
+              (self.name, default_packages, self._command.output)
+      assert time.time() < deadline, "R worker %s did not start" % self.name
+    logging.info("R worker %s is ready" % self.name)
+
+  def _on_line(self, line):
+    if line == worker_ready_marker:
+      self._ready.set()
+      return
+
+    m_done = p_job_done.match(line)
+    if m_done and m_done.group('job') == self._job_id:
+      self._status = (m_done.group('status') == 'OK', m_done.group('message').strip())
+      self._done.set()
+      return
+
+    with self._job_log_lock:
+      if self._job_log is not None and not self._job_log.closed:
+        self._job_log.write(line + '\n')
+        self._job_log.flush()
+    logging.info("[R %s] %s" % (self._job_name or self.name, line))
+
+  def run_job(self, job_id, r_dir, r_script, timeout=None):
+    """
+    Source a script in a directory and wait for it.  Return (ok, error message).  Raises RJobTimeout
+    if it runs for longer than timeout seconds (the worker is dead after that).
+    """
+    self._job_id = job_id
+    self._job_name = os.path.join(r_dir, r_script)
+    job_log = open(os.path.join(r_dir, os.path.splitext(r_script)[0] + '.Rout'), 'w')
+    with self._job_log_lock:
+      self._job_log = job_log
+    self._status = None
+    self._done.clear()
+
+    try:
+      self._command.write_line('\t'.join([job_id, os.path.abspath(r_dir), r_script]))
+      start = time.time()
+      while not self._done.wait(1.0):
+        if not self._command.is_running():
+          return (False, "R worker %s died" % self.name)
+        if timeout is not None and time.time() - start > timeout:
+          self.kill()
+          raise RJobTimeout("%s timed out after %s seconds" % (self._job_name, timeout))
+      return self._status
+    finally:
+      with self._job_log_lock:
+        self._job_log.close()
+        self._job_log = None
+      self._job_id = None
+      self._job_name = None
+
+  def is_running(self):
+    return self._command.is_running()
+
+  def kill(self):
+    self._command.cancel()
+
+  def stop(self):
+    """ Let the worker finish (it exits at the end of its stdin). """
+    try:
+      self._command.wait()
+    except command_runner.CommandError:
+      pass
+
+
+class RWorkerPool(object):
+  """ A number of R workers, sharing a queue of jobs. """
+
+  def __init__(self, num_workers, packages=None, job_timeout=None):
+    super(RWorkerPool, self).__init__()
+
+    self._num_workers = num_workers
+    self._job_timeout = job_timeout
+    packages = packages if packages is not None else default_packages
+
+    (fd, self._worker_script) = tempfile.mkstemp(prefix='r-worker-', suffix='.R')
+    f = os.fdopen(fd, 'w')
+    f.write(worker_script_template % {
+        'packages': ', '.join(['"%s"' % p for p in packages]),
+        'ready': worker_ready_marker,
+    })
+    f.close()
+
+  def _new_worker(self, i):
+    worker = _RWorker('worker%d' % i, self._worker_script)
+    worker.start()
+    return worker
+
+  def run_jobs(self, jobs):
+    """
+    Run a list of (R directory, R script) jobs.  Return a list of (ok, seconds, error message), in
+    the same order.  One failing job does not stop the others.
+    """
+    job_queue = queue.Queue()
+    for (i, job) in enumerate(jobs):
+      job_queue.put((i, job))
+    results = [None] * len(jobs)
+
+    def _work(worker_index):
+      worker = None
+      while True:
+        try:
+          (i, (r_dir, r_script)) = job_queue.get_nowait()
+        except queue.Empty:
+          break
+        start = time.time()
+        try:
+          if worker is None or not worker.is_running():
+            worker = self._new_worker(worker_index)
+          (ok, error) = worker.run_job('job%d' % i, r_dir, r_script, self._job_timeout)
+          results[i] = (ok, time.time() - start, error or None)
+        except Exception as e:
+          # A timeout, or anything else (a worker that did not start, a broken pipe to one), fails
+          # just this job.  The next one gets a new worker: the old one can look like it is still
+          # running for a moment after we kill it.
+          if not isinstance(e, RJobTimeout):
+            logging.exception("R job %s failed" % os.path.join(r_dir, r_script))
+          results[i] = (False, time.time() - start, str(e))
+          if worker is not None:
+            worker.kill()
+            worker.stop()
+            worker = None
+      if worker is not None:
+        worker.stop()
+
+    threads = [
+        threading.Thread(target=_work, args=(i,))
+        for i in range(max(1, min(self._num_workers, len(jobs))))
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def close(self):
+    if os.path.isfile(self._worker_script):
+      os.remove(self._worker_script)
@@ -7,15 +7,22 @@ Runs all of the steps necessary to build a PMML model in R and attach it to a sc
 
 import argparse
 import collections
-import functools
+import json
 import logging
 import os
 import re
 import shutil
-import subprocess
 import sys
+import time
 
-import bento_reboot
+# The other scripts' modules (bento_reboot, classpath_index, kiji_layout, pmml_container, r_workers,
+# ...) and multiprocessing are imported by the steps that use them, so that help-actions and runs
+# of a few steps only load what they need (see bench_startup.py).
+import command_runner
+import jar_discovery
+import maven_resolver
+import script_output
+import workspace
 
 myname = os.path.split(sys.argv[0])[-1]
 description = """
@@ -30,21 +37,86 @@ machine-learning model from R into production with Kiji.  The steps are the foll
 You should run this script from the root directory of the PMML example.
 """
 
-def run(cmd):
-  result = ""
-  try:
-    result = subprocess.check_output(cmd, shell=True)
-  except subprocess.CalledProcessError as e:
-    sys.stderr.write("Error running command '%s':\n" % cmd)
-    sys.stderr.write("\tExit code = %s\n" % e.returncode)
-    sys.stderr.write("\tOutput = %s\n" % e.output)
-    raise e
-  return result
+run = command_runner.run
+
+# Steps that run once for every model (the rest run once for the whole pipeline).
+model_actions = ['r-xml', 'pmml-wizard', 'repo-deploy', 'repo-fresh']
+
+# Steps that run Kiji JVMs, which need the extra JARs on KIJI_CLASSPATH.  The other steps work on a
+# machine that does not have those JARs.
+kiji_classpath_actions = [
+    'kiji-init', 'repo-init', 'scoring-server-init', 'pmml-wizard', 'repo-deploy', 'repo-fresh']
+
+
+class PmmlModel(object):
+  """
+  One R model to turn into a score function.  A manifest lists many of these, as JSON objects with
+  the same keys as the arguments here (only name and pmml_file are required).
+  """
+
+  def __init__(
+      self,
+      name,
+      pmml_file,
+      version='0.0.1',
+      container_json=None,
+      table=None,
+      r_dir='r_stuff',
+      r_script=None,
+      predictor_column='info:predictor',
+      result_column='info:predicted',
+      result_record_name=None):
+    super(PmmlModel, self).__init__()
+
+    self.name = name
+    self.version = version
+
+    # PMML file (within the work dir) that the R script writes.
+    self.pmml_file = pmml_file
+
+    # JSON model container (within the work dir) that the PMML wizard writes.
+    self.container_json = container_json if container_json is not None else name + '.json'
+
+    # Table to score (None for the user table that kiji-init creates).
+    self.table = table
+
+    # R script (within r_dir) that trains the model and writes the PMML file.
+    self.r_dir = r_dir
+    self.r_script = r_script
+
+    self.predictor_column = predictor_column
+    self.result_column = result_column
+    self.result_record_name = result_record_name
+
+  @staticmethod
+  def from_dict(model_dict):
+    return PmmlModel(**dict([(str(k), v) for (k, v) in model_dict.items()]))
+
+
+def read_manifest(manifest_file):
+  """
+  Read a JSON manifest of models:
+    {"user_table": "ozone", "models": [{"name": "artifact.ozone_model", "pmml_file": ...}, ...]}
+  Returns (user table or None, list of PmmlModels).
+  """
+  f = open(manifest_file)
+  manifest = json.load(f)
+  f.close()
+  assert len(manifest.get('models', [])) > 0, "No models in manifest %s" % manifest_file
+  models = [PmmlModel.from_dict(m) for m in manifest['models']]
+  names = [m.name for m in models]
+  assert len(names) == len(set(names)), "Duplicate model names in %s" % manifest_file
+  return (manifest.get('user_table'), models)
+
 
 class PmmlRunner(object):
 
   def _run_kiji(self, cmd, directory=None, kiji_classpath=None, env_vars=None):
     """ Run a Kiji command for the bento box in a particular directory, with a special classapth. """
+    return run(self._get_kiji_command(cmd, directory, kiji_classpath, env_vars))
+
+  def _get_kiji_command(self, cmd, directory=None, kiji_classpath=None, env_vars=None):
+    """ The full shell command for _run_kiji. """
 
     assert self._bento_dir != None
     assert os.path.isdir(self._bento_dir)
@@ -56,7 +128,15 @@ class PmmlRunner(object):
     if kiji_classpath == None:
       kiji_classpath = self._kiji_classpath
 
-    cmd_cp = "export KIJI_CLASSPATH=$KIJI_CLASSPATH:" + kiji_classpath + ";"
+    cmd_cp = "" if kiji_classpath == None \
+        else "export KIJI_CLASSPATH=$KIJI_CLASSPATH:" + kiji_classpath + ";"
+
+    # Use the bento box's classpath index and CDS archive, if it has them.
+    cmd_index = ""
+    if self._index_classpath:
+      cmd_index += "export KIJI_CLASSPATH=%s:$KIJI_CLASSPATH;" % self._index_classpath
+    if self._index_java_opts:
+      cmd_index += 'export KIJI_JAVA_OPTS="$KIJI_JAVA_OPTS %s";' % self._index_java_opts
 
     # Possibly set up a bunch of environment variables.
     cmd_env_vars = "" if env_vars == None \
@@ -64,15 +144,16 @@ class PmmlRunner(object):
         " ".join(["%s=%s" % (k,v) for k,v in env_vars.items()]) + \
         ";"
 
-    full_command = '{change_dir} {kiji_env} {cmd_cp} {env_vars} {cmd}'.format(
+    full_command = '{change_dir} {kiji_env} {cmd_index} {cmd_cp} {env_vars} {cmd}'.format(
         change_dir=cmd_change_dir,
         kiji_env = 'source %s/bin/kiji-env.sh;' % self._bento_dir,
+        cmd_index = cmd_index,
         cmd_cp = cmd_cp,
         env_vars = cmd_env_vars,
         cmd = cmd
     )
     logging.debug("Running Kiji command: '%s'" % full_command)
-    return run(full_command)
+    return full_command
 
   # List of commands available to the user.
   # TODO: Add something to unlink JARs
@@ -80,8 +161,10 @@ class PmmlRunner(object):
       'help-actions',
       'bento-setup',
       'r-xml',
+      'restore',
       'kiji-init',
       'repo-init',
+      'snapshot',
       'scoring-server-init',
       'pmml-wizard',
       'repo-deploy',
@@ -95,13 +178,21 @@ class PmmlRunner(object):
       'r-xml':
         "Run R to dump out XML for a PMML model.",
       'kiji-init':
-        "Install a Kiji instance and create a Kiji table.",
+        "Install a Kiji instance and create a Kiji table.  If the table already exists, only run "
+        "the ALTERs needed to match the DDL (or nothing), rather than starting over.",
       'repo-init':
         "Create a model repository (die if one already exists).",
+      'snapshot':
+        "Stop the Bento Box, save its HBase / ZooKeeper / HDFS data (after kiji-init and repo-init) "
+        "under work/snapshots/<--snapshot>, and start it again.",
+      'restore':
+        "Stop the Bento Box, put back the data saved by 'snapshot', and start it again.  Skips "
+        "kiji-init and repo-init, which the snapshot already covers.",
       'scoring-server-init':
         "Run the scoring server (die if it is not running).",
       'pmml-wizard' :
-        "Run the model-repo pmml command to create a JSON description of the PMML model.",
+        "Run the model-repo pmml command to create a JSON description of the PMML model (see "
+        "--pmml-wizard to do this without a JVM).",
       'repo-deploy':
         "Run the model-repo deploy command to deploy the model onto the server.",
       'repo-fresh':
@@ -110,9 +201,56 @@ class PmmlRunner(object):
         "Bulk-import data for this test case.",
     }
 
-  def __init__(self):
+  # Maven coordinates of JARs to add to KIJI_CLASSPATH for the Kiji commands.
+  kiji_classpath_coordinates = [
+      'org.jpmml:pmml-evaluator:1.1-SNAPSHOT',
+      'org.jpmml:pmml-manager:1.1-SNAPSHOT',
+      'org.jpmml:pmml-model:1.1.3',
+      'com.sun.xml.bind:jaxb-impl:2.2.6',
+      'org.jpmml:pmml-schema:1.1.3',
+      'joda-time:joda-time:2.2',
+      'org.apache.maven.shared:maven-invoker:2.1.1',
+      'org.codehaus.plexus:plexus-utils:3.0.8',
+      'org.codehaus.plexus:plexus-component-annotations:1.5.5',
+  ]
+
+  # Locally-built SNAPSHOT JARs to add to KIJI_CLASSPATH: (checkout dir within the root dir, or None
+  # for this project (the pwd), artifactId).  We use the newest version built in each checkout.
+  kiji_classpath_local_snapshots = [
+      (None, 'kiji-pmml'),
+      ('kiji-modeling', 'kiji-modeling'),
+      ('kiji-model-repository', 'kiji-model-repository'),
+  ]
+
+  # The model that we build when there is no manifest.
+  default_model = PmmlModel(
+      #name='Linear_Regression_Model',
+      name='artifact.ozone_model',
+      # TODO: Is this supposed to be in the R file?
+      version='0.0.1',
+      pmml_file='RegressionOzone.pmml',
+      container_json='ozone.json',
+      r_script='ozone.R',
+      result_record_name='OzonePredicted')
+
+  # Schema-shell DDL (within the project) that creates the user table.
+  table_ddl_file = 'src/main/layout/table_desc.ddl'
+
+  # Table that 'kiji model-repo init' creates in the Kiji instance.
+  model_repo_table = 'model_repo'
+
+  # Directories (within the bento box) with the cluster's data, which snapshot and restore save.
+  bento_state_dirs = [
+      os.path.join('cluster', 'state'),
+  ]
+
+  def __init__(self, ws=None, project_dir=None):
     super(PmmlRunner, self).__init__()
 
+    # JAR index, classpath cache and process table (see workspace.py), shared with the Bento Box
+    # setup.  If None, we make one from the command-line arguments.
+    self._workspace = ws
+
     # List of different actions for this tool to execute.
     self._actions = None
 
@@ -126,18 +264,31 @@ class PmmlRunner(object):
 
     self._user_table = 'ozone'
 
+    # The project that we run for (the current directory, unless a daemon runs us for someone).
+    self._project_dir = os.getcwd() if project_dir is None else os.path.abspath(project_dir)
+
     # Working directory for files created by this script.
-    self._work = 'work'
+    self._work = 'work' if project_dir is None else self._get_project_path('work')
 
-    self._pmml_file = 'RegressionOzone.pmml'
+    # Models to build (from the manifest, or just the default one).
+    self._models = [self.default_model]
 
-    #self._model_name = 'Linear_Regression_Model'
-    self._model_name = 'artifact.ozone_model'
+    # JARs that the models depend on, resolved once for --batch-deploy (None to let each deploy
+    # resolve them with Maven).
+    self._deploy_deps = None
 
-    # TODO: Is this supposed to be in the R file?
-    self._model_version = '0.0.1'
+    # For each model: OrderedDict of step -> (ok, seconds, error message).
+    self._model_results = collections.OrderedDict()
 
-    self._model_container_json = 'ozone.json'
+    # Extra JARs for KIJI_CLASSPATH (None until the first step that runs Kiji JVMs resolves them).
+    self._kiji_classpath = None
+
+    # Classpath index JAR and JVM options for the bento box's CDS archive (empty if there are none).
+    self._index_classpath = ''
+    self._index_java_opts = ''
+
+    # What we did, for --format=json (see script_output.py).
+    self._output = script_output.ScriptOutput('run_pmml.py')
 
   def _create_parser(self):
     """ Returns a parser for the script """
@@ -172,12 +323,83 @@ class PmmlRunner(object):
         default=os.getcwd(),
         help='Root directory (containing tgz for bento) [pwd]')
 
+    parser.add_argument(
+        '-s',
+        '--snapshot',
+        type=str,
+        default='kiji-init',
+        help='Name of the snapshot to write (snapshot) or read (restore) [kiji-init]')
+
+    parser.add_argument(
+        '-m',
+        '--manifest',
+        type=str,
+        default=None,
+        help='JSON file listing the models to build (see PmmlModel) [just the ozone model]')
+
+    parser.add_argument(
+        '--max-parallel-r',
+        type=int,
+        default=None,
+        help='Maximum number of R scripts to run at once [number of CPUs]')
+
+    parser.add_argument(
+        '--pmml-wizard',
+        type=str,
+        choices=['jvm', 'native', 'compare'],
+        default='jvm',
+        help='How pmml-wizard writes model containers: with \'kiji model-repo pmml\' (jvm), in Python\n'
+            'without a JVM (native), or both, failing if they differ (compare) [jvm]')
+
+    parser.add_argument(
+        '--batch-deploy',
+        action='store_true',
+        default=False,
+        help='Resolve the dependencies of the models once (see --deploy-deps) and hand them to\n'
+            'every repo-deploy, rather than having each deploy resolve them with Maven')
+
+    parser.add_argument(
+        '--deploy-deps',
+        type=str,
+        default=None,
+        help='pom.xml with the dependencies of the model artifacts, for --batch-deploy [none]')
+
+    parser.add_argument(
+        '--r-workers',
+        type=int,
+        default=0,
+        help='Run the R scripts in this many R processes that load the R packages once and stay up\n'
+            'between scripts, rather than one R CMD BATCH per script [0]')
+
+    parser.add_argument(
+        '--r-timeout',
+        type=float,
+        default=None,
+        help='Give up on an R script after this many seconds [no timeout]')
+
+    parser.add_argument(
+        '--max-parallel-deploy',
+        type=int,
+        default=2,
+        help='Maximum number of models to run through pmml-wizard / repo-deploy / repo-fresh at\n'
+            'once (they all write to the same model repo) [2]')
+
+    parser.add_argument(
+        '--no-scan-cache',
+        action='store_true',
+        default=False,
+        help='List the root directory to find the Bento Box, rather than using the listing from\n'
+            'the last run if the directory has not changed (see jar_discovery.py).')
+
+    script_output.add_arguments(parser)
+
     return parser
 
   def _help_actions(self):
     """ Print detailed information about how the different actions work """
     actions_str = ""
     for action in self.possible_actions:
+      if action == 'help-actions': continue
       actions_str += "command: %s\n%s\n\n" % (action, self.actions_help[action])
     print(actions_str)
     sys.exit(0)
@@ -194,9 +416,14 @@ class PmmlRunner(object):
     if args.debug:
       logging.basicConfig(level=logging.DEBUG)
 
+    self._output.set_options(args)
+
     # Root directory of Bento Box .tar.gz file and kiji checkouts.
-    self._root_dir = args.root_dir
-    assert os.path.isdir(self._root_dir)
+    if self._workspace is None or self._workspace.root_dir != os.path.abspath(args.root_dir):
+      self._workspace = workspace.Workspace(
+          args.root_dir,
+          scan_cache_file=None if args.no_scan_cache else jar_discovery.default_cache_file)
+    self._root_dir = self._workspace.root_dir
 
     # Figure out what actions (steps) to perform.
     self._actions = args.action
@@ -206,6 +433,21 @@ class PmmlRunner(object):
 
     if 'help-actions' in self._actions: self._help_actions()
 
+    self._snapshot_name = args.snapshot
+
+    if args.manifest is not None:
+      (user_table, self._models) = read_manifest(self._get_project_path(args.manifest))
+      if user_table is not None:
+        self._user_table = user_table
+
+    self._max_parallel_r = args.max_parallel_r
+    self._max_parallel_deploy = args.max_parallel_deploy
+    self._r_workers = args.r_workers
+    self._pmml_wizard = args.pmml_wizard
+    self._batch_deploy = args.batch_deploy
+    self._deploy_deps_pom = args.deploy_deps
+    self._r_timeout = args.r_timeout
+
     # Useful information for the user about what we are going to do!
     logging.info("Running the following steps:")
     for action in self.possible_actions:
@@ -243,6 +485,21 @@ class PmmlRunner(object):
 
     return kiji_ls.find(self._kiji + "/" + self._user_table) != -1
 
+  def _get_kiji_tables(self):
+    """
+    Return the names of the tables in our Kiji instance (all from one 'kiji ls'), or None if the
+    instance is not installed.
+    """
+    cmd = self._get_kiji_command('kiji ls %s' % self._kiji)
+    try:
+      # Not run(), since a missing instance is nothing to complain about here.
+      kiji_ls = command_runner.start(cmd).wait()
+    except command_runner.CommandError:
+      return None
+    prefix = self._kiji.rstrip('/') + '/'
+    return set([line.strip()[len(prefix):].strip('/') for line in kiji_ls.splitlines()
+        if line.strip().startswith(prefix)])
+
   def _is_scoring_server_running(self):
     """ Return true if the scoring server is running, false otherwise. """
     assert None != self._bento_dir
@@ -256,57 +513,57 @@ class PmmlRunner(object):
 
     return None != p_ss.search(jps_results)
 
+  def _stop_bento(self):
+    if self._is_bento_box_running():
+      logging.info("Stopping Bento Box...")
+      self._run_kiji('bento stop')
+
+  def _start_bento(self):
+    logging.info("Starting Bento Box...")
+    results = self._run_kiji('bento start')
+    assert results.find('bento-cluster started') != -1, \
+        "Bento cluster appears not to have started correctly: %s" % results
+
   def _create_work_dir(self):
     if not os.path.exists(self._work):
       os.mkdir(self._work)
 
   def _set_kiji_classpath(self):
-    # Hard-coded (yikes!) big classpath...
-    mvn_repo = os.path.join(os.environ['HOME'], '.m2', 'repository')
-
-    deps = [
-        'org/jpmml/pmml-evaluator/1.1-SNAPSHOT/pmml-evaluator-1.1-SNAPSHOT.jar',
-        'org/jpmml/pmml-manager/1.1-SNAPSHOT/pmml-manager-1.1-SNAPSHOT.jar',
-        'org/jpmml/pmml-model/1.1.3/pmml-model-1.1.3.jar',
-        'com/sun/xml/bind/jaxb-impl/2.2.6/jaxb-impl-2.2.6.jar',
-        'org/jpmml/pmml-schema/1.1.3/pmml-schema-1.1.3.jar',
-        'joda-time/joda-time/2.2/joda-time-2.2.jar',
-        'org/apache/maven/shared/maven-invoker/2.1.1/maven-invoker-2.1.1.jar',
-        'org/codehaus/plexus/plexus-utils/3.0.8/plexus-utils-3.0.8.jar',
-        'org/codehaus/plexus/plexus-component-annotations/1.5.5/plexus-component-annotations-1.5.5.jar',
+    """ Resolve the Maven coordinates for the extra JARs that the Kiji commands need. """
+    resolver = maven_resolver.MavenResolver(
+        cache_file=os.path.join(self._work, 'classpath-cache.json'))
+
+    local_snapshots = [
+        (self._project_dir if checkout is None else os.path.join(self._root_dir, checkout),
+            artifact_id)
+        for (checkout, artifact_id) in self.kiji_classpath_local_snapshots
     ]
 
-    self._kiji_classpath = ":".join([mvn_repo + '/' + d for d in deps])
-    self._kiji_classpath += ":" + "target/kiji-pmml-1.0-SNAPSHOT.jar"
-    self._kiji_classpath += ":" + \
-    "{root}/kiji-modeling/kiji-modeling/target/kiji-modeling-0.8.0-SNAPSHOT.jar:{root}/kiji-model-repository/kiji-model-repository/target/kiji-model-repository-0.7.0-SNAPSHOT.jar".format(root=self._root_dir)
+    jars = resolver.resolve(self.kiji_classpath_coordinates, local_snapshots)
+    self._kiji_classpath = ":".join(jars)
 
   # ------------------------------------------------------------------------------------------------
   # Set up the bento box.
   def _do_action_bento_setup(self):
     """ Untar the bento box, symlink JARs, start the Bento Box, etc. """
-    bento_rebooter = bento_reboot.BentoRebooter()
-
-    # Set up all of the command line options.
-    root_dir = self._root_dir
-    link_modules = 'model-repository,scoring'
-    rebooter_args = \
-        "install-bento link-jars run-bento -r {root_dir} -l {link_modules} -v ".format(
-            root_dir=root_dir,
-            link_modules=link_modules
-        )
-    bento_rebooter.go(rebooter_args.split())
+    import bento_reboot
+
+    bento_rebooter = bento_reboot.BentoRebooter(self._workspace)
+    bento_rebooter.configure(
+        ['install-bento', 'link-jars', 'run-bento'],
+        link_modules=['model-repository', 'scoring'])
+    bento_rebooter.run()
 
   def _set_bento_dir(self):
     """ Find the Bento directory from within root. """
 
-    full_paths_in_root_dir = [os.path.join(self._root_dir, d) for d in os.listdir(self._root_dir)]
+    (dirs_in_root_dir, _) = jar_discovery.listdir(
+        self._root_dir, self._workspace.scan_cache_file)
 
-    logging.debug(sorted(full_paths_in_root_dir))
+    logging.debug(dirs_in_root_dir)
 
     potential_bento_dirs = [
-        d for d in full_paths_in_root_dir if
-          os.path.isdir(os.path.abspath(d)) and os.path.basename(d).startswith('kiji-bento-')
+        os.path.join(self._root_dir, d) for d in dirs_in_root_dir if d.startswith('kiji-bento-')
     ]
 
     assert len(potential_bento_dirs) > 0, \
@@ -317,27 +574,106 @@ class PmmlRunner(object):
 
     self._bento_dir = potential_bento_dirs[0]
 
+    # Check the classpath index once, rather than for every Kiji command.
+    import classpath_index
+    indexer = classpath_index.ClasspathIndexer(self._bento_dir)
+    indexer.rebuild_if_stale()
+    self._index_classpath = indexer.get_classpath_prefix()
+    self._index_java_opts = indexer.get_java_opts()
+
   # ------------------------------------------------------------------------------------------------
   # Produce an XML file with a PMML model for something.
-  def _do_action_r_produce_pmml_xml(self):
+  def _do_action_r_produce_pmml_xml(self, r_dir, r_script):
     """ Call R with a script to make a PMML model. """
-    cmd = 'cd r_stuff; R CMD BATCH ozone.R'
-    run(cmd)
-    assert os.path.isfile(os.path.join(self._work, self._pmml_file))
+    # R CMD BATCH loads and saves the workspace in r_dir/.RData by default, which scripts running
+    # side by side in the same directory would race on (and which could leak one model's variables
+    # into the next).
+    cmd = 'cd %s; R CMD BATCH --no-save --no-restore %s' % (r_dir, r_script)
+    run(cmd, timeout=self._r_timeout)
 
     # TODO: May have to post-process the PMML file (or change the original R script) to make the
     # model name something that the model repo likes (e.g., from 'mymodel' to 'foo.mymodel-0.1').
 
   # ------------------------------------------------------------------------------------------------
   # Initialize Kiji.
+  def _get_installed_layout(self):
+    """ Return the layout of the installed user table, or None if there is no such table. """
+    import kiji_layout
+
+    cmd = self._get_kiji_command(
+        'kiji layout --table=%s/%s --do=dump' % (self._kiji, self._user_table))
+    try:
+      # Not run(), since a missing instance or table is nothing to complain about here.
+      layout_json = command_runner.start(cmd).wait()
+    except command_runner.CommandError:
+      return None
+    if layout_json.find('{') == -1:
+      return None
+    return kiji_layout.parse_layout(layout_json[layout_json.find('{'):])
+
+  def _get_project_path(self, path):
+    """
+    Resolve a path (e.g., a model's r_dir, or the DDL file) against the project rather than against
+    our current directory, which is not the project's when a daemon runs us.
+    """
+    return os.path.join(self._project_dir, path)
+
+  def _update_kiji_table(self):
+    """
+    Bring an existing user table up to date with the DDL file without recreating it.  Return False
+    if that is not possible (no table yet, or changes beyond adding families and columns).
+    """
+    installed = self._get_installed_layout()
+    if installed is None:
+      return False
+
+    import kiji_layout
+
+    tables = kiji_layout.parse_ddl_file(
+        self._get_project_path(self.table_ddl_file),
+        os.path.join(self._work, 'table-ddl-cache.json'))
+    assert self._user_table in tables, \
+        "%s does not create table %s" % (self.table_ddl_file, self._user_table)
+
+    statements = kiji_layout.get_alter_statements(
+        self._user_table, tables[self._user_table], installed)
+    if statements is None:
+      return False
+    if len(statements) == 0:
+      logging.info("Table %s already matches %s" % (self._user_table, self.table_ddl_file))
+      return True
+
+    alter_file = os.path.abspath(os.path.join(self._work, 'table_alter.ddl'))
+    f = open(alter_file, 'w')
+    f.write('\n'.join(statements) + '\n')
+    f.close()
+    logging.info("Updating table %s:\n\t%s" % (self._user_table, '\n\t'.join(statements)))
+    self._run_kiji(cmd = 'kiji-schema-shell --kiji={kiji} --file={ddl}'.format(
+        kiji=self._kiji, ddl=alter_file))
+    return True
+
   def _do_action_kiji_init(self):
-    """ Install a Kiji instance, create a Kiji table """
+    """
+    Install a Kiji instance, create a Kiji table.  If the table is already there, just make sure that
+    it matches the DDL file.  A model repo table from an earlier run gets dropped (repo-init dies if
+    there already is one, and repo-deploy would clash with the models in it), but the user table and
+    its data stay.
+    """
     assert None != self._bento_dir
     assert os.path.isdir(self._bento_dir)
     assert self._is_bento_box_running()
 
+    tables = self._get_kiji_tables()
+    if tables is not None and self._user_table in tables:
+      if self.model_repo_table in tables:
+        logging.info("Dropping the model repo from an earlier run")
+        self._run_kiji(cmd = 'kiji delete --target=%s/%s --interactive=false' % (
+            self._kiji, self.model_repo_table))
+      if self._update_kiji_table():
+        return
+
     # Possibly delete the kiji instance...
-    if self._is_kiji_instance_installed():
+    if tables is not None:
       self._run_kiji(cmd = 'kiji delete  --target=%s --interactive=false ' % self._kiji)
 
     # Install the Kiji instance.
@@ -346,8 +682,9 @@ class PmmlRunner(object):
 
     # Create the Kiji table.
     self._run_kiji(cmd =
-      'kiji-schema-shell --kiji={kiji} --file=src/main/layout/table_desc.ddl'.format(
-        kiji=self._kiji
+      'kiji-schema-shell --kiji={kiji} --file={ddl}'.format(
+        kiji=self._kiji,
+        ddl=self._get_project_path(self.table_ddl_file)
     ))
 
   # ------------------------------------------------------------------------------------------------
@@ -371,6 +708,85 @@ class PmmlRunner(object):
     res = self._run_kiji(cmd, kiji_classpath=self._kiji_classpath)
     logging.info(res)
 
+  # ------------------------------------------------------------------------------------------------
+  # Save or restore the state of the bento box after setting up Kiji.
+  def _get_snapshot_dir(self):
+    return os.path.join(os.path.abspath(self._work), 'snapshots', self._snapshot_name)
+
+  def _get_snapshot_paths(self):
+    """ (path to save, name within the snapshot) for everything in a snapshot. """
+    return [(os.path.join(self._bento_dir, d), d.replace(os.sep, '-')) for d in self.bento_state_dirs] + \
+        [(os.path.abspath(os.path.join(self._work, 'my_model_repo')), 'my_model_repo')]
+
+  def _do_action_snapshot(self):
+    """
+    Save the cluster's data with the cluster stopped (so that HBase has flushed everything).  Use a
+    reflinked copy where the filesystem supports it (btrfs, XFS), since that takes no time and no
+    space, and a compressed tar file otherwise.
+    """
+    assert self._is_kiji_user_table_present(), "Run kiji-init before taking a snapshot"
+    snapshot_dir = self._get_snapshot_dir()
+    if os.path.isdir(snapshot_dir):
+      shutil.rmtree(snapshot_dir)
+    os.makedirs(snapshot_dir)
+
+    self._stop_bento()
+    paths = [(src, dst) for (src, dst) in self._get_snapshot_paths() if os.path.exists(src)]
+    try:
+      try:
+        for (src, dst) in paths:
+          # Not run(), which would complain loudly when the filesystem cannot do reflinks.
+          command_runner.start(
+              'cp -a --reflink=always %s %s 2>/dev/null' % (src, os.path.join(snapshot_dir, dst))).wait()
+        snapshot_format = 'reflink'
+      except command_runner.CommandError:
+        logging.info("Filesystem does not support reflinks, writing a tar file instead")
+        shutil.rmtree(snapshot_dir)
+        os.makedirs(snapshot_dir)
+        for (src, dst) in paths:
+          run('tar -C %s -czf %s.tar.gz %s' % (
+              os.path.dirname(src), os.path.join(snapshot_dir, dst), os.path.basename(src)))
+        snapshot_format = 'tgz'
+    finally:
+      self._start_bento()
+
+    manifest = open(os.path.join(snapshot_dir, 'snapshot.json'), 'w')
+    json.dump({
+        'format': snapshot_format,
+        'paths': [dst for (_, dst) in paths],
+        'kiji': self._kiji,
+        'user_table': self._user_table,
+    }, manifest, indent=2)
+    manifest.close()
+    logging.info("Wrote %s snapshot %s" % (snapshot_format, snapshot_dir))
+    script_output.add_file('written', snapshot_dir)
+
+  def _do_action_restore(self):
+    """ Put back the cluster's data from a snapshot, with the cluster stopped. """
+    snapshot_dir = self._get_snapshot_dir()
+    manifest_file = os.path.join(snapshot_dir, 'snapshot.json')
+    assert os.path.isfile(manifest_file), "No snapshot in %s, run 'snapshot' first" % snapshot_dir
+    manifest = open(manifest_file)
+    snapshot = json.load(manifest)
+    manifest.close()
+    assert snapshot['kiji'] == self._kiji, \
+        "Snapshot is of %s, not %s" % (snapshot['kiji'], self._kiji)
+
+    self._stop_bento()
+    for (src, dst) in self._get_snapshot_paths():
+      if dst not in snapshot['paths']:
+        continue
+      if os.path.exists(src):
+        shutil.rmtree(src)
+      if snapshot['format'] == 'reflink':
+        run('cp -a --reflink=always %s %s' % (os.path.join(snapshot_dir, dst), src))
+      else:
+        # The tar file holds the directory under its original name.
+        run('tar -C %s -xzf %s.tar.gz' % (os.path.dirname(src), os.path.join(snapshot_dir, dst)))
+    self._start_bento()
+    assert self._is_kiji_user_table_present()
+    logging.info("Restored snapshot %s" % snapshot_dir)
+
   # ------------------------------------------------------------------------------------------------
   # Start the scoring server.
   def _do_action_scoring_server_init(self):
@@ -412,92 +828,304 @@ class PmmlRunner(object):
 
   # ------------------------------------------------------------------------------------------------
   # Create a JSON file that contains a description of the model.
-  def _do_action_pmml_wizard(self):
+  def _run_pmml_wizard(self, model, container_file):
     """ Run Robert's PMML command-line wizard! """
 
-    if os.path.isfile(os.path.join(self._work, self._model_container_json)):
-      os.remove(os.path.join(self._work, self._model_container_json))
-
     cmd_raw = \
       " kiji model-repo pmml " + \
       " --table={table} " + \
       " --model-file=file://{pmml} --model-name={model_name} " + \
-      " --model-version={version} --predictor-column=info:predictor --result-column=info:predicted " + \
-      " --result-record-name=OzonePredicted --model-container={container} "
+      " --model-version={version} --predictor-column={predictor} --result-column={result} " + \
+      " {record} --model-container={container} "
 
     cmd = cmd_raw.format(
-      table = self._kiji + "/" + self._user_table,
-      pmml = os.path.abspath(os.path.join(self._work, self._pmml_file)),
-      model_name = self._model_name,
-      version = self._model_version,
-      container = os.path.join(self._work, self._model_container_json)
+      table = self._kiji + "/" + (model.table or self._user_table),
+      pmml = os.path.abspath(os.path.join(self._work, model.pmml_file)),
+      model_name = model.name,
+      version = model.version,
+      predictor = model.predictor_column,
+      result = model.result_column,
+      record = "" if model.result_record_name is None \
+          else "--result-record-name=" + model.result_record_name,
+      container = container_file
     )
 
     self._run_kiji(cmd)
 
-    assert os.path.isfile(os.path.join(self._work, self._model_container_json))
+  def _write_pmml_container(self, model, container_file):
+    """ Write the same JSON as the PMML wizard, without starting a JVM. """
+    import pmml_container
+
+    pmml = os.path.abspath(os.path.join(self._work, model.pmml_file))
+    container = pmml_container.make_model_container(
+        pmml_file = pmml,
+        pmml_uri = 'file://' + pmml,
+        table_uri = self._kiji + "/" + (model.table or self._user_table),
+        model_name = model.name,
+        model_version = model.version,
+        predictor_column = model.predictor_column,
+        result_column = model.result_column,
+        result_record_name = model.result_record_name)
+    pmml_container.write_model_container(container, container_file)
+
+  def _do_action_pmml_wizard(self, model):
+    """ Write the JSON model container, with the PMML wizard or natively (or both, to compare). """
+    container_file = os.path.join(self._work, model.container_json)
+    if os.path.isfile(container_file):
+      os.remove(container_file)
+
+    if self._pmml_wizard == 'native':
+      self._write_pmml_container(model, container_file)
+    else:
+      self._run_pmml_wizard(model, container_file)
+
+    assert os.path.isfile(container_file)
+    script_output.add_file('written', os.path.abspath(container_file))
+
+    if self._pmml_wizard == 'compare':
+      import pmml_container
+      native_file = container_file + '.native'
+      self._write_pmml_container(model, native_file)
+      differences = pmml_container.compare_model_containers(container_file, native_file)
+      assert len(differences) == 0, \
+          "Native model container %s differs from the PMML wizard's:\n\t%s" % \
+              (native_file, '\n\t'.join(differences))
+      logging.info("Native model container for %s matches the PMML wizard's" % model.name)
 
   # ------------------------------------------------------------------------------------------------
   # Deploy the repo
-  def _do_action_repo_deploy(self):
-    self._run_kiji(cmd = 'touch foo', directory = self._work)
-    self._run_kiji(cmd = 'jar cf empty.jar foo', directory = self._work)
+  def _make_empty_jar(self):
+    """ repo-deploy needs a JAR, even though the PMML score function does not use it. """
+    import zipfile
+
+    jar_file = zipfile.ZipFile(os.path.join(self._work, 'empty.jar'), 'w')
+    jar_file.writestr('META-INF/MANIFEST.MF', 'Manifest-Version: 1.0\r\nCreated-By: %s\r\n\r\n' % myname)
+    jar_file.close()
+
+  def _get_deploy_deps(self):
+    """
+    Resolve the dependencies of the model artifacts (the --deploy-deps pom) once for all of the
+    models, reusing the last resolution while the pom is unchanged and all of its JARs are there.
+    """
+    if self._deploy_deps_pom is None:
+      return []
+
+    import bento_classpath
+    import hashlib
+
+    f = open(self._deploy_deps_pom, 'rb')
+    pom_sha1 = hashlib.sha1(f.read()).hexdigest()
+    f.close()
+
+    cache_file = os.path.join(self._work, 'deploy-deps-cache.json')
+    if os.path.isfile(cache_file):
+      f = open(cache_file)
+      cache = json.load(f)
+      f.close()
+      if cache['pom_sha1'] == pom_sha1 and all([os.path.isfile(jar) for jar in cache['jars']]):
+        logging.info("Using cached dependencies for %s" % self._deploy_deps_pom)
+        return cache['jars']
+
+    module = bento_classpath.get_pom_artifact_id(self._deploy_deps_pom)
+    classpaths = bento_classpath.BentoClasspath().get_classpaths_from_maven(
+        maven_args='-f %s' % self._deploy_deps_pom, wanted_modules=[module])
+    assert module in classpaths, "Maven did not print a classpath for %s" % module
+    jars = classpaths[module]
+
+    f = open(cache_file, 'w')
+    json.dump({'pom_sha1': pom_sha1, 'jars': jars}, f, indent=2)
+    f.close()
+    return jars
+
+  def _do_action_repo_deploy(self, model):
+    if self._deploy_deps is None:
+      deps = '--deps-resolver=maven'
+    elif len(self._deploy_deps) == 0:
+      deps = '--deps-resolver=raw'
+    else:
+      deps = '--deps-resolver=raw --deps=%s' % ':'.join(self._deploy_deps)
+
     cmd_raw = 'kiji model-repo deploy {model} {jar}  --kiji={kiji} ' + \
-        ' --deps-resolver=maven --production-ready=true --model-container={container} ' + \
+        ' {deps} --production-ready=true --model-container={container} ' + \
         ' --message="Initial deployment of model."'
     cmd = cmd_raw.format(
-        model = self._model_name,
+        model = model.name,
         kiji = self._kiji,
-        container = os.path.join(self._work, self._model_container_json),
+        deps = deps,
+        container = os.path.join(self._work, model.container_json),
         jar = os.path.join(self._work, 'empty.jar'),
     )
     self._run_kiji(cmd)
 
     # TODO: Check that we see the appropriate row in the kiji table now?
 
-  def _do_action_repo_fresh(self):
+  def _do_action_repo_fresh(self, model):
     cmd_raw = 'kiji model-repo fresh-model {kiji} {model}-{version} org.kiji.scoring.lib.AlwaysFreshen'
-    cmd = cmd_raw.format(kiji=self._kiji, model=self._model_name, version=self._model_version)
+    cmd = cmd_raw.format(kiji=self._kiji, model=model.name, version=model.version)
 
     self._run_kiji(cmd)
 
+  # ------------------------------------------------------------------------------------------------
+  # Run the per-model steps for all of the models.
+  def _run_model_step(self, model, action, func, *args):
+    """ Run one step for one model, recording how it went.  Return True if it worked. """
+    start = time.time()
+    try:
+      func(*args)
+      self._model_results[model.name][action] = (True, time.time() - start, None)
+      return True
+    except Exception as e:
+      logging.exception("%s failed for model %s" % (action, model.name))
+      self._model_results[model.name][action] = (False, time.time() - start, str(e))
+      return False
+
+  def _is_model_ok(self, model):
+    return all([ok for (ok, _, _) in self._model_results[model.name].values()])
+
+  def _run_r_scripts(self, models):
+    """
+    Run the R script for every model, several at once: either each in its own R CMD BATCH process,
+    or (with --r-workers) in a pool of R processes that stay up between scripts.  Models that share a
+    script only run it once.
+    """
+    scripts = collections.OrderedDict()
+    for model in models:
+      assert model.r_script is not None, "Model %s has no R script" % model.name
+      scripts.setdefault((self._get_project_path(model.r_dir), model.r_script), []).append(model)
+
+    def _run_script(script):
+      (r_dir, r_script) = script
+      start = time.time()
+      try:
+        self._do_action_r_produce_pmml_xml(r_dir, r_script)
+        return (True, time.time() - start, None)
+      except Exception as e:
+        logging.exception("R script %s failed" % os.path.join(r_dir, r_script))
+        return (False, time.time() - start, str(e))
+
+    if self._r_workers > 0:
+      import r_workers
+      r_pool = r_workers.RWorkerPool(self._r_workers, job_timeout=self._r_timeout)
+      try:
+        results = r_pool.run_jobs(list(scripts.keys()))
+      finally:
+        r_pool.close()
+    else:
+      import multiprocessing
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(max(1, min(self._max_parallel_r or multiprocessing.cpu_count(), len(scripts))))
+      try:
+        results = pool.map(script_output.bind(_run_script), list(scripts.keys()))
+      finally:
+        pool.close()
+        pool.join()
+
+    for ((script, script_models), (ok, seconds, error)) in zip(scripts.items(), results):
+      for model in script_models:
+        if ok and not os.path.isfile(os.path.join(self._work, model.pmml_file)):
+          (ok, error) = (False, "%s did not write %s" % (script[1], model.pmml_file))
+        self._model_results[model.name]['r-xml'] = (ok, seconds, error)
+
+  def _deploy_models(self, models, actions):
+    """
+    Run the pmml-wizard / repo-deploy / repo-fresh steps that we were asked for, for every model,
+    with at most --max-parallel-deploy models going at once.  A model stops at its first failure.
+    """
+    action_funcs = collections.OrderedDict([
+        ('pmml-wizard', self._do_action_pmml_wizard),
+        ('repo-deploy', self._do_action_repo_deploy),
+        ('repo-fresh', self._do_action_repo_fresh),
+    ])
+
+    if 'repo-deploy' in actions:
+      self._make_empty_jar()
+      # Resolve dependencies once for the whole batch, rather than in every deploy.
+      if self._batch_deploy:
+        self._deploy_deps = self._get_deploy_deps()
+
+    def _deploy_model(model):
+      for (action, func) in action_funcs.items():
+        if action not in actions or not self._is_model_ok(model):
+          continue
+        self._run_model_step(model, action, func, model)
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(max(1, min(self._max_parallel_deploy, len(models))))
+    try:
+      pool.map(script_output.bind(_deploy_model), models)
+    finally:
+      pool.close()
+      pool.join()
+
+  def _print_model_results(self):
+    """ Print a line for each model with how each step went.  Return True if they all worked. """
+    model_results = collections.OrderedDict()
+    for (name, results) in self._model_results.items():
+      steps = ["%s %s %.1fs" % (action, 'OK' if ok else 'FAILED', seconds)
+          for (action, (ok, seconds, _)) in results.items()]
+      script_output.echo("%-30s %s" % (name, ', '.join(steps)))
+      for (action, (ok, _, error)) in results.items():
+        if not ok:
+          script_output.echo("    %s: %s" % (action, error))
+      model_results[name] = collections.OrderedDict(
+          [(action, {'ok': ok, 'seconds': round(seconds, 3), 'error': error})
+              for (action, (ok, seconds, error)) in results.items()])
+    self._output.set_result('models', model_results)
+    return all([ok for results in self._model_results.values() for (ok, _, _) in results.values()])
+
   def _run_actions(self):
+    run_action = self._output.run_action
 
     self._create_work_dir()
-    self._set_kiji_classpath()
 
     if 'bento-setup' in self._actions:
-      self._do_action_bento_setup()
+      run_action('bento-setup', self._do_action_bento_setup)
 
     self._set_bento_dir()
 
     if 'bento-setup' in self._actions:
       assert self._is_bento_box_running()
 
+    for model in self._models:
+      self._model_results[model.name] = collections.OrderedDict()
+
     if 'r-xml' in self._actions:
-      self._do_action_r_produce_pmml_xml()
+      run_action('r-xml', self._run_r_scripts, self._models)
+
+    if 'restore' in self._actions:
+      run_action('restore', self._do_action_restore)
+      for action in ['kiji-init', 'repo-init']:
+        if action in self._actions:
+          logging.info("Restored from a snapshot, skipping %s" % action)
+          self._actions.remove(action)
+
+    if any([action in self._actions for action in kiji_classpath_actions]):
+      self._set_kiji_classpath()
 
     if 'kiji-init' in self._actions:
-      self._do_action_kiji_init()
+      run_action('kiji-init', self._do_action_kiji_init)
 
     if 'repo-init' in self._actions:
-      self._do_action_repo_init()
+      run_action('repo-init', self._do_action_repo_init)
 
-    if 'scoring-server-init' in self._actions:
-      self._do_action_scoring_server_init()
+    if 'snapshot' in self._actions:
+      run_action('snapshot', self._do_action_snapshot)
 
-    if 'pmml-wizard' in self._actions:
-      self._do_action_pmml_wizard()
+    if 'scoring-server-init' in self._actions:
+      run_action('scoring-server-init', self._do_action_scoring_server_init)
 
-    if 'repo-deploy' in self._actions:
-      self._do_action_repo_deploy()
+    deploy_actions = [a for a in ['pmml-wizard', 'repo-deploy', 'repo-fresh'] if a in self._actions]
+    if len(deploy_actions) > 0:
+      run_action(
+          ' '.join(deploy_actions), self._deploy_models, self._models, deploy_actions)
 
-    if 'repo-fresh' in self._actions:
-      self._do_action_repo_fresh()
+    if any([action in self._actions for action in model_actions]):
+      if not self._print_model_results():
+        sys.exit(1)
 
   def go(self, cmd_line_args):
     self._parse_options(cmd_line_args)
-    self._run_actions()
+    self._output.run(self._run_actions)
 
 if __name__ == "__main__":
   foo = PmmlRunner()
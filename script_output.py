@@ -0,0 +1,194 @@
+#!/usr/bin/env python2.7
+
+"""
+What the scripts tell you about what they did, for people and for other programs.
+
+By default the scripts say what they are up to as they go along (Maven's [INFO] lines, every link
+that they make, ...).  With --quiet they keep the per-item output to themselves.  With --format=json
+they are just as quiet, and when they are done they print a single JSON document on stdout with the
+actions that ran (and how long each one took), the files that they wrote, linked or removed, and
+their other results (e.g., the classpath), so that nothing has to scrape the text.
+
+Code that prints or touches files calls the module-level functions (echo(), add_file(),
+set_result()), which go to whichever script is running.  When one script runs another (e.g.,
+run_pmml.py runs BentoRebooter), the inner one is as quiet as the outer one, and its document goes
+into the outer one's under 'scripts'.  A script that hands work to other threads wraps it with
+bind(), so that the work goes to the script's output even when other scripts are running side by
+side (as in bento_buildd.py).
+
+"""
+
+import collections
+import json
+import sys
+import threading
+import time
+
+output_formats = ['text', 'json']
+
+# ScriptOutputs of the scripts that are running right now (in any thread), outermost first.
+_running = []
+
+# The ScriptOutput that bind() gave the current thread, if any.
+_thread_state = threading.local()
+
+
+def add_arguments(parser):
+  """ Add --format and --quiet to a script's argparse parser. """
+  parser.add_argument(
+      '--format',
+      type=str,
+      choices=output_formats,
+      default='text',
+      help='text: tell the user what is going on.\n'
+          'json: print only a JSON document with the actions run, how long each took, the files\n'
+          'touched and the results, once the script is done. [text]')
+
+  parser.add_argument(
+      '--quiet',
+      action='store_true',
+      default=False,
+      help='Do not print anything for every JAR, link or line of Maven output.')
+
+
+class ScriptOutput(object):
+  """ Collects the result document of one run of a script. """
+
+  def __init__(self, script):
+    super(ScriptOutput, self).__init__()
+    self.output_format = 'text'
+    self.b_quiet = False
+
+    # The script that is running us (if any), and the thread that we are running in.
+    self._parent = None
+    self._thread = None
+
+    self.document = collections.OrderedDict()
+    self.document['script'] = script
+    self.document['ok'] = None
+    self.document['seconds'] = None
+    self.document['actions'] = []
+    # Map from what happened to a file ('written', 'linked', ...) to a list of files.
+    self.document['files'] = collections.OrderedDict()
+    self.document['results'] = collections.OrderedDict()
+
+  def set_options(self, args):
+    """ Take --format and --quiet from the parsed command-line arguments. """
+    self.output_format = args.format
+    self.b_quiet = args.quiet or args.format == 'json'
+
+  def is_quiet(self):
+    """ Quiet if asked to be, or if a script that is running us is. """
+    return self.b_quiet or (self._parent is not None and self._parent.is_quiet())
+
+  def echo(self, line):
+    if not self.is_quiet():
+      print(line)
+
+  def add_file(self, kind, path):
+    self.document['files'].setdefault(kind, []).append(path)
+
+  def set_result(self, key, value):
+    self.document['results'][key] = value
+
+  def run_action(self, action, func, *args):
+    """ Call func, recording the action and how long it took. """
+    entry = collections.OrderedDict([('action', action), ('seconds', None)])
+    self.document['actions'].append(entry)
+    start = time.time()
+    try:
+      return func(*args)
+    finally:
+      entry['seconds'] = round(time.time() - start, 3)
+
+  def run(self, func):
+    """
+    Run a script's actions (func), with this as the output that everything goes to.  Afterwards,
+    print the document (if this is the outermost script, with --format=json), even if func failed.
+    """
+    # Scripts running side by side in other threads are not our parents.
+    parent = _get_current_in_thread() or getattr(_thread_state, 'output', None)
+    self._parent = parent
+    self._thread = threading.current_thread()
+    _running.append(self)
+    start = time.time()
+    try:
+      func()
+      self.document['ok'] = True
+    except SystemExit as e:
+      self.document['ok'] = e.code in (None, 0)
+      raise
+    except BaseException as e:
+      self.document['ok'] = False
+      self.document['error'] = "%s: %s" % (type(e).__name__, e)
+      raise
+    finally:
+      _running.remove(self)
+      self.document['seconds'] = round(time.time() - start, 3)
+      if parent is not None:
+        parent.document.setdefault('scripts', []).append(self.document)
+      elif self.output_format == 'json':
+        self.write_document()
+
+  def write_document(self, out=None):
+    out = sys.stdout if out is None else out
+    out.write(json.dumps(self.document, indent=2) + '\n')
+    out.flush()
+
+
+def _get_current_in_thread():
+  thread = threading.current_thread()
+  for output in reversed(_running):
+    if output._thread is thread:
+      return output
+  return None
+
+def get_current():
+  """
+  The ScriptOutput of the innermost script running in this thread, or else the one that bind() gave
+  this thread.  Failing those (a worker thread that nobody bound), the innermost script running
+  anywhere, as long as only one script is running at the top level.  Otherwise None.
+  """
+  output = _get_current_in_thread() or getattr(_thread_state, 'output', None)
+  if output is None and len([o for o in _running if o._parent is None]) == 1:
+    output = _running[-1]
+  return output
+
+def bind(func):
+  """
+  Wrap func, which is about to run in some other thread (e.g., a thread pool's), so that what it
+  echoes and records goes to the output of the script that is running here.
+  """
+  output = get_current()
+
+  def _run_bound(*args, **kwargs):
+    previous = getattr(_thread_state, 'output', None)
+    _thread_state.output = output
+    try:
+      return func(*args, **kwargs)
+    finally:
+      _thread_state.output = previous
+  return _run_bound
+
+def is_quiet():
+  output = get_current()
+  return output is not None and output.is_quiet()
+
+def echo(line):
+  """ Print a line for the user, unless the script that is running is quiet. """
+  output = get_current()
+  if output is None:
+    print(line)
+  else:
+    output.echo(line)
+
+def add_file(kind, path):
+  """ Record that the script that is running did something ('written', 'linked', ...) to a file. """
+  output = get_current()
+  if output is not None:
+    output.add_file(kind, path)
+
+def set_result(key, value):
+  output = get_current()
+  if output is not None:
+    output.set_result(key, value)
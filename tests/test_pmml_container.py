@@ -0,0 +1,209 @@
+#!/usr/bin/env python2.7
+
+"""
+Tests for pmml_container.py, against model containers from the PMML wizard ('kiji model-repo pmml').
+
+Run from the top of the checkout with 'python -m pytest tests' (or 'python -m unittest discover
+tests').
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pmml_container
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Nested segments to append to the ensemble's header for the large ensemble.
+large_ensemble_segments = 20000
+
+
+def _data_file(name):
+  return os.path.join(data_dir, name)
+
+
+class TestModelContainer(unittest.TestCase):
+  """ make_model_container against the wizard's output for the default (ozone) model. """
+
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp(prefix='test-pmml-container-')
+
+  def tearDown(self):
+    shutil.rmtree(self._tmp_dir)
+
+  def test_ozone_matches_wizard(self):
+    container = pmml_container.make_model_container(
+        pmml_file=_data_file('RegressionOzone.pmml'),
+        pmml_uri='file:///work/RegressionOzone.pmml',
+        table_uri='kiji://localhost:2181/default/ozone',
+        model_name='artifact.ozone_model',
+        model_version='0.0.1',
+        predictor_column='info:predictor',
+        result_column='info:predicted',
+        result_record_name='OzonePredicted')
+    container_file = os.path.join(self._tmp_dir, 'ozone.json')
+    pmml_container.write_model_container(container, container_file)
+    self.assertEqual(
+        [], pmml_container.compare_model_containers(_data_file('ozone.json'), container_file))
+
+  def test_default_result_record_name(self):
+    container = pmml_container.make_model_container(
+        pmml_file=_data_file('RegressionOzone.pmml'),
+        pmml_uri='file:///work/RegressionOzone.pmml',
+        table_uri='kiji://localhost:2181/default/ozone',
+        model_name='artifact.ozone_model',
+        model_version='0.0.1',
+        predictor_column='info:predictor',
+        result_column='info:predicted')
+    schema = container['parameters'][pmml_container.pmml_parameter_prefix + 'result-record-schema']
+    self.assertTrue('"OzoneModelPredicted"' in schema, schema)
+
+  def test_compare_finds_differences(self):
+    container_file = os.path.join(self._tmp_dir, 'ozone.json')
+    f = open(_data_file('ozone.json'))
+    f_out = open(container_file, 'w')
+    f_out.write(f.read().replace('"0.0.1"', '"0.0.2"'))
+    f_out.close()
+    f.close()
+    differences = pmml_container.compare_model_containers(_data_file('ozone.json'), container_file)
+    self.assertEqual(
+        ['/model_version', '/parameters/%smodel-version' % pmml_container.pmml_parameter_prefix],
+        [difference.split(':')[0] for difference in differences])
+
+
+class TestReadPmmlSummary(unittest.TestCase):
+
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp(prefix='test-pmml-container-')
+
+  def tearDown(self):
+    shutil.rmtree(self._tmp_dir)
+
+  def _write(self, name, text):
+    pmml_file = os.path.join(self._tmp_dir, name)
+    f = open(pmml_file, 'w')
+    f.write(text)
+    f.close()
+    return pmml_file
+
+  def test_ozone(self):
+    summary = pmml_container.read_pmml_summary(_data_file('RegressionOzone.pmml'))
+    self.assertEqual('4.1', summary.pmml_version)
+    self.assertEqual('RegressionModel', summary.model_type)
+    self.assertEqual('Linear_Regression_Model', summary.model_name)
+    self.assertEqual('regression', summary.function_name)
+    self.assertEqual(['ozone', 'temp', 'ibh', 'ibt'], list(summary.data_fields.keys()))
+    self.assertEqual(['ozone'], summary.get_predicted_fields())
+    self.assertEqual(['temp', 'ibh', 'ibt'], summary.get_active_fields())
+    self.assertEqual({'Predicted_ozone': None}, dict(summary.output_fields))
+
+  def test_no_namespace(self):
+    # PMML 3.x files from older tools have no namespace.
+    pmml_file = self._write('tree.pmml', '''<?xml version="1.0"?>
+<PMML version="3.2">
+ <DataDictionary>
+  <DataField name="label" optype="categorical" dataType="boolean"/>
+  <DataField name="x" optype="continuous" dataType="float"/>
+ </DataDictionary>
+ <TreeModel modelName="tree" functionName="classification">
+  <MiningSchema>
+   <MiningField name="label" usageType="target"/>
+   <MiningField name="x"/>
+  </MiningSchema>
+  <Node score="true"><True/></Node>
+ </TreeModel>
+</PMML>
+''')
+    summary = pmml_container.read_pmml_summary(pmml_file)
+    self.assertEqual('3.2', summary.pmml_version)
+    self.assertEqual('TreeModel', summary.model_type)
+    self.assertEqual(['label'], summary.get_predicted_fields())
+    # usageType defaults to active.
+    self.assertEqual(['x'], summary.get_active_fields())
+
+    schema = pmml_container.get_result_record_schema(summary, 'TreePredicted')
+    self.assertEqual([{'name': 'label', 'type': 'boolean'}], [dict(f) for f in schema['fields']])
+
+  def test_no_model(self):
+    pmml_file = self._write('empty.pmml', '''<?xml version="1.0"?>
+<PMML version="4.1" xmlns="http://www.dmg.org/PMML-4_1">
+ <DataDictionary/>
+</PMML>
+''')
+    self.assertRaises(AssertionError, pmml_container.read_pmml_summary, pmml_file)
+
+  def test_ensemble_stops_before_model_body(self):
+    # The fixture is cut off partway through the segments, so it only parses if we stop reading
+    # before them.  The segments' own mining schemas must not show up either.
+    summary = pmml_container.read_pmml_summary(_data_file('ensemble_truncated.pmml'))
+    self.assertEqual('MiningModel', summary.model_type)
+    self.assertEqual('churn_forest', summary.model_name)
+    self.assertEqual(['churned'], summary.get_predicted_fields())
+    self.assertEqual(['tenure', 'plan', 'calls'], summary.get_active_fields())
+    self.assertEqual(
+        {'Predicted_churned': 'string', 'Probability_yes': 'double'}, dict(summary.output_fields))
+
+    schema = pmml_container.get_result_record_schema(summary, 'ChurnPredicted')
+    self.assertEqual([
+        {'name': 'churned', 'type': 'string'},
+        {'name': 'Predicted_churned', 'type': 'string'},
+        {'name': 'Probability_yes', 'type': 'double'},
+    ], [dict(f) for f in schema['fields']])
+
+  def test_large_ensemble(self):
+    # Thousands of nested segments after the schema (and still no end to the file): reading the
+    # summary must not depend on the size of the model body.
+    f = open(_data_file('ensemble_truncated.pmml'))
+    ensemble = f.read()
+    f.close()
+    head = ensemble[:ensemble.index('   <Segment id="1">')]
+    first_segment = ensemble[len(head):ensemble.index('   <Segment id="2">')]
+
+    pmml_file = os.path.join(self._tmp_dir, 'large.pmml')
+    f = open(pmml_file, 'w')
+    f.write(head)
+    for _ in range(large_ensemble_segments):
+      f.write(first_segment)
+    f.write('   <Segment')
+    f.close()
+    self.assertTrue(os.path.getsize(pmml_file) > 10 * 1024 * 1024)
+
+    summary = pmml_container.read_pmml_summary(pmml_file)
+    self.assertEqual(['tenure', 'plan', 'calls'], summary.get_active_fields())
+
+
+class TestResultRecordSchema(unittest.TestCase):
+
+  def test_field_types(self):
+    summary = pmml_container.PmmlSummary()
+    summary.data_fields['y'] = 'integer'
+    summary.data_fields['x'] = 'double'
+    summary.mining_fields['y'] = 'predicted'
+    summary.mining_fields['x'] = 'active'
+    # An output field that repeats a predicted field only shows up once, with the output's type.
+    summary.output_fields['y'] = 'float'
+    summary.output_fields['label'] = 'string'
+    summary.output_fields['score'] = None
+    summary.output_fields['when'] = 'dateTime'
+
+    schema = pmml_container.get_result_record_schema(summary, 'YPredicted')
+    self.assertEqual('record', schema['type'])
+    self.assertEqual('YPredicted', schema['name'])
+    self.assertEqual([
+        {'name': 'y', 'type': 'float'},
+        {'name': 'label', 'type': 'string'},
+        # No type anywhere: double, like the wizard.
+        {'name': 'score', 'type': 'double'},
+        # PMML types that Avro does not have become strings.
+        {'name': 'when', 'type': 'string'},
+    ], [dict(f) for f in schema['fields']])
+
+
+if __name__ == '__main__':
+  unittest.main()
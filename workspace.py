@@ -0,0 +1,323 @@
+#!/usr/bin/env python2.7
+
+"""
+State that the scripts share about one root directory (Bento Box tarballs and Kiji checkouts), so
+that a long-running program can drive many operations without redoing the same work each time.
+
+A Workspace owns:
+
+  - The JAR index: where the locally-built Kiji JARs are, and where each Bento Box has its copies
+    of them.  We walk the tree (see jar_discovery.py) once per set of Kiji targets, not once per
+    operation.
+  - The classpath cache: the classpath that Maven gives us for each build directory, until its
+    pom.xml changes.
+  - The process table: the JVMs running on this machine (from jps), and the directories that they
+    run from, so that finding the JVMs of several Bento Boxes in a row takes one jps.
+
+The scripts (bento_reboot.py, make_cassandra_bento.py, run_pmml.py, ...) each take a Workspace, or
+make one from their command-line arguments, and use it instead of finding these things for
+themselves.  E.g., to set up a Bento Box from another program:
+
+  ws = workspace.Workspace('/path/to/root')
+  rebooter = bento_reboot.BentoRebooter(ws)
+  rebooter.configure(['install-bento', 'link-jars', 'run-bento'], link_modules=['scoring'])
+  rebooter.run()
+
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+
+import command_runner
+import jar_discovery
+
+# How long a jps listing stays good for (processes come and go, but not that quickly).
+process_table_max_age = 2.0
+
+
+def get_local_jar_pattern(kiji_target):
+  """ If you are building locally, the JAR should look like <kiji target>-x.y.z-SNAPSHOT.jar """
+  return re.compile(re.escape(kiji_target) + r'-(?P<version>\d+\.\d+\.\d+)-SNAPSHOT\.jar$')
+
+def get_bento_jar_pattern(kiji_target):
+  """
+  A released JAR, <kiji target>-x.y.z.jar (so that we don't mix up, e.g., 'kiji-scoring' and
+  'kiji-scoring-server').
+  """
+  return re.compile(re.escape(kiji_target) + r'-\d+\.\d+\.\d+\.jar$')
+
+def is_in_dir(path, directory):
+  """ True if path is directory or anything below it. """
+  return path == directory or path.startswith(directory + os.sep)
+
+def get_command_line_paths(cmdline):
+  """
+  Return the paths in a command line: its arguments, the parts of classpaths ('a.jar:b.jar') and of
+  options like -Dhadoop.log.dir=/some/dir.
+  """
+  return [path for path in re.split(r'[\s:=,;]+', cmdline) if path.startswith(os.sep)]
+
+def get_build_dir(local_jar):
+  """ The build directory should just be the root directory of this JAR file. """
+  assert os.path.isfile(local_jar)
+  assert local_jar.endswith('.jar')
+
+  target_dir = os.path.dirname(local_jar)
+  assert os.path.isdir(target_dir)
+  assert target_dir.endswith('target')
+
+  dirs = target_dir.split('/')
+  assert dirs[-1] == 'target'
+  build_dir = '/'.join(dirs[:-1])
+  assert os.path.isdir(build_dir)
+  return build_dir
+
+
+class Workspace(object):
+  """ The JAR index, classpath cache and process table for one root directory. """
+
+  def __init__(self, root_dir, scan_cache_file=jar_discovery.default_cache_file, max_depth=None):
+    super(Workspace, self).__init__()
+
+    self.root_dir = os.path.abspath(root_dir)
+    assert os.path.isdir(self.root_dir), self.root_dir
+
+    # Where to remember directory listings between runs (see jar_discovery.py), or None.
+    self.scan_cache_file = scan_cache_file
+
+    # How far below the root (or Bento) directory to look for JARs (None for no limit).
+    self.max_depth = max_depth
+
+    # Map from Kiji target to the local builds of its JAR.
+    self._local_jars = {}
+
+    # Map from Bento directory to a map from Kiji target to its JARs in that Bento Box.
+    self._bento_jars = {}
+
+    # Map from build directory to (mtime of its pom.xml, list of JARs on its classpath).
+    self._classpaths = {}
+
+    # Several threads can share a Workspace (e.g., provisioning Bento Box instances in parallel, or
+    # the requests of bento_buildd.py), so each cache has a lock.  A thread that fills the JAR index
+    # holds its lock while it walks the tree, so that the others wait for its answer rather than
+    # doing the same walk again.  Maven takes much longer, so the classpath cache has a lock for
+    # each build directory (in _classpath_dir_locks) that is held while Maven runs for it, and
+    # _classpaths_lock only guards the maps.
+    self._jars_lock = threading.Lock()
+    self._classpaths_lock = threading.Lock()
+    self._classpath_dir_locks = {}
+
+    # List of (pid, name, cwd, command line) for the running JVMs, and when we listed them.
+    self._processes = None
+    self._processes_time = None
+    self._processes_lock = threading.Lock()
+
+  # ----------------------------------------------------------------------------------------------
+  # The JAR index.
+
+  def get_local_jar(self, kiji_target, other_targets=()):
+    """
+    Return the JAR created by maven for this Kiji target.  Some of the Kiji projects have submodules
+    that may contain the JAR files.  If we have to walk the tree, we look for the JARs of
+    other_targets at the same time.
+    """
+    with self._jars_lock:
+      # A long-running process (bento_buildd.py, watch) can outlive the JARs that it found, e.g.,
+      # after a 'mvn clean' or a version bump, so look again if any of them are gone.
+      if kiji_target not in self._local_jars or \
+          not all([os.path.isfile(jar) for jar in self._local_jars[kiji_target]]):
+        # Only count JARs found within target/ (not within target/something/lib, for example).
+        self._local_jars.pop(kiji_target, None)
+        kiji_targets = [kiji_target] + [t for t in other_targets if t not in self._local_jars]
+        walker = jar_discovery.get_local_build_walker(
+            self.root_dir, self.max_depth, self.scan_cache_file)
+        self._local_jars.update(jar_discovery.find_files(
+            self.root_dir,
+            dict([(t, get_local_jar_pattern(t)) for t in kiji_targets]),
+            walker,
+            dir_name='target'))
+
+      # Hopefully we'll get only one of these!
+      matching_jars = self._local_jars[kiji_target]
+
+    logging.info("Matching JARs for Kiji target " + kiji_target + ":")
+    for jar in sorted(matching_jars):
+      logging.info("\t" + jar)
+
+    assert len(matching_jars) != 0, "Did not find any JARs built by Maven for %s!" % kiji_target
+    assert len(matching_jars) == 1, \
+        "Found multiple potential matches for JARs built by Maven for target %s!\n%s" % \
+            (kiji_target, matching_jars)
+
+    return list(matching_jars)[0]
+
+  def get_bento_jars(self, bento_dir, kiji_target, other_targets=()):
+    """
+    Return the JAR files for this target in a Bento Box (there can be more than one, from Bento
+    redundancies).  If we have to walk the Bento Box, we look for other_targets at the same time.
+    """
+    with self._jars_lock:
+      bento_jars = self._bento_jars.setdefault(os.path.abspath(bento_dir), {})
+      if kiji_target not in bento_jars:
+        kiji_targets = [kiji_target] + [t for t in other_targets if t not in bento_jars]
+        bento_jars.update(jar_discovery.find_files(
+            bento_dir,
+            dict([(t, get_bento_jar_pattern(t)) for t in kiji_targets]),
+            jar_discovery.get_bento_walker(self.max_depth, self.scan_cache_file)))
+      all_jars = bento_jars[kiji_target]
+
+    logging.info("Bento Box JARs found for Kiji target " + kiji_target + ":")
+    for bento_jar in all_jars:
+      logging.info('\t' + bento_jar)
+
+    return all_jars
+
+  def forget_bento_jars(self, bento_dir):
+    """ Call after replacing a Bento Box (e.g., untarring it again), which moves its JARs. """
+    with self._jars_lock:
+      self._bento_jars.pop(os.path.abspath(bento_dir), None)
+
+  def forget_local_jars(self):
+    """ Call after local builds might have moved (e.g., a new checkout). """
+    with self._jars_lock:
+      self._local_jars = {}
+
+  # ----------------------------------------------------------------------------------------------
+  # The classpath cache.
+
+  def _get_pom_mtime(self, build_dir):
+    return os.stat(os.path.join(build_dir, 'pom.xml')).st_mtime
+
+  def _get_missing_classpaths(self, build_dirs):
+    """
+    The build directories whose classpath we do not have (or whose pom.xml has changed).  Call with
+    _classpaths_lock held.
+    """
+    return sorted(set([d for d in build_dirs
+        if d not in self._classpaths or self._classpaths[d][0] != self._get_pom_mtime(d)]))
+
+  def get_classpaths(self, build_dirs, b_single_reactor=False):
+    """
+    Return a map from build directory to the list of JARs that Maven puts on its classpath.  We only
+    run Maven for the build directories whose pom.xml has changed since we last asked, and (with
+    b_single_reactor) run it once for all of them.
+    """
+    # Imported here (like bento_instances below), so that making a Workspace stays cheap for scripts
+    # that only need the JAR index.
+    import bento_classpath
+
+    build_dirs = [os.path.abspath(d) for d in build_dirs]
+
+    # Lock the build directories that we have to run Maven for (in sorted order, so that two
+    # requests cannot each hold a lock that the other one wants), then see which of them another
+    # thread has done in the meantime.
+    with self._classpaths_lock:
+      maybe_missing_dirs = self._get_missing_classpaths(build_dirs)
+      dir_locks = [self._classpath_dir_locks.setdefault(d, threading.Lock())
+          for d in maybe_missing_dirs]
+    for lock in dir_locks:
+      lock.acquire()
+    try:
+      with self._classpaths_lock:
+        missing_dirs = self._get_missing_classpaths(maybe_missing_dirs)
+
+      classpaths = {}
+      bentocp = bento_classpath.BentoClasspath()
+      if b_single_reactor and len(missing_dirs) > 1:
+        # Get all of the classpaths from one Maven invocation.
+        classpaths = bentocp.get_classpaths_for_build_dirs(missing_dirs)
+      else:
+        for build_dir in missing_dirs:
+          logging.info("Getting dependency JARs from %s..." % build_dir)
+          classpaths[build_dir] = bentocp.get_classpath_for_build_dir(build_dir)
+
+      with self._classpaths_lock:
+        for (build_dir, classpath) in classpaths.items():
+          self._classpaths[build_dir] = (self._get_pom_mtime(build_dir), classpath)
+        return dict([(d, self._classpaths[d][1]) for d in build_dirs])
+    finally:
+      for lock in reversed(dir_locks):
+        lock.release()
+
+  def get_dependency_jars(self, local_jars, b_single_reactor=False):
+    """
+    Return a ClasspathSet of the JARs that it takes to build these locally-built JARs (without any
+    of the Kiji stuff).  The first occurrence of a JAR (or of any version of the same Maven
+    artifact) wins.
+    """
+    import bento_classpath
+
+    build_dirs = [os.path.abspath(get_build_dir(local_jar)) for local_jar in local_jars]
+    classpaths = self.get_classpaths(build_dirs, b_single_reactor)
+
+    bentocp = bento_classpath.BentoClasspath()
+    dependency_jars = bento_classpath.ClasspathSet()
+    for build_dir in build_dirs:
+      dependency_jars.update(bentocp.remove_kiji_dependencies(classpaths[build_dir]))
+
+    logging.info("Found %s unique dependencies." % len(dependency_jars))
+    dependency_jars.log_removed()
+    return dependency_jars
+
+  # ----------------------------------------------------------------------------------------------
+  # The process table.
+
+  def get_java_processes(self, directory=None, b_refresh=False):
+    """
+    Return (pid, name) for the running JVMs (other than jps itself), or only those running from (or
+    pointing into) directory.
+    """
+    with self._processes_lock:
+      if b_refresh or self._processes is None or \
+          time.time() - self._processes_time > process_table_max_age:
+        self._processes = self._list_java_processes()
+        self._processes_time = time.time()
+      processes = self._processes
+
+    if directory is None:
+      return [(pid, name) for (pid, name, _, _) in processes]
+    # Compare whole path components, so that .../box1 does not take in the JVMs of .../box10.
+    directory = os.path.abspath(directory)
+    return [(pid, name) for (pid, name, cwd, cmdline) in processes
+        if is_in_dir(cwd, directory) or
+            any([is_in_dir(os.path.normpath(path), directory)
+                for path in get_command_line_paths(cmdline)])]
+
+  def _list_java_processes(self):
+    import bento_instances
+
+    processes = []
+    for line in command_runner.run('jps').splitlines():
+      toks = line.split()
+      if len(toks) == 1: continue
+      assert len(toks) == 2, toks
+      (pid, name) = toks
+      if name == 'Jps': continue
+      (cwd, cmdline) = bento_instances.get_process_dirs(pid)
+      processes.append((pid, name, cwd, cmdline))
+    return processes
+
+  def kill_java_processes(self, directory=None, ports=()):
+    """
+    Stop the JVMs (only those running from directory, if it is set): SIGTERM, then SIGKILL for any
+    that do not exit in time.  Then wait until nothing listens on ports (see process_terminator.py).
+    Return the number of JVMs that we stopped.
+    """
+    import process_terminator
+
+    # Never signal a pid from an old listing, it might belong to something else by now.
+    processes = self.get_java_processes(directory, b_refresh=True)
+    pids = [pid for (pid, _) in processes]
+    process_terminator.terminate(pids, ports)
+    with self._processes_lock:
+      if self._processes is not None:
+        self._processes = [p for p in self._processes if p[0] not in pids]
+    return len(processes)
+
+  def forget_processes(self):
+    """ Call after starting JVMs, so that the next lookup sees them. """
+    with self._processes_lock:
+      self._processes = None